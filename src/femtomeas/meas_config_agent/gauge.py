@@ -16,7 +16,7 @@ from langgraph.store.memory import InMemoryStore
 import os
 import json
 from femtomeas.agent_common.common import *
-from .hadrons_xml import HadronsXML
+from .hadrons_xml import HadronsXML, HadronsXMLTemplate
 from femtomeas.workflow_manager.api_general import listSpecialGlobusEndpoints
 from femtomeas.agent_common.agent_base import parameterAgent
 
@@ -40,17 +40,30 @@ class LoadGauge(BaseModel):
         job_index : The index of the entry in the range, i.e. 0 -> start, 1 -> start+step,  etc
         override_path : Replace the path in which the file resides, e.g. if it was moved prior to execution
         """
-        
+        self._setXMLsingleValues(xml, self.singleConfValues(job_index, override_path))
+
+    def singleConfValues(self, job_index, override_path = None)->dict:
+        """
+        Return the values of the per-configuration XML fields (the gauge file and trajectory counter range) for the placeholders set by setXMLsingleTemplate
+        """
         stub = self.stub
         if override_path != None:
             stub = os.path.join(override_path,  os.path.basename(self.stub) )
         ckpoint_idx = self.start + job_index * self.step
         if ckpoint_idx > self.end:
             raise Exception("Configuration index is out of range")           
+        return { "file" : stub, "traj_start" : ckpoint_idx, "traj_end" : ckpoint_idx+1 }
+
+    def setXMLsingleTemplate(self,xml):
+        """
+        Output the single-configuration XML with placeholders for the per-configuration values; see HadronsXMLTemplate
+        """
+        self._setXMLsingleValues(xml, { k : HadronsXMLTemplate.placeholder(k) for k in ("file", "traj_start", "traj_end") })
         
+    def _setXMLsingleValues(self, xml, values):
         opt = xml.addModule("gauge","MIO::LoadNersc")
-        HadronsXML.setValue(opt, "file", stub)
-        xml.setTrajCounter(ckpoint_idx, ckpoint_idx+1, 1)
+        HadronsXML.setValue(opt, "file", values["file"])
+        xml.setTrajCounter(values["traj_start"], values["traj_end"], 1)
 
         
     def getJobConfigurationsAndSource(self):
@@ -71,6 +84,12 @@ class UnitGauge(BaseModel):
     def setXMLsingle(self,xml,job_index, override_path = None  ):
         self.setXML(xml)
 
+    def singleConfValues(self, job_index, override_path = None)->dict:
+        return {}
+
+    def setXMLsingleTemplate(self,xml):
+        self.setXML(xml)
+
     def getJobConfigurationsAndSource(self):
         """
         Return a list of configuration filenames required for the job and the source endpoint ID. If no actual file is required return a suitable sized list of None for the first argument. If the files are local or no files are required, return None for the second argument.
@@ -89,6 +108,12 @@ class RandomGauge(BaseModel):
     def setXMLsingle(self,xml,job_index, override_path = None  ):
         self.setXML(xml)
 
+    def singleConfValues(self, job_index, override_path = None)->dict:
+        return {}
+
+    def setXMLsingleTemplate(self,xml):
+        self.setXML(xml)
+
     def getJobConfigurationsAndSource(self):
         """
         Return a list of configuration filenames required for the job and the source endpoint ID. If no actual file is required return a suitable sized list of None for the first argument. If the files are local or no files are required, return None for the second argument.
@@ -116,6 +141,18 @@ class GaugeFieldConfig(BaseModel):
         """       
         self.config.setXMLsingle(xml, job_index, override_path)
 
+    def singleConfValues(self, job_index, override_path = None)->dict:
+        """
+        Return the values of the per-configuration fields of the template XML output by setXMLsingleTemplate
+        """
+        return self.config.singleConfValues(job_index, override_path)
+
+    def setXMLsingleTemplate(self,xml):
+        """
+        Output the single-configuration XML with placeholders for the per-configuration values; see HadronsXMLTemplate
+        """
+        self.config.setXMLsingleTemplate(xml)
+
     def getJobConfigurationsAndSource(self):
         """
         Return a list of configuration filenames required for the job and the source endpoint ID. If no actual file is required return a suitable sized list of None for the first argument. If the files are local or no files are required, return None for the second argument.
@@ -1,4 +1,7 @@
 import xml.etree.ElementTree as ET
+import io
+from xml.sax.saxutils import escape
+import re
 
 
 class HadronsXML:
@@ -87,6 +90,15 @@ class HadronsXML:
         ET.indent(self.tree, space="  ")
         self.tree.write(filename, xml_declaration=True)
 
+    def toFileBytes(self):
+        """
+        Return a bytestring encoding of the script identical to the file output by write
+        """
+        ET.indent(self.tree, space="  ")
+        buf = io.BytesIO()
+        self.tree.write(buf, xml_declaration=True)
+        return buf.getvalue()
+        
     def toBytes(self):
         """
         Return a bytestring encoding of the script
@@ -117,3 +129,35 @@ class HadronsXML:
         self.database = _getck(self.parameters,"database")
         self.genetic = _getck(self.parameters,"genetic")
     
+
+
+
+class HadronsXMLTemplate:
+    """
+    A Hadrons XML serialized once with named placeholders standing in for a few per-job values (e.g. the gauge file and trajectory counter).
+    Rendering substitutes the values into the cached bytes, producing output identical to serializing the document with the values set directly
+    """
+    _placeholder_re = re.compile(rb"@@HADRONS_TEMPLATE:(\w+)@@")
+    
+    @staticmethod
+    def placeholder(name):
+        """The text to set in place of the value of the named field"""
+        return f"@@HADRONS_TEMPLATE:{name}@@"
+
+    def __init__(self, xml : HadronsXML):
+        parts = self._placeholder_re.split(xml.toBytes())
+        self.literals = parts[0::2] #the literal segments between the fields
+        self.fields = [ p.decode() for p in parts[1::2] ]
+
+    def render(self, **values)->bytes:
+        """
+        Return the bytestring encoding of the script with the named fields substituted
+        """
+        missing = set(self.fields) - set(values.keys())
+        if len(missing) > 0:
+            raise Exception("Missing values for template fields", missing)
+        out = [ self.literals[0] ]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            out.append( escape(str(values[field])).encode("ascii", "xmlcharrefreplace") ) #match the escaping of ET.tostring
+            out.append(literal)
+        return b"".join(out)
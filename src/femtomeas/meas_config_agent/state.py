@@ -10,7 +10,7 @@ from .solver_config import *
 from .propagator_config import *
 from .gauge import *
 from .eigenvectors import *
-from .hadrons_xml import HadronsXML
+from .hadrons_xml import HadronsXML, HadronsXMLTemplate
 from femtomeas.agent_common.common import Print
 
 def checkpointState(state, filename):
@@ -114,4 +114,20 @@ class State(BaseModel):
         self.gauge.setXMLsingle(xml,job_index,override_path)
         return xml
 
+    def toHadronsXMLsingleConfTemplate(self)->HadronsXMLTemplate:
+        """
+        Build and serialize the single-configuration XML once, with placeholders for the gauge file and trajectory counter.
+        Use toHadronsXMLsingleConfBytes to produce the XML for each configuration
+        """
+        xml=self._toHadronsXMLbase()
+        self.gauge.setXMLsingleTemplate(xml)
+        return HadronsXMLTemplate(xml)
+
+    def toHadronsXMLsingleConfBytes(self,template : HadronsXMLTemplate,job_index,override_path = None )->bytes:
+        """
+        Output the bytestring encoding of the XML for a single configuration, equal to toHadronsXMLsingleConf(job_index, override_path).toBytes()
+        template : The output of toHadronsXMLsingleConfTemplate
+        """
+        return template.render(**self.gauge.singleConfValues(job_index,override_path))
+
     
@@ -0,0 +1,79 @@
+import time
+import threading
+import statistics
+from typing import Callable, Tuple, Any
+
+class AdaptiveWaiter:
+    """
+    Wait on the completion of asynchronous API tasks, polling with exponential backoff.
+    The completion times of previous tasks are recorded per operation (e.g. "filesystem/mkdir") and used to choose the delay before the first poll,
+    such that quick operations are picked up within tens of milliseconds while long ones do not hammer the API
+    """
+    def __init__(self, min_delay=0.02, max_delay=4.0, factor=2.0, timeout=600, history=32):
+        """
+        min_delay: the shortest delay between polls in seconds
+        max_delay: the longest delay between polls in seconds
+        factor: the multiplicative increase in the delay after each unsuccessful poll
+        timeout: the default time in seconds after which waiting is abandoned (None for no limit)
+        history: the number of completion times retained per operation
+        """
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.timeout = timeout
+        self.history = history
+        self._times = {} #op -> list of recent completion times
+        self._lock = threading.Lock()
+
+    def record(self, op : str, elapsed : float):
+        """Record the observed completion time of an operation"""
+        with self._lock:
+            times = self._times.setdefault(op, [])
+            times.append(elapsed)
+            if len(times) > self.history:
+                del times[0]
+
+    def initialDelay(self, op : str)->float:
+        """
+        The delay before the first poll. Without history this is min_delay; otherwise it is a little under the median observed completion time so that the first poll usually lands just after completion
+        """
+        with self._lock:
+            times = self._times.get(op)
+            if not times:
+                return self.min_delay
+            median = statistics.median(times)
+        return min(max(0.8 * median, self.min_delay), self.max_delay)
+
+    def stats(self)->dict:
+        """Return a dict op -> { "count", "median", "max" } summarizing the observed completion times"""
+        with self._lock:
+            return { op : { "count" : len(t), "median" : statistics.median(t), "max" : max(t) } for op, t in self._times.items() if len(t) > 0 }
+
+    def wait(self, op : str, poll : Callable[[], Tuple[bool, Any]], timeout : float | None = -1):
+        """
+        Poll until completion
+        Args:
+           op - The operation name under which completion times are recorded
+           poll - A function returning a tuple (done, result)
+           timeout - The time in seconds after which an exception is raised. Use -1 for the default of this waiter, None for no limit
+        Return:
+           The result of the final poll
+        """
+        if timeout == -1:
+            timeout = self.timeout
+        t0 = time.monotonic()
+        delay = self.initialDelay(op)
+        backoff = self.min_delay #after the tuned first poll, back off from the minimum delay
+        while True:
+            time.sleep(delay)
+            done, result = poll()
+            elapsed = time.monotonic() - t0
+            if done:
+                self.record(op, elapsed)
+                return result
+            if timeout != None and elapsed > timeout:
+                raise Exception(f"Timed out after {elapsed:.1f}s waiting for {op} task to complete")
+            delay = backoff
+            backoff = min(backoff * self.factor, self.max_delay)
+            if timeout != None:
+                delay = min(delay, max(timeout - elapsed, self.min_delay))
@@ -7,17 +7,17 @@ from .logging import wfapiLog
 if globals.api_impl == "IRI":
     #Pure IRI
     print("Using IRI API")
-    from .iri_api import setupWorkflowAgent, remoteLs, remoteMkdir, uploadBytes, executeBatchJobCompat, remoteChmod, getJobState, cancelJob, queryMachineStatus, globusTransferStatus, globusCopyToMachine, globusCopyFromMachine, getUserAccountProjects, getKnownMachines, getMachineQueues, downloadFile, listSpecialGlobusEndpoints
+    from .iri_api import setupWorkflowAgent, remoteLs, remoteMkdir, uploadBytes, executeBatchJobCompat, remoteChmod, getJobState, getJobStates, cancelJob, queryMachineStatus, globusTransferStatus, globusCopyToMachine, globusCopyFromMachine, getUserAccountProjects, getKnownMachines, getMachineQueues, downloadFile, listSpecialGlobusEndpoints, remoteRm
 elif globals.api_impl == "IRI_SF_HYBRID":
     #IRI with SFAPI for Globus transfers (NERSC only)    
     print("Using IRI/SFAPI hybrid")
-    from .iri_api import setupWorkflowAgent, remoteLs, remoteMkdir, uploadBytes, executeBatchJobCompat, remoteChmod, getJobState, cancelJob, queryMachineStatus, globusTransferStatus, globusCopyToMachine, globusCopyFromMachine, getUserAccountProjects, getKnownMachines, getMachineQueues, remoteRun, downloadFile, listSpecialGlobusEndpoints
+    from .iri_api import setupWorkflowAgent, remoteLs, remoteMkdir, uploadBytes, executeBatchJobCompat, remoteChmod, getJobState, getJobStates, cancelJob, queryMachineStatus, globusTransferStatus, globusCopyToMachine, globusCopyFromMachine, getUserAccountProjects, getKnownMachines, getMachineQueues, remoteRun, downloadFile, listSpecialGlobusEndpoints, remoteRm
 elif globals.api_impl == "SF":
     print("Using Superfacility API")
-    from .sfapi import setupWorkflowAgent, remoteLs, remoteMkdir, uploadBytes, executeBatchJob, getJobState, cancelJob, queryMachineStatus, globusTransferStatus, globusCopyToMachine, globusCopyFromMachine, listSpecialGlobusEndpoints
+    from .sfapi import setupWorkflowAgent, remoteLs, remoteMkdir, uploadBytes, executeBatchJob, getJobState, getJobStates, cancelJob, queryMachineStatus, globusTransferStatus, globusCopyToMachine, globusCopyFromMachine, listSpecialGlobusEndpoints, remoteRm, downloadFile
 elif globals.api_impl == "SPOOF":
     print("Using Spoof API")
-    from .spoof_api import setupWorkflowAgent, remoteMkdir, uploadBytes, executeBatchJobCompat, getJobState, globusTransferStatus, globusCopyToMachine, globusCopyFromMachine, queryMachineStatus, getUserAccountProjects, getKnownMachines, getMachineQueues, remoteRun, downloadFile, listSpecialGlobusEndpoints
+    from .spoof_api import setupWorkflowAgent, remoteMkdir, uploadBytes, executeBatchJobCompat, getJobState, getJobStates, globusTransferStatus, globusCopyToMachine, globusCopyFromMachine, queryMachineStatus, getUserAccountProjects, getKnownMachines, getMachineQueues, remoteRun, downloadFile, listSpecialGlobusEndpoints, remoteRm
 else:
     raise Exception("Unknown API implementation")
 
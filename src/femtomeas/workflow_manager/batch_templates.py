@@ -0,0 +1,156 @@
+import re
+from pathlib import Path
+
+class BatchScriptTemplate:
+    """
+    A batch script parsed once into literal segments and named fields written as {{name}}, such that rendering is a single join.
+    Other text, including bash ${VAR} expansions and braces, is passed through unchanged
+    """
+    _placeholder_re = re.compile(r"\{\{(\w+)\}\}")
+
+    def __init__(self, text : str):
+        parts = self._placeholder_re.split(text)
+        self.literals = [ p.encode() for p in parts[0::2] ] #the literal segments between the fields
+        self.fields = parts[1::2]
+
+    @classmethod
+    def fromFile(cls, filename : str):
+        return cls(Path(filename).expanduser().read_text())
+
+    def render(self, **values)->bytes:
+        """
+        Return the script with the named fields substituted, encoded as bytes
+        """
+        missing = set(self.fields) - set(values.keys())
+        if len(missing) > 0:
+            raise Exception("Missing values for batch script template fields", missing)
+        out = [ self.literals[0] ]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            out.append(str(values[field]).encode())
+            out.append(literal)
+        return b"".join(out)
+
+#Fields common to the job and pack templates:
+#  queue, account, nodes, time, log, env, bin, grid, mpi, ranks, bind, plus the machine parameters below (overridable per machine with template_params)
+#  guard - the lines, each newline-terminated, by which a job submitted with an idempotency token exits if it was superseded (see hadrons.submissionGuard); empty otherwise
+#Job template: run_dir
+#Pack template: count, mode, run_nodes, runs
+_perlmutter_job = """#!/bin/bash
+#SBATCH -q {{queue}}
+#SBATCH -C gpu
+#SBATCH -A {{account}}
+#SBATCH --ntasks-per-node={{ranks_per_node}}
+#SBATCH --exclusive
+#SBATCH --gpus-per-task=1
+#SBATCH -N {{nodes}}
+#SBATCH -t {{time}}
+#SBATCH -o {{log}}
+
+now=$(date)
+echo "Hadrons job started at ${now}"
+{{guard}}
+BIND="{{bind}}"
+export MPICH_OFI_NIC_POLICY=GPU
+
+#Hadrons uses an SQLite database that has I/O failures on Lustre. We need to actually run in a temporary directory then move everything back
+SCRATCH_DIR=${SCRATCH}/${SLURM_JOB_ID}
+mkdir -p ${SCRATCH_DIR}
+cd ${SCRATCH_DIR}
+
+cat <<EOF > wrap.sh
+#!/bin/bash
+export CUDA_VISIBLE_DEVICES=\\${SLURM_LOCALID}
+echo "Rank \\${SLURM_PROCID}, local rank \\${SLURM_LOCALID} : visible devices \\${CUDA_VISIBLE_DEVICES}"
+cd ${SCRATCH_DIR}
+\\$*
+EOF
+
+chmod u+x wrap.sh
+{{env}}
+
+srun -c {{cpus_per_task}} --gpu-bind=none ${BIND} -n {{ranks}} ./wrap.sh {{bin}}/HadronsXmlRun {{run_dir}}/run.xml --mpi {{mpi}} --grid {{grid}} --accelerator-threads {{threads}} --shm {{shm}} --device-mem {{device_mem}} --threads {{threads}} --log Iterative,Message,Error,Warning,Performance --comms-overlap --comms-concurrent --shm-mpi 1
+mv ${SCRATCH_DIR}/* {{run_dir}}/
+cd {{run_dir}}
+rmdir ${SCRATCH_DIR}
+now=$(date)
+echo "Hadrons job completed at ${now}"
+"""
+
+_perlmutter_pack = """#!/bin/bash
+#SBATCH -q {{queue}}
+#SBATCH -C gpu
+#SBATCH -A {{account}}
+#SBATCH --ntasks-per-node={{ranks_per_node}}
+#SBATCH --exclusive
+#SBATCH --gpus-per-task=1
+#SBATCH -N {{nodes}}
+#SBATCH -t {{time}}
+#SBATCH -o {{log}}
+
+now=$(date)
+echo "Hadrons pack of {{count}} {{mode}} runs started at ${now}"
+{{guard}}
+BIND="{{bind}}"
+export MPICH_OFI_NIC_POLICY=GPU
+
+#Hadrons uses an SQLite database that has I/O failures on Lustre. We need to actually run in temporary directories then move everything back
+SCRATCH_BASE=${SCRATCH}/${SLURM_JOB_ID}
+mkdir -p ${SCRATCH_BASE}
+
+cat <<EOF > ${SCRATCH_BASE}/wrap.sh
+#!/bin/bash
+export CUDA_VISIBLE_DEVICES=\\${SLURM_LOCALID}
+echo "Rank \\${SLURM_PROCID}, local rank \\${SLURM_LOCALID} : visible devices \\${CUDA_VISIBLE_DEVICES}"
+cd \\$1
+shift
+\\$*
+EOF
+
+chmod u+x ${SCRATCH_BASE}/wrap.sh
+{{env}}
+
+#Run a single member of the pack. Args: job index, job run directory
+runHadrons() {
+  local dir=${SCRATCH_BASE}/$1
+  mkdir -p ${dir}
+  echo "Job $1 started at $(date)"
+  srun -N {{run_nodes}} -c {{cpus_per_task}} --gpu-bind=none ${BIND} -n {{ranks}} ${SCRATCH_BASE}/wrap.sh ${dir} {{bin}}/HadronsXmlRun $2/run.xml --mpi {{mpi}} --grid {{grid}} --accelerator-threads {{threads}} --shm {{shm}} --device-mem {{device_mem}} --threads {{threads}} --log Iterative,Message,Error,Warning,Performance --comms-overlap --comms-concurrent --shm-mpi 1 > $2/run.log 2>&1
+  local rc=$?
+  mv ${dir}/* $2/
+  rmdir ${dir}
+  echo ${rc} > $2/exit_code
+  echo "Job $1 completed with exit code ${rc} at $(date)"
+  return ${rc}
+}
+
+FAILED=0
+{{runs}}
+
+rm ${SCRATCH_BASE}/wrap.sh
+rmdir ${SCRATCH_BASE}
+now=$(date)
+echo "Hadrons pack completed at ${now}"
+if [ ${FAILED} -ne 0 ]; then
+  exit 1
+fi
+"""
+
+#Named sets of batch script templates: name -> { "job" : template, "pack" : template or None, "params" : default machine parameters }
+#bind is the CPU binding used when whole nodes are allocated (ranks >= ranks_per_node)
+batch_templates = { "perlmutter" : { "job" : BatchScriptTemplate(_perlmutter_job),
+                                     "pack" : BatchScriptTemplate(_perlmutter_pack),
+                                     "params" : { "ranks_per_node" : 4, "cpus_per_task" : 32, "threads" : 8, "shm" : 3072, "device_mem" : 15360,
+                                                  "bind" : "--cpu-bind=verbose,map_ldom:3,2,1,0" } } }
+
+def registerBatchTemplates(name : str, job : BatchScriptTemplate, pack : BatchScriptTemplate | None = None, params : dict | None = None):
+    """
+    Add a named set of batch script templates, e.g. for a new machine
+    Args:
+       job - The template for a single Hadrons run
+       pack - The template for a pack of runs (see hadrons.submitHadronsPack), or None if packs are not supported
+       params - Default values of the machine parameters, which must include ranks_per_node
+    """
+    params = {} if params == None else dict(params)
+    if "ranks_per_node" not in params:
+        raise Exception("Batch script template parameters must include ranks_per_node")
+    batch_templates[name] = { "job" : job, "pack" : pack, "params" : params }
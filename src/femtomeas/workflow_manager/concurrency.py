@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from typing import Callable, List
+
+def boundedMap(func : Callable, items : list, max_workers : int = 8, key : Callable | None = None, max_per_key : int | None = None, return_exceptions = False)->list:
+    """
+    Apply func to each item concurrently over a bounded thread pool, returning the results in the order of the input items
+    Args:
+       func - The function to apply to each item
+       items - The list of items
+       max_workers - The maximum number of concurrent calls
+       key - If provided, a function mapping an item to a key (e.g. the machine name) under which the number of concurrent calls is limited to max_per_key
+       max_per_key - The maximum number of concurrent calls sharing the same key (None for no limit)
+       return_exceptions - If True, exceptions raised by func are returned in place of the result; otherwise the first exception is re-raised once all calls have finished
+    """
+    if len(items) == 0:
+        return []
+
+    limits = {}
+    if key != None and max_per_key != None:
+        for item in items:
+            limits.setdefault(key(item), threading.BoundedSemaphore(max_per_key))
+
+    def _call(item):
+        sem = limits.get(key(item)) if len(limits) > 0 else None
+        try:
+            if sem != None:
+                sem.acquire()
+            return func(item)
+        except Exception as e:
+            return e
+        finally:
+            if sem != None:
+                sem.release()
+
+    if max_workers <= 1 or len(items) == 1:
+        results = [ _call(item) for item in items ]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+            results = list(pool.map(_call, items))
+
+    if not return_exceptions:
+        for r in results:
+            if isinstance(r, Exception):
+                raise r
+    return results
@@ -0,0 +1,118 @@
+import sqlite3
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Any
+from .logging import wfapiLog
+
+#Lifetimes in seconds of the cached responses of API discovery calls, by endpoint: (ttl, stale_ttl)
+#Within ttl the cached value is used as is; within a further stale_ttl it is used while being refreshed in the background; beyond that it is refreshed before use
+discovery_ttl = { "status/resources" : (24*3600, 7*24*3600),
+                  "account/projects" : (6*3600, 7*24*3600) }
+default_ttl = (3600, 24*3600)
+
+def defaultCacheFile()->str:
+    """The default location of the cache, overridable with the FEMTOMEAS_DISCOVERY_CACHE environment variable"""
+    return os.getenv("FEMTOMEAS_DISCOVERY_CACHE", str(Path("~/.femtomeas/discovery_cache.db").expanduser()))
+
+class DiscoveryCache:
+    """
+    A persistent cache of the responses of API discovery calls (resource IDs, projects, etc), keyed by machine and endpoint, such that
+    restarts of the manager, GUI sessions and agent validation do not repeat them
+    """
+    def __init__(self, filename : str | None = None):
+        """
+        filename: the SQLite database file; if None the cache is held in memory
+        """
+        self._lock = threading.Lock()
+        self._revalidating = set()
+        db_path = ":memory:"
+        if filename != None:
+            try:
+                Path(filename).expanduser().parent.mkdir(parents=True, exist_ok=True)
+                db_path = str(Path(filename).expanduser())
+            except OSError as e:
+                wfapiLog(f"Could not create discovery cache at {filename} ({e}), using an in-memory cache")
+        self.filename = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA busy_timeout = 5000")
+        with self.conn as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS discovery_cache (
+            machine TEXT NOT NULL,
+            endpoint TEXT NOT NULL,
+            value TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (machine, endpoint)
+            )
+            """)
+
+    def _read(self, machine, endpoint):
+        with self._lock, self.conn as conn:
+            row = conn.execute("SELECT value, fetched_at FROM discovery_cache WHERE machine = ? AND endpoint = ?", (machine, endpoint)).fetchone()
+        return None if row == None else (json.loads(row[0]), row[1])
+
+    def _store(self, machine, endpoint, value):
+        with self._lock, self.conn as conn:
+            conn.execute("INSERT OR REPLACE INTO discovery_cache(machine, endpoint, value, fetched_at) VALUES (?,?,?,?)", (machine, endpoint, json.dumps(value), time.time()))
+
+    def _revalidate(self, machine, endpoint, fetch):
+        key = (machine, endpoint)
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def _run():
+            try:
+                self._store(machine, endpoint, fetch())
+            except Exception as e:
+                wfapiLog(f"Background refresh of {machine}:{endpoint} failed: {e}")
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+        threading.Thread(target=_run, daemon=True).start()
+
+    def get(self, machine : str, endpoint : str, fetch : Callable[[], Any], force_refresh = False):
+        """
+        Return the cached value for the endpoint on the machine, calling fetch to obtain it if it is missing or expired. The value must be JSON-serializable
+        force_refresh: fetch the value regardless of the cache state, e.g. if the cached value was found to be wrong
+        """
+        ttl, stale_ttl = discovery_ttl.get(endpoint, default_ttl)
+        cached = None if force_refresh else self._read(machine, endpoint)
+        if cached != None:
+            value, fetched_at = cached
+            age = time.time() - fetched_at
+            if age < ttl:
+                return value
+            if age < ttl + stale_ttl:
+                self._revalidate(machine, endpoint, fetch)
+                return value
+
+        value = fetch()
+        self._store(machine, endpoint, value)
+        return value
+
+    def invalidate(self, machine : str | None = None, endpoint : str | None = None):
+        """Remove cached entries matching the machine and/or endpoint (all entries if both are None)"""
+        with self._lock, self.conn as conn:
+            conn.execute("DELETE FROM discovery_cache WHERE (? IS NULL OR machine = ?) AND (? IS NULL OR endpoint = ?)", (machine, machine, endpoint, endpoint))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def getDiscoveryCache()->DiscoveryCache:
+    """Return the process-wide discovery cache, opening it at the default location on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache == None:
+            _cache = DiscoveryCache(defaultCacheFile())
+        return _cache
+
+def setDiscoveryCacheFile(filename : str | None):
+    """Use the given file for the process-wide discovery cache (None for an in-memory cache)"""
+    global _cache
+    with _cache_lock:
+        _cache = DiscoveryCache(filename)
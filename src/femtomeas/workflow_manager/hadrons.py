@@ -1,10 +1,11 @@
 import os
-import tempfile
 from femtomeas.meas_config_agent.hadrons_xml import HadronsXML
 from .api_general import *
 from typing import Literal, Union, List, Optional, Tuple
 from . import globals
 from .utils import checkSafePath
+from .batch_templates import BatchScriptTemplate, batch_templates, registerBatchTemplates
+from .retry_policy import scaleWalltime
 
 hadrons_info = None
 
@@ -14,8 +15,12 @@ def setHadronsInfo(hadrons_info_ : dict):
     Args:
        hadrons_info_ : dict    machine_name -> {
                                                  "bin" : "/path/to/hadrons/bin/dir",
-                                                 "env" (optional) : "Command line instructions to set up environment, e.g.  module load hadrons" }
+                                                 "env" (optional) : "Command line instructions to set up environment, e.g.  module load hadrons",
+                                                 "template" (optional) : "The name of a set of batch script templates (see batch_templates), or the path of a job script template file. Default: the machine name in lower case",
+                                                 "pack_template" (optional) : "For a template file, the path of the pack script template file",
+                                                 "template_params" (optional) : { "param" : value }  overrides of the machine parameters of the template, e.g. shm, device_mem }
                                                }
+    Template files are parsed here, once
     """
     for m in hadrons_info_.keys():
         if m not in globals.remote_workdir:
@@ -24,11 +29,29 @@ def setHadronsInfo(hadrons_info_ : dict):
             raise Exception("Bin dir must be provided")
         if "env" not in hadrons_info_[m]:
             hadrons_info_[m]["env"] = ""
+        if hadrons_info_[m].get("template") == None:
+            hadrons_info_[m]["template"] = m.lower()
+        name = hadrons_info_[m]["template"]
+        if name not in batch_templates:
+            if not os.path.isfile(os.path.expanduser(name)):
+                raise Exception(f"Batch script template {name} for machine {m} is neither a known template nor a file")
+            pack_file = hadrons_info_[m].get("pack_template")
+            registerBatchTemplates(name, BatchScriptTemplate.fromFile(name), None if pack_file == None else BatchScriptTemplate.fromFile(pack_file),
+                                   hadrons_info_[m].get("template_params"))
+        params = dict(batch_templates[name]["params"])
+        params.update(hadrons_info_[m].get("template_params") or {})
+        hadrons_info_[m]["params"] = params
+        machine_ranks_per_node[m] = int(params["ranks_per_node"])
     global hadrons_info
     hadrons_info = hadrons_info_
         
 
-def validateHadronsXML(machine: str, hadrons_xml_file : str) -> bool:
+def validateHadronsXML(machine: str, hadrons_xml : str | bytes) -> bool:
+    """
+    Check a Hadrons XML with the remote HadronsXmlValidate
+    Args:
+       hadrons_xml - The XML file contents as bytes, or the path of a local XML file
+    """
     if hadrons_info == None:
         raise Exception("Must run setHadronsInfo")
     if machine not in hadrons_info.keys():
@@ -39,7 +62,10 @@ def validateHadronsXML(machine: str, hadrons_xml_file : str) -> bool:
     remoteMkdirUnsafe(machine, scratch_dir)
     
     tmp_file = scratch_dir + "/hadrons_validate.xml"
-    uploadSmallFile(machine, tmp_file, hadrons_xml_file)
+    if isinstance(hadrons_xml, bytes):
+        uploadBytes(machine, tmp_file, io.BytesIO(hadrons_xml))
+    else:
+        uploadSmallFile(machine, tmp_file, hadrons_xml)
     ret = remoteRun(machine,  f'{ hadrons_info[machine]["env"] }; { hadrons_info[machine]["bin"] }/HadronsXmlValidate { tmp_file }').strip().split('\n')
 
     if "Application valid" in ret[-1]:
@@ -48,48 +74,84 @@ def validateHadronsXML(machine: str, hadrons_xml_file : str) -> bool:
         print(ret)
         return False
 
-def defaultRankGeom(ranks : int, grid : Tuple[int,int,int,int]):
-    #rem = ranks
-    # mu = 0
-    # 
-    # while(rem % 2 != 1):
-    #     grid[mu] *= 2
-    #     rem = rem // 2
-    #     mu = (mu + 1) % 4
-    # grid[mu] *= rem
-
-    rem = ranks
-    geom = [1,1,1,1]
-    grid_rem = list(grid)
-    while(rem % 2 != 1):
-        #Find a grid direction divisible by 2 and that has the smallest number of ranks in that direction
-        smu=None
-        for mu in range(4):
-            if grid_rem[mu] % 2 == 0 and ( True if smu == None else geom[mu] < geom[smu] ):
-                smu = mu
-        if smu == None:
-            raise Exception(f"Remaining ranks is {rem} but remaining grid {grid_rem} has no directions divisible by 2")
-        
-        geom[smu] *= 2
-        grid_rem[smu] = grid_rem[smu] // 2        
-        rem = rem // 2
+#The number of MPI ranks (one per GPU) placed on each node, by machine; updated from the batch script templates by setHadronsInfo
+machine_ranks_per_node = { "Perlmutter" : 4 }
 
-    smu = None
-    for mu in range(4):
-        if grid_rem[mu] % rem == 0 and ( True if smu == None else geom[mu] < geom[smu] ):
-            smu = mu
-    if smu == None:
-        raise Exception(f"Remaining ranks is {rem} but remaining grid {grid_rem} has no directions divisible by it")
-    geom[smu] *= rem
-    grid_rem[smu] = grid_rem[smu] // rem
-   
-    prod = 1    
+#Relative cost per face site of a halo exchange between ranks on the same node (NVLink) and on different nodes (network)
+intra_node_link_cost = 1.
+inter_node_link_cost = 4.
+
+def haloCost(geom : Tuple[int,int,int,int], grid : Tuple[int,int,int,int], ranks_per_node : int = 4, Ls : int = 1)->float:
+    """
+    Estimate the halo-exchange cost of a rank geometry, as the largest over ranks of the face sites sent to its neighbors in each partitioned direction,
+    weighted by whether the neighbor is on the same node. Ranks are assigned to nodes in consecutive blocks of ranks_per_node in lexicographic order of
+    their coordinates with x fastest, as in Grid
+    Args:
+       geom - The number of ranks in each direction
+       grid - The global lattice size
+       ranks_per_node - The number of ranks on each node
+       Ls - The size of the (undecomposed) fifth dimension for domain wall fermions, which multiplies the face sizes
+    """
+    local = [ grid[mu] // geom[mu] for mu in range(4) ]
+    vol = Ls
     for mu in range(4):
-        prod *= geom[mu]
-        assert geom[mu] * grid_rem[mu] == grid[mu]
-        
-    assert(prod == ranks)
-    
+        vol *= local[mu]
+    stride = [1,1,1,1]
+    for mu in range(1,4):
+        stride[mu] = stride[mu-1] * geom[mu-1]
+    ranks = stride[3] * geom[3]
+
+    worst = 0.
+    for r in range(ranks):
+        node = r // ranks_per_node
+        cost = 0.
+        for mu in range(4):
+            if geom[mu] == 1:
+                continue
+            face = vol // local[mu]
+            x = (r // stride[mu]) % geom[mu]
+            for d in (1,-1):
+                nbr = r + ( (x + d) % geom[mu] - x ) * stride[mu]
+                cost += face * (intra_node_link_cost if nbr // ranks_per_node == node else inter_node_link_cost)
+        worst = max(worst, cost)
+    return worst
+
+def rankGeometries(ranks : int, grid : Tuple[int,int,int,int], ranks_per_node : int = 4, Ls : int = 1)->List[Tuple[Tuple[int,int,int,int], float]]:
+    """
+    Enumerate the factorizations of the number of ranks over the four lattice directions that divide the lattice evenly, ranked by increasing halo-exchange cost (see haloCost)
+    Geometries leaving an odd local extent in any direction are incompatible with red-black checkerboarding and are only considered if no other geometry exists
+    Return: a list of (geometry, cost)
+    """
+    def _factorizations(rem, mu):
+        if mu == 3:
+            if grid[3] % rem == 0:
+                yield (rem,)
+            return
+        for n in range(1, rem+1):
+            if rem % n == 0 and grid[mu] % n == 0:
+                for tail in _factorizations(rem // n, mu+1):
+                    yield (n,) + tail
+
+    geoms = list(_factorizations(ranks, 0))
+    even = [ g for g in geoms if all( (grid[mu] // g[mu]) % 2 == 0 for mu in range(4) ) ]
+    if len(even) > 0:
+        geoms = even
+
+    #Ties are broken in favor of partitioning the slower directions, keeping the x direction local for vectorization
+    ranked = [ (g, haloCost(g, grid, ranks_per_node, Ls)) for g in geoms ]
+    ranked.sort(key=lambda gc: (gc[1], gc[0]))
+    return ranked
+
+def defaultRankGeom(ranks : int, grid : Tuple[int,int,int,int], ranks_per_node : int = 4, Ls : int = 1):
+    """
+    Choose the rank geometry with the lowest halo-exchange cost (see rankGeometries)
+    Return: the geometry and the local lattice size
+    """
+    ranked = rankGeometries(ranks, grid, ranks_per_node, Ls)
+    if len(ranked) == 0:
+        raise Exception(f"{ranks} ranks cannot be distributed evenly over lattice {grid}")
+    geom = list(ranked[0][0])
+    grid_rem = [ grid[mu] // geom[mu] for mu in range(4) ]
     return geom, grid_rem
 
 def sizesToGridArgList(sizes : List[int]):
@@ -101,8 +163,57 @@ def sizesToGridArgList(sizes : List[int]):
         out = out + f".{sizes[i]}"
     return out
 
+def renderBatchScript(machine : str, kind : Literal["job","pack"], ranks : int, **values)->bytes:
+    """
+    Render the batch script of the given kind from the machine's templates
+    Args:
+       ranks - The number of MPI ranks of each run
+       values - The values of the job-specific template fields
+    """
+    info = hadrons_info[machine]
+    template = batch_templates[info["template"]][kind]
+    if template == None:
+        raise Exception(f"Batch script template {info['template']} of machine {machine} does not support {kind} scripts")
+    params = dict(info["params"])
+    if ranks < int(params["ranks_per_node"]):
+        params["bind"] = "" #Entire node must be allocated for the CPU binding
+    return template.render(env=info["env"], bin=info["bin"], ranks=ranks, **params, **values)
+
+def submissionGuard(run_dir : str, token : str | None)->str:
+    """
+    The batch script lines by which a submission made with an idempotency token runs only once its receipt (see writeSubmissionReceipt) names that token.
+    A job whose submission was interrupted before the receipt was written, and which was therefore submitted again, exits without running
+    """
+    if token == None:
+        return ""
+    receipt = f"{run_dir}/submission"
+    return f"""for i in $(seq 120); do [ -f {receipt} ] && break; sleep 1; done
+if [ "$(cut -d' ' -f1 {receipt} 2>/dev/null)" != "{token}" ]; then
+  echo "Submission {token} was superseded, exiting"
+  exit 0
+fi
+"""
+
+def writeSubmissionReceipt(machine : str, run_dir : str, token : str, jobid : str):
+    """Record the batch job id of the submission made with the given idempotency token in the run directory"""
+    uploadBytes(machine, f"{run_dir}/submission", io.BytesIO(f"{token} {jobid}\n".encode()))
+
+def readSubmissionReceipt(machine : str, run_dir : str, token : str)->str | None:
+    """
+    Return the batch job id of the submission made with the given idempotency token, or None if its receipt was not written (the submission was not made or was interrupted)
+    """
+    try:
+        receipt = downloadFile(machine, f"{run_dir}/submission")
+    except Exception as e:
+        wfapiLog(f"Could not read the submission receipt in {machine}:{run_dir}: {e}")
+        return None
+    fields = (receipt or "").split()
+    if len(fields) == 2 and fields[0] == token:
+        return fields[1]
+    return None
+
 def submitHadronsJob(machine: str,
-                     hadrons_xml_file : str,
+                     hadrons_xml : str | bytes,
                      job_run_dir : str,
                      account : str,
                      queue : str,
@@ -110,8 +221,17 @@ def submitHadronsJob(machine: str,
                      grid : Tuple[int, int, int, int], 
                      mpi : Tuple[int, int, int, int] | None = None, 
                      ranks = None,
-                     delete_xml_after_upload = False
+                     delete_xml_after_upload = False,
+                     token : str | None = None
                      ):
+    """
+    Submit a Hadrons run as a batch job
+    Args:
+       hadrons_xml - The XML file contents as bytes, which are uploaded directly, or the path of a local XML file
+       delete_xml_after_upload - For an XML file, remove it once uploaded
+       token - If not None, an idempotency token: the job id is recorded with it in the run directory (see readSubmissionReceipt) and the job runs only if it is the recorded submission
+    Return: the batch job id
+    """
     if hadrons_info == None:
         raise Exception("Must run setHadronsInfo")
     if machine not in hadrons_info.keys():
@@ -126,82 +246,109 @@ def submitHadronsJob(machine: str,
             if grid[mu] % mpi[mu] != 0:
                 raise Exception(f"Global lattice size {grid[mu]} in direction {mu} does not divide evenly over {mpi[mu]} ranks")
     elif mpi == None:
-        mpi = defaultRankGeom(ranks, grid)
+        mpi, _ = defaultRankGeom(ranks, grid, machine_ranks_per_node.get(machine, 4))
 
     if not checkSafePath(machine, job_run_dir):
         raise Exception(f"Provided job path {job_run_dir} is not in the sandbox")
 
     remoteMkdir(machine, job_run_dir)
-    uploadSmallFile(machine, f"{job_run_dir}/run.xml", hadrons_xml_file)
-
-    if delete_xml_after_upload:
-        os.remove(hadrons_xml_file)        
+    if isinstance(hadrons_xml, bytes):
+        uploadBytes(machine, f"{job_run_dir}/run.xml", io.BytesIO(hadrons_xml))
+    else:
+        uploadSmallFile(machine, f"{job_run_dir}/run.xml", hadrons_xml)
+        if delete_xml_after_upload:
+            os.remove(hadrons_xml)
     
     grid_str = sizesToGridArgList(grid)
     mpi_str = sizesToGridArgList(mpi)
 
-    ###################################
-    if machine == "Perlmutter":
-        if ranks < 4:
-            bind="" #Entire node must be allocated for verbose,map_ldom
-        else:
-            bind = "--cpu-bind=verbose,map_ldom:3,2,1,0"
-            
-        nodes = (ranks + 3) // 4
-        script=f"""#!/bin/bash
-#SBATCH -q {queue}
-#SBATCH -C gpu
-#SBATCH -A {account}
-#SBATCH --ntasks-per-node=4
-#SBATCH --exclusive
-#SBATCH --gpus-per-task=1
-#SBATCH -N {nodes}
-#SBATCH -t {time}
-#SBATCH -o {job_run_dir}/run.log
-
-now=$(date)        
-echo "Hadrons job started at ${{now}}"
-        
-BIND="{bind}"
-export MPICH_OFI_NIC_POLICY=GPU
+    ranks_per_node = machine_ranks_per_node.get(machine, 4)
+    nodes = (ranks + ranks_per_node - 1) // ranks_per_node
+    script = renderBatchScript(machine, "job", ranks, queue=queue, account=account, nodes=nodes, time=time, log=f"{job_run_dir}/run.log",
+                              grid=grid_str, mpi=mpi_str, run_dir=job_run_dir, guard=submissionGuard(job_run_dir, token))
 
-#Hadrons uses an SQLite database that has I/O failures on Lustre. We need to actually run in a temporary directory then move everything back        
-SCRATCH_DIR=${{SCRATCH}}/${{SLURM_JOB_ID}}
-mkdir -p ${{SCRATCH_DIR}}        
-cd ${{SCRATCH_DIR}}
-        
-cat <<EOF > wrap.sh
-#!/bin/bash
-export CUDA_VISIBLE_DEVICES=\\${{SLURM_LOCALID}}  
-echo "Rank \\${{SLURM_PROCID}}, local rank \\${{SLURM_LOCALID}} : visible devices \\${{CUDA_VISIBLE_DEVICES}}"
-cd ${{SCRATCH_DIR}}
-\\$*
-EOF
-        
-chmod u+x wrap.sh
-{ hadrons_info[machine]["env"] }
-        
-srun -c 32 --gpu-bind=none ${{BIND}} -n {ranks} ./wrap.sh { hadrons_info[machine]["bin"] }/HadronsXmlRun {job_run_dir}/run.xml --mpi {mpi_str} --grid {grid_str} --accelerator-threads 8 --shm 3072 --device-mem 15360 --threads 8 --log Iterative,Message,Error,Warning,Performance --comms-overlap --comms-concurrent --shm-mpi 1
-mv ${{SCRATCH_DIR}}/* {job_run_dir}/
-cd {job_run_dir}        
-rmdir ${{SCRATCH_DIR}}
-now=$(date)
-echo "Hadrons job completed at ${{now}}"
-"""
-    #######################################
-        
     remote_script_path = f"{job_run_dir}/batch_script.sh"
-    
-    fd, tmp_path = tempfile.mkstemp(prefix="batch_script_", text=True, dir="/tmp", suffix=".sh")
-    print("submitHadronsJob staging batch script through temporary file",tmp_path)
-    with os.fdopen(fd, 'w') as f:    
-        f.write(script)
+    uploadBytes(machine, remote_script_path, io.BytesIO(script))
 
-    uploadSmallFile(machine, remote_script_path, tmp_path)
-
-    if os.path.exists(tmp_path):
-        os.remove(tmp_path)
-        
     #return executeBatchJob(machine, remote_script_path)
-    return executeBatchJobCompat(machine, f"source {remote_script_path}", nodes=nodes, ranks_per_node=4, gpus_per_rank=1,
-                                 time=time, queue=queue, account=account, job_run_dir=job_run_dir, exclusive=True, allow_unsafe=False)
+    jobid = executeBatchJobCompat(machine, f"source {remote_script_path}", nodes=nodes, ranks_per_node=ranks_per_node, gpus_per_rank=1,
+                                  time=time, queue=queue, account=account, job_run_dir=job_run_dir, exclusive=True, allow_unsafe=False)
+    if token != None:
+        writeSubmissionReceipt(machine, job_run_dir, token, jobid)
+    return jobid
+
+
+def submitHadronsPack(machine: str,
+                      members : List[Tuple[int, str, bytes]],
+                      pack_run_dir : str,
+                      account : str,
+                      queue : str,
+                      time : str,
+                      grid : Tuple[int, int, int, int],
+                      mpi : Tuple[int, int, int, int],
+                      mode : Literal["sequential","concurrent"] = "sequential",
+                      token : str | None = None
+                      ):
+    """
+    Submit several Hadrons runs (e.g. one per configuration) as a single batch job, paying the queue wait and node allocation overhead once
+    Args:
+       members - A list of tuples (job index, job run directory, XML file contents as bytes). The output of each run is placed in its run directory, with the Hadrons log in run.log and the exit code in exit_code
+       pack_run_dir - The directory in which the batch script and log of the pack are placed
+       time - The duration of a single run, as a number of seconds or as [hh:]mm:ss
+       mode - "sequential" : the runs execute one after another as separate srun steps over the same nodes, and the job time is scaled by the number of runs
+              "concurrent" : the allocation is split between the runs, which execute simultaneously each on its own nodes
+       token - If not None, an idempotency token recorded with the job id in pack_run_dir; see submitHadronsJob
+    Return: the batch job id. The job fails if any of the runs fails
+    """
+    if hadrons_info == None:
+        raise Exception("Must run setHadronsInfo")
+    if machine not in hadrons_info.keys():
+        raise Exception("Invalid machine")
+    if mode not in ("sequential","concurrent"):
+        raise Exception(f"Unknown pack mode {mode}")
+    if len(members) == 0:
+        raise Exception("Pack has no members")
+
+    ranks = 1
+    for mu in range(4):
+        ranks *= mpi[mu]
+        if grid[mu] % mpi[mu] != 0:
+            raise Exception(f"Global lattice size {grid[mu]} in direction {mu} does not divide evenly over {mpi[mu]} ranks")
+
+    for job_run_dir in [ pack_run_dir ] + [ m[1] for m in members ]:
+        if not checkSafePath(machine, job_run_dir):
+            raise Exception(f"Provided job path {job_run_dir} is not in the sandbox")
+
+    remoteMkdir(machine, pack_run_dir)
+    for _, job_run_dir, xml_bytes in members:
+        remoteMkdir(machine, job_run_dir)
+        uploadBytes(machine, f"{job_run_dir}/run.xml", io.BytesIO(xml_bytes))
+
+    grid_str = sizesToGridArgList(grid)
+    mpi_str = sizesToGridArgList(mpi)
+
+    ranks_per_node = machine_ranks_per_node.get(machine, 4)
+    run_nodes = (ranks + ranks_per_node - 1) // ranks_per_node
+    if mode == "sequential":
+        nodes = run_nodes
+        pack_time = scaleWalltime(time, len(members)) #the time may be given as a number or as [hh:]mm:ss
+        runs = "\n".join(f"runHadrons {job_id} {job_run_dir} || FAILED=1" for job_id, job_run_dir, _ in members)
+    else:
+        nodes = run_nodes * len(members)
+        pack_time = time
+        runs = "\n".join(f"runHadrons {job_id} {job_run_dir} &" for job_id, job_run_dir, _ in members) + """
+for pid in $(jobs -p); do
+  wait ${pid} || FAILED=1
+done"""
+
+    script = renderBatchScript(machine, "pack", ranks, queue=queue, account=account, nodes=nodes, time=pack_time, log=f"{pack_run_dir}/run.log",
+                              grid=grid_str, mpi=mpi_str, count=len(members), mode=mode, run_nodes=run_nodes, runs=runs, guard=submissionGuard(pack_run_dir, token))
+
+    remote_script_path = f"{pack_run_dir}/batch_script.sh"
+    uploadBytes(machine, remote_script_path, io.BytesIO(script))
+
+    jobid = executeBatchJobCompat(machine, f"source {remote_script_path}", nodes=nodes, ranks_per_node=ranks_per_node, gpus_per_rank=1,
+                                  time=pack_time, queue=queue, account=account, job_run_dir=pack_run_dir, exclusive=True, allow_unsafe=False)
+    if token != None:
+        writeSubmissionReceipt(machine, pack_run_dir, token, jobid)
+    return jobid
@@ -1,6 +1,6 @@
 from typing import Tuple
 from femtomeas.meas_config_agent.state import State
-from .manager import JobManager, TransferToAction, TransferFromAction, HadronsComputeAction, HadronsJobSpec
+from .manager import JobManager, TransferToAction, TransferFromAction, HadronsComputeAction, HadronsJobSpec, ANY_MACHINE
 from . import globals
 from .logging import wfmanLog
 
@@ -19,12 +19,17 @@ from langchain.agents.structured_output import ToolStrategy, ProviderStrategy
 from langchain.agents import create_agent
 from langchain.agents.middleware import before_model, after_model, AgentState
 import json
+import uuid
+import hashlib
+import posixpath
+from datetime import datetime
 from femtomeas.agent_common.common import getUserInput, provideInformationToUser, queryYesNo, prettyPrintPydantic, Print as AgentPrint, Input as AgentInput
 from femtomeas.agent_common.agent_base import parameterAgent
 from femtomeas.workflow_manager.api_general import getKnownMachines, getUserAccountProjects, getMachineQueues, listSpecialGlobusEndpoints
 
 from langchain.tools import tool
-from .hadrons import defaultRankGeom
+from .hadrons import defaultRankGeom, machine_ranks_per_node
+from .perf_model import getPerfModel, workloadKey
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.runtime import Runtime
 
@@ -45,45 +50,96 @@ def enqueueStandardHadronsWorkflow(state : State, jman : JobManager,
                             mpi : Tuple[int,int,int,int],
                             machine : str, group_name : str,
                             account: str, queue : str, time : str,
-                            stage_out: Tuple[str,str] | None = None
+                            stage_out: Tuple[str,str] | None = None,
+                            pack_size : int = 1,
+                            pack_mode : Literal["sequential","concurrent"] = "sequential",
+                            use_config_cache : bool = False,
+                            priority : int | None = None,
+                            weight : float | None = None,
+                            deadline : float | None = None
                             ):
     """
     stage_out : If not None, provide a tuple containing the destination Globus endpoint and a path. Files will be placed in subdirectories of that path labeled by the job index
+    pack_size : If >1, the compute stages of up to this many configurations are bundled into a single batch job. Each configuration retains its own job entry and run directory
+    pack_mode : For packed jobs, whether the configurations run one after another ("sequential", the job time is scaled accordingly) or simultaneously over a split allocation ("concurrent")
+    use_config_cache : If True, remote configurations are staged into a cache directory in the sandbox shared by all job groups, and are not transferred again while present.
+                       The manager must be given a cache size bound (config_cache_bytes). Cached copies are identified by their source endpoint and path only: if a source file
+                       is replaced at the same path, call JobManager.invalidateConfigCache or the stale copy is used
+    machine : If ANY_MACHINE, each workflow is assigned a machine when it starts by the placement policy of the manager, and paths are expressed relative to the <SANDBOX> placeholder.
+              The account and queue are those used unless the policy overrides them for the chosen machine. Packing is not supported
+    priority : If not None, the scheduling priority of the job group; groups of higher priority are started first (see JobData.setJobGroup)
+    weight : If not None, the share of the active workflow slots given to the job group relative to other groups of the same priority
+    deadline : If not None, the time (seconds since the epoch) by which the job group should be complete; groups with a deadline are started earliest deadline first
     """
     
     configs, source_uuid = state.gauge.getJobConfigurationsAndSource()
     grid = state.gauge.getGrid()
     
-    if machine not in globals.remote_workdir:
+    if machine == ANY_MACHINE:
+        if pack_size > 1:
+            raise Exception("Packed workflows cannot be placed on ANY_MACHINE")
+        sandbox = "<SANDBOX>"
+    elif machine not in globals.remote_workdir:
         raise Exception(f"Unknown machine {machine}")
+    else:
+        sandbox = globals.remote_workdir[machine]
     
-    job_dir = globals.remote_workdir[machine] + f"/{group_name}/<JOBID>"
-    cfg_staging_dir = globals.remote_workdir[machine] + f"/{group_name}/configurations"
+    job_dir = sandbox + f"/{group_name}/<JOBID>"
+    cfg_staging_dir = sandbox + f"/{group_name}/configurations"
+
+    def _stagingDir(config):
+        if not use_config_cache:
+            return cfg_staging_dir
+        #One cache directory per source directory, such that the file names (and hence the Hadrons gauge file stub) are preserved
+        source_dir = posixpath.dirname(config)
+        return sandbox + "/config_cache/" + hashlib.sha256(f"{source_uuid}:{source_dir}".encode()).hexdigest()[:16]
 
     wfmanLog("enqueueStandardHadronsWorkflow is queueing",len(configs),"configurations:", configs)
+
+    #The stage-out action is common to all configurations and is stored once
+    stage_out_action = None
+    if stage_out:
+        stage_out_action = TransferFromAction(machine=machine, source_path=job_dir, dest_endpoint=stage_out[0], dest_path=stage_out[1])
+    
+    #Build the workflows before taking the manager lock such that the manager thread is blocked only for the database insert
+    #The XML is serialized once and only the gauge file and trajectory counter are substituted per configuration
+    xml_template = state.toHadronsXMLsingleConfTemplate()
+    pack_prefix = f"{group_name}/{uuid.uuid4().hex[:8]}" #distinguish packs of different enqueue calls with the same group name
+    workflows = []
     for i in range(len(configs)):
         workflow = []
 
         #If the configs are remote they will need to staged in
         override_cfgpath = None
         if source_uuid != None and configs[i] != None:
-            action = TransferToAction(source_endpoint=source_uuid, source_path=configs[i], machine=machine, dest_path=cfg_staging_dir)
+            staging_dir = _stagingDir(configs[i])
+            action = TransferToAction(source_endpoint=source_uuid, source_path=configs[i], machine=machine, dest_path=staging_dir, cached=use_config_cache)
             workflow.append(action)
-            override_cfgpath = cfg_staging_dir
+            override_cfgpath = staging_dir
 
-        xml = state.toHadronsXMLsingleConf(i, override_path = override_cfgpath)
-        spec = HadronsJobSpec(job_rundir=job_dir, xml=xml, grid=grid)
+        xml_spec = state.toHadronsXMLsingleConfBytes(xml_template, i, override_path = override_cfgpath)
+        spec = HadronsJobSpec.fromBytes(job_rundir=job_dir, xml_spec=xml_spec, grid=grid)
 
+        pack = {}
+        if pack_size > 1:
+            pack_idx = i // pack_size
+            pack = { "pack_key" : f"{pack_prefix}/{pack_idx}", "pack_size" : min(pack_size, len(configs) - pack_idx*pack_size), "pack_mode" : pack_mode }
         workflow.append(
-            HadronsComputeAction(machine=machine, account=account, queue=queue, time=time, spec=spec, mpi=mpi)
+            HadronsComputeAction(machine=machine, account=account, queue=queue, time=time, spec=spec, mpi=mpi, **pack)
             )
 
-        if stage_out:
-            workflow.append(TransferFromAction(machine=machine, source_path=job_dir, dest_endpoint=stage_out[0], dest_path=stage_out[1])) 
-            
-            
-        with jman as jd:
-            jd.enqueueJob(workflow, group_name)
+        if stage_out_action:
+            workflow.append(stage_out_action)
+        workflows.append(workflow)
+
+    if len(workflows) == 0:
+        return None
+    with jman as jd:
+        if priority != None or weight != None or deadline != None:
+            jd.setJobGroup(group_name, priority=priority, weight=weight, deadline=deadline)
+        first, last = jd.enqueueJobs(workflows, group_name)
+    wfmanLog(f"enqueueStandardHadronsWorkflow queued jobs {first}-{last}")
+    return first, last
 
 @tool
 def agentGetKnownMachines() -> List[str]:
@@ -135,14 +191,33 @@ def getLatticeSize()->Tuple[int,int,int,int]:
 @tool
 def getDefaultRankGeometry(ranks : int)->Tuple[int,int,int,int]:
     """
-    Compute a suitable MPI decomposition given a specific total number of MPI ranks.
+    Compute the MPI decomposition with the lowest communication cost given a specific total number of MPI ranks.
 
     Args:
        ranks: The total number of MPI ranks to use
     """
-    geom, _ = defaultRankGeom(ranks, state_.gauge.getGrid())
+    #Halo exchanges of domain wall fermion fields scale with the largest Ls in use
+    Ls = max( [ a.action.Ls for a in (state_.actions or []) if a.action.type == "DWF" ], default=1 )
+    geom, _ = defaultRankGeom(ranks, state_.gauge.getGrid(), Ls=Ls)
     return geom
-  
+
+@tool
+def recommendJobSize(machine : str, max_duration : int | None = None)->dict | str:
+    """
+    Recommend the number of nodes, MPI rank decomposition and job time for this job on a machine, based on the measured performance of previous jobs with the same action and solver.
+
+    Args:
+       machine: The name of the machine
+       max_duration: If not None, the longest acceptable job time in seconds, e.g. the limit of the queue
+
+    Return: a dictionary with the recommended "nodes", "rank_geom" and "walltime_seconds", and the "predicted_seconds" run time, or a message if no recommendation is possible
+    """
+    action, solver = workloadKey(state_.toHadronsXML().toBytes())
+    rec = getPerfModel().recommend(machine, state_.gauge.getGrid(), action, solver, max_walltime=max_duration,
+                                   ranks_per_node=machine_ranks_per_node.get(machine, 4))
+    if rec == None:
+        return f"No performance records are available on {machine} for action {action} and solver {solver}"
+    return rec
 
 class JobSubmissionParameters(BaseModel):
     """Parameters for Job submission"""
@@ -153,6 +228,9 @@ class JobSubmissionParameters(BaseModel):
     rank_geom: Tuple[int,int,int,int] = Field(..., description="The MPI rank decomposition of the lattice. The four integers indicate the number of ranks in the x,y,z,t directions, respectively. The total number of ranks is the product of these four numbers.")
     job_group: str = Field(...,description="A name to assign this collection of jobs.")
     copy_out: Tuple[str,str] | None = Field(...,description="A tuple containing 1) the Globus endpoint UUID and 2) the base path, for copying out results to a remote machine. Use None if and only if the user specifies that they don't want to copy out the results.")
+    priority: int | None = Field(None, description="The scheduling priority of this job group. Job groups of higher priority are started before those of lower priority; groups of equal priority share the machine fairly. Use None to keep the current priority of the group (0 for a new group).")
+    weight: PositiveFloat | None = Field(None, description="The share of the machine given to this job group relative to other groups of equal priority, e.g. 2 for twice the share of a group of weight 1. Use None to keep the current weight of the group (1 for a new group).")
+    deadline: str | None = Field(None, description="The date and time by which the jobs should be complete, in ISO 8601 format (e.g. 2026-11-01T18:00). Use None if the user has no deadline.")
 
     def check(self):       
         if self.machine not in getKnownMachines():
@@ -161,6 +239,11 @@ class JobSubmissionParameters(BaseModel):
             return (False, f"Account {self.account} not in list of available accounts: {getUserAccountProjects(self.machine)}")
         elif self.queue not in (queues := [ q[0] for q in getMachineQueues(self.machine) ] ):
             return (False, f"Queue {self.queue} not in list of available queues: {queues}")
+        elif self.deadline != None:
+            try:
+                datetime.fromisoformat(self.deadline)
+            except ValueError:
+                return (False, f"Deadline {self.deadline} is not an ISO 8601 date/time")
         return (True, "")
         
         
@@ -191,7 +274,8 @@ def hadronsSubmissionAgent(state : State, jman : JobManager, model):
     role = "gathering information from the user for submitting a collection of batch jobs to American Science Cloud (AmSC) compute resources via the IRI API (a REST API for controlling the compute resources)"
     
     tool_rules = [
-        "For getDefaultRankGeometry, the number of MPI ranks input to this tool must be that explicitly specified by the user. Never assume or guess a number of ranks"
+        "For getDefaultRankGeometry, the number of MPI ranks input to this tool must be that explicitly specified by the user. Never assume or guess a number of ranks",
+        "Only call recommendJobSize if the user asks for a recommendation of the job size or duration, and only after the machine is known. Present its recommendation to the user for confirmation; never apply it without their agreement"
         ]
     parameter_rules = [
 """rank_geom:
@@ -214,6 +298,7 @@ def hadronsSubmissionAgent(state : State, jman : JobManager, model):
     Never start this workflow unless the user has explicitly asked for help choosing the decomposition.""",
 
 """duration:
+  - Mention that, once the machine is known, you can recommend a job time (and number of nodes) from the measured performance of previous jobs.
   - if the user provides a value in any unit other than seconds (e.g. minutes, hours, etc), convert the user's response to seconds then output the value in seconds and explain that you converted to seconds on a separate line before your next question
     For example
       "You:  What is the duration of each run? You can answer in any unit.
@@ -239,14 +324,31 @@ f"""copy_out:
       If the user says no:
       - set copy_out to None
     
-  Note that we also accept special UUIDs {listSpecialGlobusEndpoints()} in place of regular ID strings."""
+  Note that we also accept special UUIDs {listSpecialGlobusEndpoints()} in place of regular ID strings.""",
+
+"""priority:
+  - In your response, on a separate line before your question, explain that job groups of higher priority are started first when the number of active workflows is limited, and that groups of equal priority share the available slots. The default is 0.
+  - If the user does not want to set a priority, set priority to None.
+""",
+
+"""weight:
+  - In your response, on a separate line before your question, explain that groups of equal priority share the available slots in proportion to their weights. The default is 1.
+  - If the user does not want to set a weight, set weight to None.
+""",
+
+"""deadline:
+  - Ask the user if the jobs must be complete by a particular date and time. If they do not, set deadline to None.
+  - Convert the user's answer to ISO 8601 format (e.g. 2026-11-01T18:00) and state the converted value in your response.
+"""
   ]
 
     tools = [agentGetKnownMachines,agentGetUserAccounts,
              getLatticeSize,getDefaultRankGeometry,
-             agentGetMachineQueues]
+             agentGetMachineQueues,recommendJobSize]
 
     obj = parameterAgent(model, JobSubmissionParameters, role, tools, tool_rules, parameter_rules)  
     
     AgentPrint("Submitting job to workflow manager...")
-    enqueueStandardHadronsWorkflow(state, jman, obj.rank_geom, obj.machine, obj.job_group, obj.account, obj.queue, str(obj.duration), obj.copy_out)
+    deadline = datetime.fromisoformat(obj.deadline).timestamp() if obj.deadline != None else None
+    enqueueStandardHadronsWorkflow(state, jman, obj.rank_geom, obj.machine, obj.job_group, obj.account, obj.queue, str(obj.duration), obj.copy_out,
+                                   priority=obj.priority, weight=obj.weight, deadline=deadline)
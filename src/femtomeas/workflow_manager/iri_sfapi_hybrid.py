@@ -1,6 +1,5 @@
 from authlib.integrations.requests_client import OAuth2Session
 from authlib.oauth2.rfc7523 import PrivateKeyJWT
-import httpx
 from . import  globals
 import json
 from typing import Literal, Union, List, Optional, Tuple
@@ -13,6 +12,10 @@ from pathlib import Path
 import globus_sdk
 from globus_sdk.exc import GlobusAPIError
 from .utils import checkSafePath
+from .adaptive_wait import AdaptiveWaiter
+from .transport import getTransport
+from .token_manager import ManagedToken
+from .discovery_cache import getDiscoveryCache
 from .logging import wfapiLog, wfapiUserQuery
 
 known_machines = {  "Perlmutter" :
@@ -22,7 +25,24 @@ known_machines = {  "Perlmutter" :
                       "sfapi_machine_name" : "perlmutter",
                       "queues" : [ ("debug", "max time 0.5 hours, max nodes 8"), ("regular", "use for standard, production jobs or those too large for debug") ]
                      } }
-tokens = { "iriapi_base" : None, "sfapi_base" : None }  #index tokens by their base path
+tokens = { "iriapi_base" : None, "sfapi_base" : None }  #index tokens by their base path; values are ManagedToken instances once set up
+
+def manageToken(base, auth_data, refresh, on_refresh = None):
+    """
+    Place an access token under management such that it is refreshed in the background ahead of its expiry and renewed if a request is rejected as unauthorized
+    Args:
+       base - The base path key in the tokens dict
+       auth_data - The token data
+       refresh - A function taking the current token data and returning new token data (or None on failure)
+       on_refresh - Called with the new token data after a refresh, e.g. to save it
+    """
+    old = tokens.get(base)
+    if isinstance(old, ManagedToken):
+        old.stop()
+    tok = ManagedToken(base, auth_data, refresh, on_refresh)
+    tok.start()
+    tokens[base] = tok
+
 
 def listSpecialGlobusEndpoints():
     return ["dtn","hpss","perlmutter"]
@@ -79,10 +99,10 @@ def setupSFapi(key_path):
             raise Exception("Unable to fetch token; response was", tok)
 
         global sfapi_client
-        sfapi_client = httpx.Client()
+        sfapi_client = getTransport() #pooled, retrying HTTP transport shared with the other API backends
 
-        global tokens
-        tokens['sfapi_base'] = sfapi_session.fetch_token()['access_token']
+        #Client-credential tokens are simply re-fetched
+        manageToken('sfapi_base', sfapi_session.fetch_token(), lambda ad: sfapi_session.fetch_token())
         
 
 ############################################################
@@ -190,7 +210,8 @@ def setupIRIapi(key_path):
     wfapiLog(f"Saved token data to {key_path}")
     wfapiLog(f"Granted scopes: {auth_data.get('scope', '')}")
 
-    tokens['iriapi_base'] = auth_data['access_token']
+    manageToken('iriapi_base', auth_data, lambda ad: refresh_tokens(client, ad["refresh_token"]) if ad.get("refresh_token") else None,
+                on_refresh=lambda ad: save_tokens(Path(key_path), ad))
     
     
 ################################################
@@ -218,31 +239,27 @@ def get(machine, suburl, params = None, base='iriapi_base'):
 
     token = tokens[base]
     base_path = known_machines[machine][base]
-    resp = sfapi_client.get(base_path + '/' + suburl, headers={ "accept" : "application/json", "Authorization" : f"Bearer {token}" }, params=params, timeout=300  )
+    resp = sfapi_client.get(base_path + '/' + suburl, token=token, suburl=suburl, params=params)
     if resp.status_code == 200:
         j = json.loads(resp.text)
         return j
     else:
         raise Exception(f"Get operation failed with code {resp.status_code} and text {resp.text}")
         
-iri_api_project_map = {}
+def _fetchProjectMap(machine):
+    j = get(machine, "account/projects")
+    pmap = dict()
+    for acct in j:
+        pmap[acct['name']] = acct['id']
+    return pmap
 
 def getUserProjectIDmap(machine):
     """
-    Obtain the mapping between project name and id
+    Obtain the mapping between project name and id. The result is held in the persistent discovery cache
     Return:
        dict name -> id
     """
-    global iri_api_project_map
-
-    if machine not in iri_api_project_map:
-        j = get(machine, "account/projects")
-        pmap = dict()
-        for acct in j:
-            pmap[acct['name']] = acct['id']
-        iri_api_project_map[machine] = pmap
-    
-    return iri_api_project_map[machine]
+    return getDiscoveryCache().get(machine, "account/projects", lambda: _fetchProjectMap(machine))
 
 def getKnownMachines():
     return list(known_machines.keys())
@@ -271,46 +288,46 @@ def getUserAccountProjects(machine):
 
 
 
-iri_api_resource_map = {}
+def _fetchResourceMap(machine):
+    wfapiLog("Obtaining resource information for machine",machine)
+    j = get(machine, "status/resources", params={"group" : known_machines[machine]['iriapi_group'], "resource_type" : "compute"})
+
+    rmap = dict()
+    #The API does not distinguish between login and compute nodes; both are "compute" resources, but the login node does not have any capabilities listed (unclear if this will change)
+    #For now, use the capabilities to distinguish as the names are likely arbitrary
+    compute = None
+    login=None
+    for r in j:
+        cpu = False
+        gpu =False
+        for cap in r['capability_uris']:
+            if 'capabilities/cpu' in cap:
+                cpu = True
+            if 'capabilities/gpu' in cap:
+                gpu = True
+        if cpu and gpu:
+            wfapiLog(f"Identified resource {json.dumps(r,indent=2)} as compute backend")
+            rmap["compute"] = r["id"]
+        elif not cpu and not gpu:
+            wfapiLog(f"Identified resource {json.dumps(r,indent=2)} as login frontend")
+            rmap["login"] = r["id"]
+        else:
+            wfapiLog(f"Warning: unidentified resource {json.dumps(r,indent=2)}")
+    return rmap
 
 def getResourceID(machine, rtype="compute"):
     """
-    Get the resource ID associated with the resource
+    Get the resource ID associated with the resource. The resource map is held in the persistent discovery cache
     rtype: "compute" or "login"
     """
-    global iri_api_resource_map
     if rtype not in ["compute","login"]:
         raise Exception("Invalid resource type")
-    
-    if machine not in iri_api_resource_map:
-        wfapiLog("Obtaining resource information for machine",machine)
-        j = get(machine, "status/resources", params={"group" : known_machines[machine]['iriapi_group'], "resource_type" : "compute"})
-        
-        iri_api_resource_map[machine] = dict()
-            
-        #The API does not distinguish between login and compute nodes; both are "compute" resources, but the login node does not have any capabilities listed (unclear if this will change)
-        #For now, use the capabilities to distinguish as the names are likely arbitrary
-        compute = None
-        login=None
-        for r in j:
-            cpu = False
-            gpu =False
-            for cap in r['capability_uris']:
-                if 'capabilities/cpu' in cap:
-                    cpu = True
-                if 'capabilities/gpu' in cap:
-                    gpu = True
-            if cpu and gpu:
-                wfapiLog(f"Identified resource {json.dumps(r,indent=2)} as compute backend")
-                iri_api_resource_map[machine]["compute"] = r["id"]
-            elif not cpu and not gpu:
-                wfapiLog(f"Identified resource {json.dumps(r,indent=2)} as login frontend")
-                iri_api_resource_map[machine]["login"] = r["id"]
-            else:
-                wfapiLog(f"Warning: unidentified resource {json.dumps(r,indent=2)}")
-        
-    
-    return iri_api_resource_map[machine][rtype]
+
+    rmap = getDiscoveryCache().get(machine, "status/resources", lambda: _fetchResourceMap(machine))
+    if rtype not in rmap:
+        #The cached map may predate a change of resources
+        rmap = getDiscoveryCache().get(machine, "status/resources", lambda: _fetchResourceMap(machine), force_refresh=True)
+    return rmap[rtype]
 
 
 def queryMachineStatus(machine: str, rtype="compute")-> bool:
@@ -328,12 +345,21 @@ def queryMachineStatus(machine: str, rtype="compute")-> bool:
     return j['current_status'] == 'up'
     
 
-def waitTask(machine, task_id, poll_freq=4):
-    j = get(machine, f"task/{task_id}")
-    
-    while(j['status'] == "active"):
-        time.sleep(poll_freq)
+#Adaptive polling of asynchronous tasks; tune e.g. task_waiter.timeout or task_waiter.max_delay as required
+task_waiter = AdaptiveWaiter()
+
+def waitTask(machine, task_id, op = "task", timeout = -1):
+    """
+    Wait for an asynchronous task to finish, polling with an adaptive exponential backoff
+    Args:
+       op - The name of the operation that spawned the task, e.g. "filesystem/mkdir". Completion times are tracked per operation to tune the initial poll delay
+       timeout - The time in seconds after which an exception is raised. Use -1 for the default of task_waiter, None for no limit
+    """
+    def _poll():
         j = get(machine, f"task/{task_id}")
+        return j['status'] != "active", j
+
+    j = task_waiter.wait(op, _poll, timeout)
 
     if j['status'] != "completed":
         raise Exception(f"Task not completed, response {json.dumps(j,indent=2)}")
@@ -360,7 +386,7 @@ def remoteLs(machine: str, path: str)-> List[str]:
 
     j = get(machine, f"filesystem/ls/{rid}", params={"path" : path})
     tid = j['task_id']
-    j = waitTask(machine, tid)
+    j = waitTask(machine, tid, op="filesystem/ls")
 
     files = [ f['name'] for f in j['result']['output'] ]
     return files
@@ -373,9 +399,7 @@ def put(machine, suburl, data = None, params=None):
     
     token = tokens['iriapi_base']   
     base_path = known_machines[machine]['iriapi_base']
-    headers={ "accept" : "application/json", "Authorization" : f"Bearer {token}" }
-    
-    resp = sfapi_client.put(base_path + '/' + suburl, headers=headers, json=data, params=params, timeout=300)
+    resp = sfapi_client.put(base_path + '/' + suburl, token=token, suburl=suburl, json=data, params=params)
     return json.loads(resp.text), resp.status_code
 
 
@@ -392,7 +416,7 @@ def remoteChmod(machine: str, path : str, mode : str, allow_unsafe = False) -> b
     rid = getResourceID(machine, rtype="login")
     j, status = put(machine, f"filesystem/chmod/{rid}", data={"path" : path, "mode" : mode})
     tid = j['task_id']
-    j = waitTask(machine, tid)
+    j = waitTask(machine, tid, op="filesystem/chmod")
     
     if j["status"] == "completed":
         return True
@@ -409,9 +433,7 @@ def post(machine, suburl, data = None, params=None, files=None, base='iriapi_bas
 
     token = tokens[base]      
     base_path = known_machines[machine][base]
-    headers={ "accept" : "application/json", "Authorization" : f"Bearer {token}" }
-    
-    resp = sfapi_client.post(base_path + '/' + suburl, headers=headers, json=data if data_is_json else None, data=data if not data_is_json else None, params=params, files=files, timeout=300 )
+    resp = sfapi_client.post(base_path + '/' + suburl, token=token, suburl=suburl, json=data if data_is_json else None, data=data if not data_is_json else None, params=params, files=files)
     return json.loads(resp.text), resp.status_code
     
 def remoteMkdir(machine: str, path: str, create_parents = True, allow_unsafe = False)-> int:
@@ -435,7 +457,7 @@ def remoteMkdir(machine: str, path: str, create_parents = True, allow_unsafe = F
         
     j, status = post(machine, f"filesystem/mkdir/{rid}", data={"path" : path, "parent" : create_parents})
     tid = j['task_id']
-    j = waitTask(machine, tid)
+    j = waitTask(machine, tid, op="filesystem/mkdir")
 
     if j["status"] == "completed":
         return 1
@@ -446,6 +468,33 @@ def remoteMkdir(machine: str, path: str, create_parents = True, allow_unsafe = F
         return 0
 
 
+def remoteRm(machine: str, path: str, allow_unsafe = False)-> bool:
+    """
+    Remove a file on the remote machine
+    Args:
+       allow_unsafe - Allow removal of files other than within the sandbox
+    Return: True if successful, False otherwise
+    """
+    wfapiLog(f"Removing file {machine}:{path}")
+    
+    if not allow_unsafe and not checkSafePath(machine, path):
+        raise Exception("Path is not a subdirectory of the sandbox path")
+
+    if not pathlib.Path(path).is_absolute():
+        raise Exception("Path must be absolute")
+
+    rid = getResourceID(machine, rtype="login")
+
+    j, status = delete(machine, f"filesystem/rm/{rid}", params={"path" : path})
+    tid = j['task_id']
+    j = waitTask(machine, tid, op="filesystem/rm")
+
+    if j["status"] == "completed":
+        return True
+    else:
+        wfapiLog("File removal failed, status:", status, "response:", json.dumps(j,indent=2))
+        return False
+
 def uploadBytes(machine: str, remote_path: str, content: io.BytesIO, allow_unsafe = False) -> bool:
     """
     Upload file contents as bytes to a remote path
@@ -469,7 +518,7 @@ def uploadBytes(machine: str, remote_path: str, content: io.BytesIO, allow_unsaf
 
     j, status = post(machine, f"filesystem/upload/{rid}", params={'path' : remote_path}, files={'file': content})
     tid = j['task_id']
-    j = waitTask(machine, tid)
+    j = waitTask(machine, tid, op="filesystem/upload")
 
     if j["status"] == "completed":
         return 1
@@ -494,12 +543,12 @@ def downloadFile(machine: str, remote_path: str)->str:
 
     j = get(machine, f"filesystem/download/{rid}", params={'path' : remote_path})
     tid = j['task_id']
-    j = waitTask(machine, tid)
+    j = waitTask(machine, tid, op="filesystem/download")
     
     if j["status"] == "completed":
         return j["result"]["output"]
     else:
-        wfapiLog("Download failed, status:", status, " response:", json.dumps(j,indent=2))
+        wfapiLog("Download failed, status:", j["status"], " response:", json.dumps(j,indent=2))
         return None
 
 
@@ -599,6 +648,29 @@ def getJobState(machine: str, jobid: str) -> str:
     j = get(machine, f"compute/status/{rid}/{jobid}", params = { "historical" : True })
     wfapiLog(f"Queried job state {machine}:{jobid}, got {j['status']['state']}")
     return j['status']['state']
+
+def getJobStates(machine: str, jobids: List[str]) -> dict:
+    """
+    Query the states of many jobs on a machine with a single request to the compute status listing
+    The listing is restricted to the user's current (queued or running) jobs, such that its size is bounded by the jobs in flight rather than by the account history
+    Args:
+       machine - The name of the machine
+       jobids - The list of job IDs
+    Return:
+       A dict mapping job ID to state. Jobs absent from the listing, i.e. those that have finished since the last query, are queried individually
+    """
+    if len(jobids) == 0:
+        return {}
+    rid = getResourceID(machine, rtype="compute")
+    j = get(machine, f"compute/status/{rid}", params = { "historical" : False })
+
+    wanted = set(str(jobid) for jobid in jobids)
+    out = { str(e['id']) : e['status']['state'] for e in j if str(e['id']) in wanted }
+    wfapiLog(f"Queried {len(wanted)} job states on {machine} with a single listing, {len(out)} found")
+    
+    for jobid in wanted - out.keys(): #finished jobs, or if the listing is truncated
+        out[jobid] = getJobState(machine, jobid)
+    return out
     
     
 def delete(machine, suburl, params = None):
@@ -608,7 +680,7 @@ def delete(machine, suburl, params = None):
     
     token = tokens['iriapi_base']         
     base_path = known_machines[machine]['iriapi_base']
-    resp = sfapi_client.delete(base_path + '/' + suburl, headers={ "accept" : "*/*", "Authorization" : f"Bearer {token}" }, params=params, timeout=300  )
+    resp = sfapi_client.delete(base_path + '/' + suburl, token=token, suburl=suburl, headers={ "accept" : "*/*" }, params=params)
     return {} if resp.text == "" else resp.json(), resp.status_code
 
 def cancelJob(machine: str, jobid: str):
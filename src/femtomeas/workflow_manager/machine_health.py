@@ -0,0 +1,68 @@
+import threading
+import time
+from typing import Callable
+from .logging import wfmanLog
+
+class MachineHealth:
+    """
+    The availability of machines as reported by the API (see queryMachineStatus), cached with a time-to-live such that the manager loop can consult it on every
+    tick without querying the API each time. A machine whose status query fails is considered down until it is next checked
+    """
+    def __init__(self, query : Callable[[str], bool] | None = None, ttl=300., down_ttl=60.):
+        """
+        query: a function returning whether a machine is up; if None, queryMachineStatus of the API
+        ttl: the lifetime in seconds of a cached 'up' status
+        down_ttl: the lifetime in seconds of a cached 'down' status, i.e. the interval at which a down machine is checked for its return
+        """
+        if query == None:
+            from .api_general import queryMachineStatus
+            query = queryMachineStatus
+        self._query = query
+        self.ttl = ttl
+        self.down_ttl = down_ttl
+        self._lock = threading.Lock()
+        self._status = {} #machine -> (up, expiry time)
+
+    def isUp(self, machine : str)->bool:
+        """Return whether the machine is up, querying the API if the cached status has expired"""
+        with self._lock:
+            entry = self._status.get(machine)
+        if entry != None and time.time() < entry[1]:
+            return entry[0]
+        try:
+            up = bool(self._query(machine))
+        except Exception as e:
+            wfmanLog(f"Status query of machine {machine} failed, considering it down: {e}")
+            up = False
+        self._set(machine, up)
+        return up
+
+    def _set(self, machine, up):
+        with self._lock:
+            prev = self._status.get(machine)
+            self._status[machine] = (up, time.time() + (self.ttl if up else self.down_ttl))
+        if prev != None and prev[0] != up:
+            wfmanLog(f"Machine {machine} is now {'up' if up else 'down'}")
+
+    def cachedStatus(self, machine : str)->bool | None:
+        """The last known status of the machine regardless of its age, or None if it has not been checked"""
+        with self._lock:
+            entry = self._status.get(machine)
+        return None if entry == None else entry[0]
+
+    def markDown(self, machine : str):
+        """Record that the machine is down, e.g. after an operation on it failed, until it is next checked"""
+        self._set(machine, False)
+
+    def invalidate(self, machine : str | None = None):
+        """Discard the cached status of the machine (all machines if None) such that it is checked on next use"""
+        with self._lock:
+            if machine == None:
+                self._status.clear()
+            else:
+                self._status.pop(machine, None)
+
+    def downMachines(self)->dict:
+        """Return dict machine -> time of the next check, for the machines last known to be down"""
+        with self._lock:
+            return { m : expiry for m, (up, expiry) in self._status.items() if not up }
@@ -1,29 +1,49 @@
 from dataclasses import dataclass
+import dataclasses
 import pickle
+import hashlib
+import typing
 import sqlite3
-import tempfile
 import os
 from pathlib import Path
 from typing import List, Tuple
 from femtomeas.meas_config_agent.hadrons_xml import HadronsXML
 import time
 import threading
+import heapq
 import json
+import math
+import posixpath
+import uuid
 
 from .api_general import *
-from .hadrons import submitHadronsJob
+from .hadrons import submitHadronsJob, submitHadronsPack, readSubmissionReceipt, machine_ranks_per_node
+from .perf_model import PerfModel, getPerfModel
+from .machine_health import MachineHealth
+from .retry_policy import RetryPolicy, classifyFailure, scaleWalltime
 from . import globals
 from .logging import wfmanLog, updateGUI
+from .concurrency import boundedMap
+from concurrent.futures import ThreadPoolExecutor
+from .schema import migrateSchema, tableExists, tableColumns, addColumn
 
 from enum import Enum
 import re
+from xml.sax.saxutils import escape
 
 def replaceJobIdSubstring(in_str, job_id):
     """Replace instances of <JOBID> with the job index in path strings"""
     return re.sub(r'<JOBID>', str(job_id), in_str)
 
+#The machine of the actions of workflows that are placed on a machine when they start, by a PlacementPolicy
+ANY_MACHINE = "<ANY>"
+
+def replaceSandboxSubstring(in_str, machine):
+    """Replace instances of <SANDBOX> with the sandbox directory of the machine in path strings, for workflows whose machine is chosen when they start"""
+    return in_str.replace("<SANDBOX>", globals.remote_workdir[machine]) if machine in globals.remote_workdir else in_str
+
 class HadronsJobSpec:
-    job_rundir : str #Job run directory. The <JOBID> substring will be replaced by the job index if present
+    job_rundir : str #Job run directory. The <JOBID> and <SANDBOX> substrings will be replaced by the job index and the machine's sandbox directory if present
     xml_spec : bytes #The HadronsXML spec as a bytestring
     grid : Tuple[int,int,int,int]
 
@@ -32,6 +52,26 @@ class HadronsJobSpec:
         self.xml_spec = xml.toBytes()
         self.grid = grid
 
+    @classmethod
+    def fromBytes(cls, job_rundir, xml_spec : bytes, grid):
+        """Construct directly from the bytestring encoding of the XML"""
+        spec = cls.__new__(cls)
+        spec.job_rundir = job_rundir
+        spec.xml_spec = xml_spec
+        spec.grid = tuple(grid)
+        return spec
+
+    def toParams(self, store_blob)->dict:
+        """
+        Flatten into a dictionary of JSON-encodable parameters. The XML is passed to store_blob, which returns a key by which it can be retrieved
+        """
+        return { "job_rundir" : self.job_rundir, "grid" : list(self.grid), "xml_blob" : store_blob(self.xml_spec) }
+
+    @classmethod
+    def fromParams(cls, params : dict, load_blob):
+        """Inverse of toParams; load_blob retrieves the XML by key"""
+        return cls.fromBytes(params["job_rundir"], load_blob(params["xml_blob"]), params["grid"])
+
     def __repr__(self):
         xml = HadronsXML()
         xml.fromBytes(self.xml_spec)
@@ -39,6 +79,16 @@ class HadronsJobSpec:
         
         return f"HadronsJobSpec(job_rundir={self.job_rundir}, xml_spec={xmlstr}, grid={self.grid})"
 
+    def toFileBytes(self)->bytes:
+        """Return the contents of the XML file as written by writeXML"""
+        xml = HadronsXML()
+        xml.fromBytes(self.xml_spec)
+        return xml.toFileBytes()
+
+    def toFileBytesOn(self, machine)->bytes:
+        """As toFileBytes, with the <SANDBOX> substring of paths in the XML replaced by the sandbox directory of the machine"""
+        return self.toFileBytes().replace(escape("<SANDBOX>").encode(), escape(globals.remote_workdir[machine]).encode())
+        
     def writeXML(self, filename):
         xml = HadronsXML()
         xml.fromBytes(self.xml_spec)
@@ -53,18 +103,33 @@ class TransferActionBase:
         """
         raise NotImplementedError("Derived class must implement getTransferInfo")
 
+    def recoverAction(self, job_id, token)->str | None:
+        """
+        Return the API key of an initiation made with the idempotency token, or None if it must be initiated again. A repeated transfer only rewrites the same files, so an interrupted transfer is always initiated again
+        """
+        return None
+
 @dataclass
 class TransferToAction(TransferActionBase):
-    #The <JOBID> substring will be replaced by the job index if present in the path strings
+    #The <JOBID> and <SANDBOX> substrings will be replaced by the job index and the machine's sandbox directory if present in the path strings
     source_endpoint: str 
     source_path: str
     machine: str
     dest_path: str
+    #If True, dest_path is a configuration cache directory shared between jobs and the transfer is skipped if the file is already present; see JobData.evictConfigCache
+    cached: bool = False
+    #For a cached transfer, an identifier of the content of the source file, e.g. its size and modification time or a checksum. A cached copy staged from a different version is transferred again.
+    #If None, the cached copy is identified by the source path alone
+    source_version: str | None = None
+
+    def cachePath(self)->str:
+        """The location of the transferred file in the cache"""
+        return posixpath.join(replaceSandboxSubstring(self.dest_path, self.machine), posixpath.basename(self.source_path))
 
-    def initiateAction(self, job_id)-> str:
+    def initiateAction(self, job_id, token=None)-> str:
         assert self.machine in globals.remote_workdir
         source_path = replaceJobIdSubstring(self.source_path, job_id)
-        dest_path = replaceJobIdSubstring(self.dest_path, job_id)
+        dest_path = replaceSandboxSubstring(replaceJobIdSubstring(self.dest_path, job_id), self.machine)
         
         return globusCopyToMachine(self.machine, dest_path, self.source_endpoint, source_path)
 
@@ -72,20 +137,20 @@ class TransferToAction(TransferActionBase):
         """
         Return the transfer information in a common dictionary format with entries {"origin", "destination"}
         """
-        return { "origin" : f"{self.source_endpoint}:{self.source_path}",  "destination" : f"{self.machine}:{self.dest_path}" }
+        return { "origin" : f"{self.source_endpoint}:{self.source_path}",  "destination" : f"{self.machine}:{replaceSandboxSubstring(self.dest_path, self.machine)}" }
 
     
 @dataclass
 class TransferFromAction(TransferActionBase):
-    #The <JOBID> substring will be replaced by the job index if present in the path strings
+    #The <JOBID> and <SANDBOX> substrings will be replaced by the job index and the machine's sandbox directory if present in the path strings
     machine: str
     source_path: str
     dest_endpoint: str
     dest_path: str
     
-    def initiateAction(self, job_id)-> str:
+    def initiateAction(self, job_id, token=None)-> str:
         assert self.machine in globals.remote_workdir
-        source_path = replaceJobIdSubstring(self.source_path, job_id)
+        source_path = replaceSandboxSubstring(replaceJobIdSubstring(self.source_path, job_id), self.machine)
         dest_path = replaceJobIdSubstring(self.dest_path, job_id)
         
         return globusCopyFromMachine(self.dest_endpoint, dest_path, self.machine, source_path)
@@ -94,7 +159,7 @@ class TransferFromAction(TransferActionBase):
         """
         Return the transfer information in a common dictionary format with entries {"origin", "destination"}
         """
-        return { "origin" : f"{self.machine}:{self.source_path}", "destination" : f"{self.dest_endpoint}:{self.dest_path}" }
+        return { "origin" : f"{self.machine}:{replaceSandboxSubstring(self.source_path, self.machine)}", "destination" : f"{self.dest_endpoint}:{self.dest_path}" }
 
 
     
@@ -117,15 +182,66 @@ class ComputeActionBase:
 class HadronsComputeAction(ComputeActionBase):
     spec :  HadronsJobSpec
     mpi : Tuple[int, int, int, int]
+    #Actions sharing a pack_key are held until all pack_size members are ready, then run together in a single batch job; see submitHadronsPack for the pack_mode options
+    pack_key : str | None = None
+    pack_size : int = 1
+    pack_mode : str = "sequential"
    
-    def initiateAction(self, job_id)->str:
-        _, xml_file = tempfile.mkstemp(prefix="hadrons_xml_", text=True, dir="/tmp", suffix=".xml")
-        self.spec.writeXML(xml_file)
+    def initiateAction(self, job_id, token=None)->str:
         assert self.machine in globals.remote_workdir
         
-        rundir = replaceJobIdSubstring(self.spec.job_rundir, job_id)
+        rundir = replaceSandboxSubstring(replaceJobIdSubstring(self.spec.job_rundir, job_id), self.machine)
         wfmanLog(f"Job {job_id} machine {self.machine} rundir {rundir}")
-        return submitHadronsJob(self.machine, xml_file, rundir, self.account, self.queue, self.time, self.spec.grid, self.mpi, delete_xml_after_upload = True)
+        return submitHadronsJob(self.machine, self.spec.toFileBytesOn(self.machine), rundir, self.account, self.queue, self.time, self.spec.grid, self.mpi, token=token)
+
+    def recoverAction(self, job_id, token)->str | None:
+        """
+        Return the API key of a batch job submitted with the idempotency token, from its receipt in the run directory, or None if it must be submitted again.
+        A job whose submission was interrupted before its receipt was written exits without running (see hadrons.submissionGuard), so submitting again cannot duplicate the run
+        """
+        return readSubmissionReceipt(self.machine, replaceSandboxSubstring(replaceJobIdSubstring(self.spec.job_rundir, job_id), self.machine), token)
+
+    def packExitCode(self, job_id)->int | None:
+        """
+        Return the exit code of this member's own run within a finished pack, as recorded in its run directory by the pack script, or None if it cannot be read
+        """
+        rundir = replaceSandboxSubstring(replaceJobIdSubstring(self.spec.job_rundir, job_id), self.machine)
+        try:
+            return int(downloadFile(self.machine, f"{rundir}/exit_code").strip())
+        except Exception as e:
+            wfmanLog(f"Could not read the exit code of job {job_id} in pack {self.pack_key}: {e}")
+            return None
+
+    @staticmethod
+    def _packRundir(members)->str:
+        job_id0, a0 = members[0]
+        return replaceSandboxSubstring(replaceJobIdSubstring(a0.spec.job_rundir, f"pack_{job_id0}"), a0.machine)
+
+    @staticmethod
+    def recoverPack(members, token)->str | None:
+        """
+        As recoverAction, for a pack submitted with the idempotency token by initiatePack
+        """
+        return readSubmissionReceipt(members[0][1].machine, HadronsComputeAction._packRundir(members), token)
+
+    @staticmethod
+    def initiatePack(members, token=None)->str:
+        """
+        Initiate the actions of a pack as a single batch job
+        members: list of (job_id, action) for actions sharing the same pack_key
+        token: if not None, the idempotency token of the submission (see recoverPack)
+        Return: the API key of the batch job, shared by all of the members
+        """
+        job_id0, a0 = members[0]
+        for job_id, a in members:
+            if (a.machine, a.account, a.queue, a.time, tuple(a.mpi), tuple(a.spec.grid), a.pack_mode) != (a0.machine, a0.account, a0.queue, a0.time, tuple(a0.mpi), tuple(a0.spec.grid), a0.pack_mode):
+                raise Exception(f"Job {job_id} does not have the same compute parameters as the other members of pack {a0.pack_key}")
+        assert a0.machine in globals.remote_workdir
+        
+        pack_rundir = HadronsComputeAction._packRundir(members)
+        runs = [ (job_id, replaceSandboxSubstring(replaceJobIdSubstring(a.spec.job_rundir, job_id), a.machine), a.spec.toFileBytesOn(a.machine)) for job_id, a in members ]
+        wfmanLog(f"Pack {a0.pack_key} of jobs {[ m[0] for m in members ]} machine {a0.machine} rundir {pack_rundir}")
+        return submitHadronsPack(a0.machine, runs, pack_rundir, a0.account, a0.queue, a0.time, a0.spec.grid, a0.mpi, mode=a0.pack_mode, token=token)
 
 class ActionClass(Enum):
     NONE = 0
@@ -140,63 +256,310 @@ def actionClass(action):
     else:
         raise Exception("Unknown action type",type(action))    
     
-def _ser(obj):
-    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+#Action types that can be stored in the database, by name
+action_types = {}
+
+def registerActionType(cls):
+    """Register an action dataclass such that it can be reconstructed from the database"""
+    action_types[cls.__name__] = cls
+    return cls
+
+for _cls in (TransferToAction, TransferFromAction, HadronsComputeAction):
+    registerActionType(_cls)
+
+def actionToParams(action, store_blob)->dict:
+    """
+    Flatten an action dataclass into a dictionary of JSON-encodable parameters. Fields providing toParams (e.g. HadronsJobSpec) are flattened with a '<field>.' prefix, with bulk data passed to store_blob
+    """
+    out = {}
+    for f in dataclasses.fields(action):
+        v = getattr(action, f.name)
+        if hasattr(v, "toParams"):
+            for k, kv in v.toParams(store_blob).items():
+                out[f"{f.name}.{k}"] = kv
+        else:
+            out[f.name] = list(v) if isinstance(v, tuple) else v
+    return out
+
+def actionFromParams(action_type : str, params : dict, load_blob):
+    """Reconstruct an action from its type name and the output of actionToParams"""
+    if action_type not in action_types:
+        raise Exception("Unknown action type", action_type)
+    cls = action_types[action_type]
+    kwargs = {}
+    for f in dataclasses.fields(cls):
+        prefix = f.name + "."
+        nested = { k[len(prefix):] : v for k, v in params.items() if k.startswith(prefix) }
+        if len(nested) > 0:
+            kwargs[f.name] = f.type.fromParams(nested, load_blob)
+        elif f.name in params:
+            v = params[f.name]
+            kwargs[f.name] = tuple(v) if isinstance(v, list) and typing.get_origin(f.type) is tuple else v
+    return cls(**kwargs)
+
+def _packKey(workflow):
+    """The key of the pack to which the workflow's packed action belongs, or None"""
+    for action in workflow:
+        if getattr(action, "pack_key", None) != None:
+            return action.pack_key
+    return None
+
+def estimateConfigBytes(grid)->int:
+    """The size in bytes of a double-precision gauge configuration on the given lattice (4 links of 3x3 complex numbers per site)"""
+    return math.prod(grid) * 4 * 9 * 2 * 8
+
+def _configBytes(workflow)->int:
+    """The estimated size of a configuration staged in by the workflow, based on the lattice of its compute action"""
+    grid = next( (a.spec.grid for a in workflow if hasattr(a, "spec")), None)
+    return 0 if grid == None else estimateConfigBytes(grid)
+
+def _scratchBytes(workflow)->int:
+    """The estimated space in the sandbox scratch occupied by the data staged in by the workflow, with one configuration per stage-in transfer"""
+    return sum(1 for a in workflow if type(a) is TransferToAction) * _configBytes(workflow)
+
+@dataclass
+class PipelinePolicy:
+    """
+    A scheduling policy under which the stage-in of upcoming workflows overlaps the compute of earlier ones, replacing the single limit on active workflows.
+    Compute actions whose inputs have been staged are held until a compute slot is free, and new workflows are started while the prefetch depth,
+    the stage-in budget and the scratch space allow, such that staged work is available whenever a compute slot becomes free
+    """
+    max_transfers_active : int = 8 #the maximum number of stage-in transfers in flight
+    max_computes_active : int = 4 #the maximum number of compute jobs in flight (a pack counts once)
+    prefetch_depth : int | None = None #the maximum number of workflows staged or staging ahead of compute; if None, twice max_computes_active
+    scratch_bytes : int | None = None #the space in the sandbox scratch available to workflows that have started but not finished, using the estimate of _scratchBytes; if None, unlimited
+
+    def depth(self)->int:
+        return 2*self.max_computes_active if self.prefetch_depth == None else self.prefetch_depth
+
+@dataclass
+class PlacementPolicy:
+    """
+    A policy choosing the machine of each workflow enqueued for ANY_MACHINE when it starts. Of the target machines that are up, the one with the shortest expected
+    wait is chosen: the median queue wait of its recent compute jobs, plus a delay for each of our jobs queued or being staged there, less a credit if the
+    workflow's configuration is already present or being staged in its configuration cache. The actions are then rewritten to the chosen machine
+    """
+    targets : dict #machine -> { "account" : ..., "queue" : ... }, the candidate machines and the compute parameters used on each (entries absent from the dictionary are kept)
+    queue_penalty : float = 600. #the expected delay in seconds added per compute job queued or being staged on a machine
+    staged_credit : float = 900. #the seconds credited to a machine on which the workflow's configuration is cached
+    default_wait : float = 600. #the queue wait in seconds assumed for a machine with no history
+    history : int = 20 #the number of recent compute jobs on a machine from which its queue wait is estimated
+    retry_delay : float = 60. #the delay in seconds before workflows that could not be placed because no target was up are retried
+
+def defaultRetryPolicies()->dict:
+    """
+    Retry policies suited to Hadrons ensembles: transfers are retried promptly, computes after a longer backoff with the walltime extended after a timeout
+    Return: dict ActionClass -> RetryPolicy, for the JobData/JobManager retry argument
+    """
+    return { ActionClass.TRANSFER : RetryPolicy(max_attempts=5, backoff=60.),
+             ActionClass.COMPUTE : RetryPolicy(max_attempts=3, backoff=300.) }
+
 def _unser(ser):
+    """Deserialize the pickled objects of databases predating the versioned schema"""
     return pickle.loads(ser)
 
+def pollConcurrently(tasks : list, max_workers=8, max_per_machine=4)->list:
+    """
+    Execute polling tasks, each a tuple (action_manager, machine, rows), over a bounded thread pool with a per-machine concurrency limit.
+    Tasks that raise are logged and yield an empty result such that the affected actions retain their last known status until the next poll
+    Return: a list of dicts action_id -> api_status in the order of the input tasks
+    """
+    results = boundedMap(lambda t: t[0]._runPollTask(t[1], t[2]), tasks, max_workers=max_workers, key=lambda t: t[1], max_per_key=max_per_machine, return_exceptions=True)
+    out = []
+    for (aman, machine, rows), res in zip(tasks, results):
+        if isinstance(res, Exception):
+            wfmanLog(f"Status query of {len(rows)} {aman.table_name} on {machine} failed: {res}")
+            res = {}
+        out.append(res)
+    return out
+
 class ActionStatus(Enum):
     PENDING = 0 #not yet started
     ACTIVE = 1 #a live action (any status not failed or completed, e.g. queued, new, etc)
     COMPLETED = 2 #action completed successfully
     FAILED = 3 #action failed
+    HELD = 4 #action is waiting on a condition before it can be initiated (e.g. the other members of a pack)
+    SCHEDULING = 5 #action is being initiated under the job's intent_token; if found at startup the initiation was interrupted and is reconciled by JobData.recoverInterrupted
+
+class CacheStatus(Enum):
+    ABSENT = 0 #not present or a previous transfer failed
+    STAGING = 1 #a transfer to the cache is in flight
+    PRESENT = 2 #the file is in the cache
     
 class ActionManager:
     def _queryStatusInternal(self, machine, api_key):
         """Return the API status"""        
         raise NotImplementedError("Derived class must implement _queryStatusInternal")
+
+    def _queryStatusesInternal(self, machine, api_keys : list)->dict:
+        """
+        Return a dict api_key -> API status for all of the provided keys on the given machine.
+        The default implementation queries each key in turn; derived classes should override this if the API supports a bulk query
+        """
+        return { k : self._queryStatusInternal(machine, k) for k in api_keys }
+
+    def _pollTasks(self, actions)->list:
+        """
+        Partition the provided action table rows (each containing 'action_id', 'machine' and 'api_key') into independent polling tasks:
+        one per machine if the API supports a bulk status query, otherwise one per action
+        Return: list of (machine, rows) tuples
+        """
+        by_machine = {}
+        for t in actions:
+            by_machine.setdefault(t['machine'], []).append(t)
+        if self.bulk_status_query:
+            return list(by_machine.items())
+        else:
+            return [ (machine, [t]) for machine, mactions in by_machine.items() for t in mactions ]
+
+    def _runPollTask(self, machine, actions)->dict:
+        """
+        Execute a polling task produced by _pollTasks
+        Return: dict action_id -> api_status
+        """
+        api_statuses = self._queryStatusesInternal(machine, list(dict.fromkeys( t['api_key'] for t in actions ))) #actions may share an API key, e.g. packed compute jobs
+        return { t['action_id'] : api_statuses[t['api_key']] for t in actions }
+
+    def _pollStatuses(self, actions)->dict:
+        """
+        Poll the API concurrently for the status of the provided action table rows (each containing 'action_id', 'machine' and 'api_key')
+        Return: dict action_id -> api_status
+        """
+        out = {}
+        for res in pollConcurrently([ (self, machine, rows) for machine, rows in self._pollTasks(actions) ], self.max_poll_workers, self.max_poll_per_machine):
+            out.update(res)
+        return out
+
+    def _splitStale(self, action_ids : list, update_freq, force_update):
+        """
+        Separate the given actions into those whose cached status is recent enough to be used and those that must be polled
+        Return: dict action_id -> (action_status, api_status) for the former and a list of action table rows for the latter
+        """
+        if len(action_ids) == 0:
+            return {}, []
+        
+        placeholders = ",".join("?" for _ in action_ids)
+        with self.conn as conn:
+            actions = conn.execute(f"SELECT action_id, action_status, api_status, last_update, machine, api_key FROM {self.table_name} WHERE action_id IN ({placeholders})", tuple(action_ids) ).fetchall()
+
+        now = int(time.time())
+        cached = {}
+        stale = []
+        for t in actions:
+            if force_update or (now > t['last_update'] + update_freq):
+                stale.append(t)
+            else:
+                cached[t['action_id']] = (getattr(ActionStatus, t['action_status'],None), t['api_status'])
+        return cached, stale
+    
+    def _writeStatuses(self, conn : sqlite3.Connection, api_statuses : dict)->dict:
+        """
+        Record the provided API statuses (dict action_id -> api_status) within an open transaction
+        Return: dict action_id -> (action_status, api_status)
+        """
+        out = { action_id : (self.api_action_status_map[api_status], api_status) for action_id, api_status in api_statuses.items() }
+        now = int(time.time())
+        conn.executemany(f"UPDATE {self.table_name} SET api_status = ?, action_status = ?, last_update = ?, started_at = CASE WHEN started_at IS NULL AND ? THEN ? ELSE started_at END WHERE action_id = ?",
+                         [ (api_status, action_status.name, now, api_status in self.started_statuses, now, action_id) for action_id, (action_status, api_status) in out.items() ] )
+        return out
+
+    def _storeStatuses(self, api_statuses : dict)->dict:
+        """
+        Record the provided API statuses (dict action_id -> api_status) in the database in a single transaction
+        Return: dict action_id -> (action_status, api_status)
+        """
+        with self.conn as conn:
+            return self._writeStatuses(conn, api_statuses)
+    
+    bulk_status_query = False #whether _queryStatusesInternal resolves many keys with a single API call
+    started_statuses = () #the API statuses indicating that the action has left the queue, at the first observation of which started_at is recorded
+    info_columns = () #the entries of the action's getInfo dictionary, stored as columns of the action table
     
-    def __init__(self, connection : sqlite3.Connection, table_name, api_action_status_map):
+    def __init__(self, connection : sqlite3.Connection, table_name, api_action_status_map, max_poll_workers=8, max_poll_per_machine=4):
+        """
+        max_poll_workers: the maximum number of concurrent API status queries
+        max_poll_per_machine: the maximum number of concurrent API status queries to any one machine
+        """
         self.conn = connection
         self.table_name = table_name
         self.api_action_status_map = api_action_status_map #map between return status from the API to an ActionStatus
-        
-        with self.conn as conn:        
-            conn.execute(f"""
-            CREATE TABLE IF NOT EXISTS {table_name} (
-            action_id INTEGER PRIMARY KEY,
-            machine TEXT,
-            details BLOB,
-            api_key TEXT,
-            api_status TEXT,
-            action_status TEXT,
-            last_update INTEGER,
-            job_id INTEGER
-            )
-            """)
-
-    def startAction(self, action, job_id):
-        api_key = action.initiateAction(job_id)
+        self.max_poll_workers = max_poll_workers
+        self.max_poll_per_machine = max_poll_per_machine
+
+    def createTable(self, conn : sqlite3.Connection):
+        """
+        Create the action table. The information returned by the action's getInfo is stored in plain columns such that monitoring does not require the action to be reconstructed
+        """
+        columns = [ "action_id INTEGER PRIMARY KEY",
+                    "machine TEXT",
+                    "api_key TEXT",
+                    "api_status TEXT",
+                    "action_status TEXT",
+                    "last_update INTEGER",
+                    "job_id INTEGER",
+                    "workflow_stage INTEGER",
+                    "submitted_at INTEGER",
+                    "started_at INTEGER" ] + [ f"{c} TEXT" for c in self.info_columns if c != "machine" ]
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table_name} ({', '.join(columns)})")
+
+    def createIndexes(self, conn : sqlite3.Connection):
+        """
+        Index the action table on the status such that the active actions can be found without scanning the full history. The index also covers the poll schedule query
+        """
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table_name}_status ON {self.table_name}(action_status, last_update)")
+
+    def initiate(self, action, job_id, token=None):
+        """
+        Initiate the action through the API without recording it in the database. This is safe to call concurrently for independent actions
+        Return: api_key, api_status
+        """
+        if token != None and hasattr(action, "recoverAction"):
+            api_key = action.initiateAction(job_id, token=token) #actions supporting recovery take an idempotency token
+        else:
+            api_key = action.initiateAction(job_id)
         api_status = self._queryStatusInternal(action.machine, api_key)
-        action_status = self.api_action_status_map[api_status]
+        return api_key, api_status
+
+    def initiatePack(self, members, token=None):
+        """
+        Initiate a pack of actions as a single API operation without recording them in the database
+        members: list of (job_id, action) with actions of the same type providing initiatePack
+        Return: api_key, api_status shared by the members
+        """
+        action = members[0][1]
+        if token != None and hasattr(type(action), "recoverPack"):
+            api_key = type(action).initiatePack(members, token=token)
+        else:
+            api_key = type(action).initiatePack(members)
+        api_status = self._queryStatusInternal(action.machine, api_key)
+        return api_key, api_status
         
+    def _recordAction(self, conn : sqlite3.Connection, action, job_id, api_key, api_status, workflow_stage=None, token=None):
+        """
+        Record an initiated action within an open transaction
+        token: the idempotency token under which the action was initiated
+        Return: action_id
+        """
+        action_status = self.api_action_status_map[api_status]
+        info = action.getInfo()
+        columns = [ c for c in self.info_columns if c != "machine" ]
+        now = int(time.time())
+        cur = conn.execute(f"INSERT INTO {self.table_name}(machine, api_key, api_status, action_status, last_update, job_id, workflow_stage, submitted_at, started_at, token{''.join(', '+c for c in columns)}) VALUES (?,?,?,?,?,?,?,?,?,?{',?'*len(columns)})",
+                           (action.machine, api_key, api_status, action_status.name, now, job_id, workflow_stage, now, now if api_status in self.started_statuses else None, token, *[ info[c] for c in columns ])
+                           )
+        return cur.lastrowid
+    
+    def startAction(self, action, job_id, workflow_stage=None):
+        api_key, api_status = self.initiate(action, job_id)        
         with self.conn as conn:        
-            cur = conn.execute(f"INSERT INTO {self.table_name}(machine, details, api_key, api_status, action_status, last_update, job_id) VALUES (?,?,?,?,?,?,?)",
-                               (action.machine, _ser(action), api_key, api_status, action_status.name, int(time.time()), job_id)
-                               )
-            action_id = cur.lastrowid
-            return action_id
+            return self._recordAction(conn, action, job_id, api_key, api_status, workflow_stage)
 
 
     def updateStatuses(self):
         """Force update of all active statuses"""
         with self.conn as conn:
             actions = conn.execute(f"SELECT action_id, api_key, machine FROM {self.table_name} WHERE action_status = ?", (ActionStatus.ACTIVE.name,) ).fetchall()
-            for t in actions:
-                api_status = self._queryStatusInternal(t['machine'],t['api_key'])
-                action_status = self.api_action_status_map[api_status]
-
-                conn.execute(f"UPDATE {self.table_name} SET api_status = ?, action_status = ?, last_update = ? WHERE action_id = ?", (api_status, action_status.name, int(time.time()), t['action_id']) )
+        self._storeStatuses(self._pollStatuses(actions))
 
     def __str__(self):
         with self.conn as conn:
@@ -218,60 +581,81 @@ class ActionManager:
             api_status = action['api_status']
             if force_update or (int(time.time()) > action['last_update'] + update_freq):
                 api_status = self._queryStatusInternal(action['machine'],action['api_key'])
-                action_status = self.api_action_status_map[api_status]
-                
-                conn.execute(f"UPDATE {self.table_name} SET api_status = ?, action_status = ?, last_update = ? WHERE action_id = ?", (api_status, action_status.name, int(time.time()), action_id) )
+                action_status, api_status = self._writeStatuses(conn, { action_id : api_status })[action_id]
             return action_status, api_status
         
+    def queryStatuses(self, action_ids : list, update_freq=30, force_update=False)->dict:
+        """
+        Query the status of many actions by id. As for queryStatus, the last known status is used unless it has been more than update_freq seconds since the last poll or force_update == True.
+        Stale actions are polled concurrently, with one bulk query per machine where the API supports it.
+        Return: dict action_id -> (action_status, api_status)
+        """
+        out, stale = self._splitStale(action_ids, update_freq, force_update)
+        if len(stale) > 0:
+            out.update(self._storeStatuses(self._pollStatuses(stale)))
+        return out
+        
     def waitForAction(self, action_id, check_freq=30):
         """Blocking wait until the action either completes or fails. Status checks are performed every check_freq seconds. Return the final status."""
         while( (action_status := self.queryStatus(action_id,force_update=True)[0] ) == ActionStatus.ACTIVE):
             time.sleep(check_freq)
         return action_status
 
+    def _infoDict(self, entry)->dict:
+        dc = { c : entry[c] for c in self.info_columns }
+        dc['job_id'] = entry['job_id']
+        dc['api_key'] = entry['api_key']
+        dc['api_status'] = entry['api_status']
+        return dc
+    
     def getActiveActions(self):
         """
         Get all active actions and returning a list of dictionaries, each containing "api_key", "api_status" and other custom fields defined on a per-action basis
         """
-        out = []
         with self.conn as conn:
-            entries = conn.execute(f"SELECT job_id, api_key, api_status, details FROM {self.table_name} WHERE action_status = ?", (ActionStatus.ACTIVE.name,) ).fetchall()
-            for entry in entries:
-                action = _unser(entry['details'])
-                dc = action.getInfo()
-                dc['job_id'] = entry['job_id']
-                dc['api_key'] = entry['api_key']
-                dc['api_status'] = entry['api_status']
-                out.append(dc)
-        return out
+            entries = conn.execute(f"SELECT * FROM {self.table_name} WHERE action_status = ?", (ActionStatus.ACTIVE.name,) ).fetchall()
+        return [ self._infoDict(entry) for entry in entries ]
+
+    def getPollSchedule(self, update_freq=30, exclude_machines=())->list:
+        """
+        Get the times at which the active actions are next due a status poll
+        exclude_machines: machines whose actions are not polled (e.g. because they are down)
+        Return: a list of tuples (due_time, action_id)
+        """
+        placeholders = ",".join("?" for _ in exclude_machines)
+        with self.conn as conn:
+            entries = conn.execute(f"SELECT action_id, last_update FROM {self.table_name} WHERE action_status = ? AND machine NOT IN ({placeholders})", (ActionStatus.ACTIVE.name, *exclude_machines) ).fetchall()
+        #queryStatus polls only once the cached status is strictly older than update_freq at integer resolution
+        return [ (entry['last_update'] + update_freq + 1, entry['action_id']) for entry in entries ]
 
     def getActionInfo(self, action_id)->dict:
         """
         For the given action, return a dictionary containing "api_key", "api_status" and other custom fields defined on a per-action basis
         """        
         with self.conn as conn:
-            entry = conn.execute(f"SELECT job_id, details, api_status, api_key FROM {self.table_name} WHERE action_id = ?", (action_id,) ).fetchone()
-            action = _unser(entry['details'])
-            dc = action.getInfo()
-            dc['job_id'] = entry['job_id']
-            dc['api_key'] = entry['api_key']
-            dc['api_status'] = entry['api_status']
-            return dc
+            entry = conn.execute(f"SELECT * FROM {self.table_name} WHERE action_id = ?", (action_id,) ).fetchone()
+        return self._infoDict(entry)
             
     
 class DataTransfers(ActionManager):
-    def __init__(self, connection : sqlite3.Connection):
+    info_columns = ("origin", "destination")
+    
+    def __init__(self, connection : sqlite3.Connection, **kwargs):
         #"ACTIVE"  The task is in progress.
         #"INACTIVE" The task has been suspended and will not continue without intervention. Currently, only credential expiration will cause this state.
         #"SUCCEEDED"  The task completed successfully.
         #"FAILED"  The task or one of its subtasks failed, expired, or was canceled.
         smap = { "ACTIVE" : ActionStatus.ACTIVE, "INACTIVE" : ActionStatus.FAILED, "SUCCEEDED" : ActionStatus.COMPLETED, "FAILED" : ActionStatus.FAILED }    
-        super().__init__(connection, "transfers", smap)
+        super().__init__(connection, "transfers", smap, **kwargs)
     def _queryStatusInternal(self, machine, api_key):
         return globusTransferStatus(machine, api_key)
 
 class ComputeActions(ActionManager):
-    def __init__(self, connection : sqlite3.Connection):
+    bulk_status_query = True
+    started_statuses = ("active", "completed")
+    info_columns = ("machine", "queue", "time")
+    
+    def __init__(self, connection : sqlite3.Connection, **kwargs):
         #IRI API: 
         #0"new"
         #1"queued"
@@ -281,49 +665,455 @@ class ComputeActions(ActionManager):
         #5"canceled"
         smap = {"new": ActionStatus.ACTIVE, "queued" : ActionStatus.ACTIVE, "active" : ActionStatus.ACTIVE,
                 "completed" : ActionStatus.COMPLETED, "failed" : ActionStatus.FAILED, "canceled" : ActionStatus.FAILED }
-        super().__init__(connection, "computes", smap)
+        super().__init__(connection, "computes", smap, **kwargs)
     def _queryStatusInternal(self, machine, api_key):
         return getJobState(machine, api_key)
+    def _queryStatusesInternal(self, machine, api_keys : list)->dict:
+        return getJobStates(machine, api_keys)
 
     
 class JobData:
-    def __init__(self, filename: str | None = None, max_workflows_active=10):
+    def __init__(self, filename: str | None = None, max_workflows_active=10, max_poll_workers=8, max_poll_per_machine=4, max_initiate_workers=4, cache_size_mb=64,
+                 pipeline : PipelinePolicy | None = None, config_cache_bytes : int | None = None, perf_model : PerfModel | None = None, placement : PlacementPolicy | None = None,
+                 machine_health : MachineHealth | None = None, retry : dict | None = None, record_performance=True):
+        """
+        retry: if not None, dict ActionClass -> RetryPolicy under which failed actions of that class are retried (see defaultRetryPolicies); otherwise a failure ends the workflow
+        machine_health: the cached machine availability by which actions on down machines are held and their polling suspended; if None, a MachineHealth with the default time-to-live
+        pipeline: if not None, workflows are scheduled under this policy instead of the max_workflows_active limit
+        placement: the policy by which workflows enqueued for ANY_MACHINE are assigned a machine when they start; required to enqueue such workflows
+        perf_model: the database in which the run times of completed Hadrons computes, parsed from their logs, are recorded; if None, the process-wide database (see perf_model.getPerfModel)
+        record_performance: if False, the run times of completed computes are not recorded
+        config_cache_bytes: the size in bytes of the configuration cache on each machine, beyond which the least recently used configurations not referenced by unfinished jobs are removed. Required to enqueue cached transfers
+        max_poll_workers: the maximum number of concurrent API status queries when polling active actions
+        max_poll_per_machine: the maximum number of concurrent API status queries to any one machine
+        max_initiate_workers: the maximum number of actions of independent jobs that are initiated concurrently
+        cache_size_mb: the size of the SQLite page cache in MB
+        """
         db_path = ":memory:" if filename is None else str(Path(filename).expanduser())
         self.max_workflows_active = max_workflows_active
+        self.max_initiate_workers = max_initiate_workers
+        self.pipeline = pipeline
+        self.config_cache_bytes = config_cache_bytes
+        self.perf_model = perf_model
+        self.record_performance = record_performance
+        self._perf_pool = None #background thread on which the logs of completed computes are downloaded and recorded, created on first use
+        self.placement = placement
+        self._placement_retry_at = None #if not None, the time at which workflows that could not be placed are retried
+        self.health = MachineHealth() if machine_health == None else machine_health
+        self.retry = retry
+        self._recovery_needed = True #interrupted initiations are reconciled on the first pass; see recoverInterrupted
+        if placement != None:
+            for m in placement.targets:
+                if m not in globals.remote_workdir:
+                    raise Exception(f"Placement target {m} is not a known machine")
+        self.max_poll_workers = max_poll_workers
+        self.max_poll_per_machine = max_poll_per_machine
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
+        self._configureConnection(filename is not None, cache_size_mb)
+
+        poll_args = { "max_poll_workers" : max_poll_workers, "max_poll_per_machine" : max_poll_per_machine }
+        self.action_man = { ActionClass.TRANSFER : DataTransfers(self.conn, **poll_args),
+                            ActionClass.COMPUTE : ComputeActions(self.conn, **poll_args) }
+
+        with self.conn as conn:
+            conn.execute("BEGIN IMMEDIATE") #apply any schema migrations atomically
+            migrateSchema(conn, self._migrations())
+
+    def _configureConnection(self, on_disk : bool, cache_size_mb):
+        """
+        Set the per-connection pragmas. These must be applied outside of a transaction
+        """
+        conn = self.conn
+        if on_disk:
+            #With write-ahead logging readers (e.g. the GUI) do not block on the manager's writes, and commits need not fsync the main database file.
+            #synchronous=NORMAL is durable against application crashes; a power loss may lose the last commits but cannot corrupt the database
+            mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            if mode.lower() != "wal":
+                wfmanLog(f"Could not enable WAL mode for the job database, using journal mode {mode}")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute(f"PRAGMA cache_size = {-1024*int(cache_size_mb)}") #negative values are in KiB
+        conn.execute("PRAGMA temp_store = MEMORY")
         
-        self.action_man = { ActionClass.TRANSFER : DataTransfers(self.conn),
-                            ActionClass.COMPUTE : ComputeActions(self.conn) }
+    def _migrations(self)->list:
+        """The ordered list of schema migrations; see schema.migrateSchema"""
+        return [ self._schemaV1, self._schemaV2, self._schemaV3, self._schemaV4, self._schemaV5, self._schemaV6, self._schemaV7, self._schemaV8, self._schemaV9, self._schemaV10, self._schemaV11 ]
 
-        with self.conn as conn:        
-            conn.execute("""
-            CREATE TABLE IF NOT EXISTS jobs (
-            job_id INTEGER PRIMARY KEY,
-            job_group TEXT,
-            workflow BLOB NOT NULL,
-            workflow_stage INTEGER NOT NULL,
-            head_action_type TEXT,
-            head_action_class TEXT,
-            head_action_status TEXT,
-            head_action_id INTEGER,
-            last_status_change INTEGER
-            )
-            """)
+    def _createTablesV1(self, conn : sqlite3.Connection):
+        #Workflows are stored as one row per stage with the action parameters in a separate key/value table, such that they can be queried without deserialization
+        #Bulk data such as the Hadrons XML is stored once in a content-addressed blob table
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+        job_id INTEGER PRIMARY KEY,
+        job_group TEXT,
+        num_stages INTEGER NOT NULL,
+        workflow_stage INTEGER NOT NULL,
+        head_action_type TEXT,
+        head_action_class TEXT,
+        head_action_status TEXT,
+        head_action_id INTEGER,
+        last_status_change INTEGER
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS workflow_stages (
+        job_id INTEGER NOT NULL,
+        stage INTEGER NOT NULL,
+        action_type TEXT NOT NULL,
+        action_class TEXT NOT NULL,
+        machine TEXT,
+        PRIMARY KEY (job_id, stage)
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS action_params (
+        job_id INTEGER NOT NULL,
+        stage INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        value TEXT,
+        PRIMARY KEY (job_id, stage, name)
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+        blob_hash TEXT PRIMARY KEY,
+        content BLOB NOT NULL
+        )
+        """)
+        for aman in self.action_man.values():
+            aman.createTable(conn)
+        
+    def _schemaV1(self, conn : sqlite3.Connection):
+        """
+        Create the tables. Databases predating schema versioning, which store the workflows and actions as pickled BLOBs, are converted
+        """
+        if "workflow" not in tableColumns(conn, "jobs"):
+            self._createTablesV1(conn)
+            return
+
+        wfmanLog("Converting job database with pickled workflows to the versioned schema")
+        legacy_tables = [ t for t in ["jobs"] + [ aman.table_name for aman in self.action_man.values() ] if tableExists(conn, t) ]
+        for t in legacy_tables:
+            conn.execute(f"ALTER TABLE {t} RENAME TO {t}_legacy")
+        self._createTablesV1(conn)
+
+        heads = {} #(action_class name, action_id) -> workflow stage
+        for row in conn.execute("SELECT * FROM jobs_legacy").fetchall():
+            workflow = _unser(row['workflow'])
+            conn.execute("INSERT INTO jobs(job_id, job_group, num_stages, workflow_stage, head_action_type, head_action_class, head_action_status, head_action_id, last_status_change) VALUES (?,?,?,?,?,?,?,?,?)",
+                         (row['job_id'], row['job_group'], len(workflow), row['workflow_stage'], row['head_action_type'], row['head_action_class'], row['head_action_status'], row['head_action_id'], row['last_status_change']) )
+            self._insertWorkflow(conn, row['job_id'], workflow)
+            heads[(row['head_action_class'], row['head_action_id'])] = row['workflow_stage']
+
+        for action_class, aman in self.action_man.items():
+            if aman.table_name not in legacy_tables:
+                continue
+            for row in conn.execute(f"SELECT * FROM {aman.table_name}_legacy").fetchall():
+                action = _unser(row['details'])
+                action_id = aman._recordAction(conn, action, row['job_id'], row['api_key'], row['api_status'], heads.get((action_class.name, row['action_id'])))
+                conn.execute(f"UPDATE {aman.table_name} SET action_id = ?, action_status = ?, last_update = ? WHERE action_id = ?", (row['action_id'], row['action_status'], row['last_update'], action_id))
+
+        for t in legacy_tables:
+            conn.execute(f"DROP TABLE {t}_legacy")
+
+    def _schemaV2(self, conn : sqlite3.Connection):
+        """
+        Index the job and action tables on the columns filtered by the manager loop
+        """
+        #Workflow scheduling and progression filter on the head status (and class); including the remaining selected columns makes the index covering
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_class ON jobs(head_action_status, head_action_class, head_action_type, head_action_id)")
+        #Pending workflows are started in job id order
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_job ON jobs(head_action_status, job_id)")
+        for aman in self.action_man.values():
+            aman.createIndexes(conn)
+
+    def _schemaV3(self, conn : sqlite3.Connection):
+        """
+        Record the pack to which each job belongs (if any)
+        """
+        addColumn(conn, "jobs", "pack_key", "TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_pack ON jobs(pack_key) WHERE pack_key IS NOT NULL")
+
+    def _schemaV4(self, conn : sqlite3.Connection):
+        """
+        Record the estimated scratch space occupied by each job's staged data
+        """
+        addColumn(conn, "jobs", "scratch_bytes", "INTEGER NOT NULL DEFAULT 0")
+
+    def _schemaV5(self, conn : sqlite3.Connection):
+        """
+        Track the configurations in the cache on each machine, keyed by their source, along with the unfinished jobs that reference them
+        """
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS config_cache (
+        machine TEXT NOT NULL,
+        source_endpoint TEXT NOT NULL,
+        source_path TEXT NOT NULL,
+        cache_path TEXT NOT NULL,
+        size_bytes INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL,
+        api_key TEXT,
+        last_used INTEGER,
+        PRIMARY KEY (machine, source_endpoint, source_path)
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS config_cache_refs (
+        job_id INTEGER NOT NULL,
+        machine TEXT NOT NULL,
+        source_endpoint TEXT NOT NULL,
+        source_path TEXT NOT NULL,
+        PRIMARY KEY (job_id, machine, source_endpoint, source_path)
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_config_cache_refs_entry ON config_cache_refs(machine, source_endpoint, source_path)")
+        #A cached file being staged for one job is shared with others by the API key of its transfer
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_transfers_api_key ON transfers(api_key)")
+
+    def _schemaV6(self, conn : sqlite3.Connection):
+        """
+        Record when each action was submitted and when it was first seen to have left the queue, from which the queue wait on each machine is estimated
+        """
+        for aman in self.action_man.values():
+            addColumn(conn, aman.table_name, "submitted_at", "INTEGER")
+            addColumn(conn, aman.table_name, "started_at", "INTEGER")
+
+    def _schemaV7(self, conn : sqlite3.Connection):
+        """
+        Record the down machine on which a job is waiting: a pending job whose workflow is not started, or a held job whose next action is not initiated, until the machine is back up
+        """
+        addColumn(conn, "jobs", "held_machine", "TEXT")
+
+    def _schemaV8(self, conn : sqlite3.Connection):
+        """
+        Record the idempotency token under which each job's head action is initiated, and with which each action was recorded, such that interrupted initiations can be reconciled
+        """
+        addColumn(conn, "jobs", "intent_token", "TEXT")
+        for aman in self.action_man.values():
+            addColumn(conn, aman.table_name, "token", "TEXT")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{aman.table_name}_token ON {aman.table_name}(token)")
+
+    def _schemaV9(self, conn : sqlite3.Connection):
+        """
+        Record the retries of each job's head action: the number made, the classified cause of the last failure and the time of the next retry (NULL if none is due)
+        """
+        addColumn(conn, "jobs", "attempts", "INTEGER NOT NULL DEFAULT 0")
+        addColumn(conn, "jobs", "failure_cause", "TEXT")
+        addColumn(conn, "jobs", "retry_at", "INTEGER")
+
+    def _schemaV10(self, conn : sqlite3.Connection):
+        """
+        Scheduling parameters of job groups (see setJobGroup); groups without an entry have the default priority and weight and no deadline
+        """
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS job_groups (
+        job_group TEXT PRIMARY KEY,
+        priority INTEGER NOT NULL DEFAULT 0,
+        weight REAL NOT NULL DEFAULT 1,
+        deadline INTEGER
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_group_status ON jobs(job_group, head_action_status, job_id)")
+
+    def _schemaV11(self, conn : sqlite3.Connection):
+        """
+        Record the version of the source file from which each cached configuration was staged (see TransferToAction.source_version)
+        """
+        addColumn(conn, "config_cache", "source_version", "TEXT")
+
+    def _storeBlob(self, conn : sqlite3.Connection, content : bytes)->str:
+        """Store bulk data once, keyed by its SHA-256 hash, returning the key"""
+        blob_hash = hashlib.sha256(content).hexdigest()
+        conn.execute("INSERT OR IGNORE INTO blobs(blob_hash, content) VALUES (?,?)", (blob_hash, content))
+        return blob_hash
+
+    def _loadBlob(self, conn : sqlite3.Connection, blob_hash : str)->bytes:
+        row = conn.execute("SELECT content FROM blobs WHERE blob_hash = ?", (blob_hash,)).fetchone()
+        if row == None:
+            raise Exception("Missing blob", blob_hash)
+        return row['content']
+        
+    def _workflowRows(self, job_id, workflow, store_blob, param_cache = None):
+        """
+        Return the rows (stages, params) of the workflow_stages and action_params tables for a workflow
+        param_cache: optional dictionary in which the flattened parameters of action instances are cached, such that actions shared between workflows are flattened only once
+        """
+        stages = []
+        params = []
+        for stage, action in enumerate(workflow):
+            stages.append( (job_id, stage, type(action).__name__, actionClass(action).name, getattr(action, "machine", None)) )
+            if param_cache != None and id(action) in param_cache:
+                action_params = param_cache[id(action)][1]
+            else:
+                action_params = [ (name, json.dumps(value)) for name, value in actionToParams(action, store_blob).items() ]
+                if param_cache != None:
+                    param_cache[id(action)] = (action, action_params) #keep a reference such that the id is not reused
+            params.extend( (job_id, stage, name, value) for name, value in action_params )
+        return stages, params
+        
+    def _insertWorkflow(self, conn : sqlite3.Connection, job_id, workflow):
+        """Store the workflow stages and their action parameters within an open transaction"""
+        stages, params = self._workflowRows(job_id, workflow, lambda content: self._storeBlob(conn, content))
+        conn.executemany("INSERT INTO workflow_stages(job_id, stage, action_type, action_class, machine) VALUES (?,?,?,?,?)", stages)
+        conn.executemany("INSERT INTO action_params(job_id, stage, name, value) VALUES (?,?,?,?)", params)
+
+    def _loadAction(self, conn : sqlite3.Connection, job_id, stage):
+        """Reconstruct the action of a single workflow stage"""
+        row = conn.execute("SELECT action_type FROM workflow_stages WHERE job_id = ? AND stage = ?", (job_id, stage)).fetchone()
+        if row == None:
+            raise Exception(f"Job {job_id} has no workflow stage {stage}")
+        params = { p['name'] : json.loads(p['value']) for p in conn.execute("SELECT name, value FROM action_params WHERE job_id = ? AND stage = ?", (job_id, stage)).fetchall() }
+        return actionFromParams(row['action_type'], params, lambda blob_hash: self._loadBlob(conn, blob_hash))
+
+    def getWorkflow(self, job_id)->list:
+        """Reconstruct the list of workflow actions for a job"""
+        with self.conn as conn:
+            num_stages = conn.execute("SELECT num_stages FROM jobs WHERE job_id = ?", (job_id,)).fetchone()['num_stages']
+            return [ self._loadAction(conn, job_id, stage) for stage in range(num_stages) ]
        
     def enqueueJob(self, workflow, job_group = None):
-        assert len(workflow) > 0
-        with self.conn as conn:        
-            cur = conn.execute("INSERT INTO jobs(job_group, workflow, workflow_stage, head_action_type, head_action_class, head_action_status, last_status_change) VALUES (?,?,?,?,?,?,?)",
-                               (job_group, _ser(workflow), -1,
-                                type(workflow[0]).__name__,
-                                actionClass(workflow[0]).name,
-                                ActionStatus.PENDING.name,
-                                int(time.time())
-                                ) )
-            job_id = cur.lastrowid
-            return job_id
+        job_id, _ = self.enqueueJobs([workflow], job_group)
+        return job_id
+
+    def enqueueJobs(self, workflows, job_group = None)->Tuple[int,int]:
+        """
+        Enqueue many workflows in a single transaction
+        Args:
+           workflows - A list of workflows, each a list of actions
+           job_group - The job group assigned to all of the workflows
+        Return:
+           The range (first, last) of the contiguous job ids assigned to the workflows, in order
+        """
+        assert len(workflows) > 0 and all(len(w) > 0 for w in workflows)
+        for w in workflows:
+            if any( getattr(a, "machine", None) == ANY_MACHINE for a in w ):
+                if self.placement == None:
+                    raise Exception("Workflows for ANY_MACHINE require a placement policy")
+                if _packKey(w) != None:
+                    raise Exception("Packed workflows cannot be placed on ANY_MACHINE")
+        
+        #Flatten the workflows outside of the transaction. Bulk data shared between workflows (e.g. an identical XML) is hashed and stored once,
+        #as are the parameters of action instances shared between workflows
+        blobs = {} #content -> hash
+        def _store(content):
+            if content not in blobs:
+                blobs[content] = hashlib.sha256(content).hexdigest()
+            return blobs[content]
+        param_cache = {}
+        rows = [ self._workflowRows(i, w, _store, param_cache) for i, w in enumerate(workflows) ]
+        now = int(time.time())
+        if self.config_cache_bytes == None and any( getattr(a, "cached", False) for w in workflows for a in w ):
+            raise Exception("Cached transfers require a bound on the size of the configuration cache (config_cache_bytes)")
+        cache_refs = [ (i, a, _configBytes(w)) for i, w in enumerate(workflows) for a in w if getattr(a, "cached", False) and a.machine != ANY_MACHINE ] #placed workflows reference the cache when placed
+        
+        with self.conn as conn:
+            conn.execute("BEGIN IMMEDIATE") #reserve the job id range
+            first = int(conn.execute("SELECT COALESCE(MAX(job_id), 0) FROM jobs").fetchone()[0]) + 1
+            conn.executemany("INSERT INTO jobs(job_id, job_group, num_stages, workflow_stage, head_action_type, head_action_class, head_action_status, last_status_change, pack_key, scratch_bytes) VALUES (?,?,?,?,?,?,?,?,?,?)",
+                             [ (first + i, job_group, len(w), -1, type(w[0]).__name__, actionClass(w[0]).name, ActionStatus.PENDING.name, now, _packKey(w), _scratchBytes(w)) for i, w in enumerate(workflows) ])
+            conn.executemany("INSERT OR IGNORE INTO blobs(blob_hash, content) VALUES (?,?)", [ (h, content) for content, h in blobs.items() ])
+            conn.executemany("INSERT INTO workflow_stages(job_id, stage, action_type, action_class, machine) VALUES (?,?,?,?,?)",
+                             ( (first + r[0],) + r[1:] for stages, _ in rows for r in stages ) )
+            conn.executemany("INSERT INTO action_params(job_id, stage, name, value) VALUES (?,?,?,?)",
+                             ( (first + r[0],) + r[1:] for _, params in rows for r in params ) )
+            self._referenceCachedConfigs(conn, [ (first + i, a, size) for i, a, size in cache_refs ], now)
+        return first, first + len(workflows) - 1
+
+    def _referenceCachedConfigs(self, conn : sqlite3.Connection, refs, now):
+        """
+        Reference the cached configurations of jobs until the jobs finish, such that they are not evicted, within an open transaction
+        An entry staged from a different version of the source file than that of the referencing transfer is marked absent, such that the file is transferred again
+        refs: list of (job_id, TransferToAction, size in bytes)
+        """
+        conn.executemany("INSERT INTO config_cache(machine, source_endpoint, source_path, cache_path, size_bytes, status, last_used, source_version) VALUES (?,?,?,?,?,?,?,?) "
+                         "ON CONFLICT(machine, source_endpoint, source_path) DO UPDATE SET last_used = excluded.last_used, "
+                         "status = CASE WHEN excluded.source_version IS NULL OR excluded.source_version IS config_cache.source_version THEN config_cache.status ELSE excluded.status END, "
+                         "api_key = CASE WHEN excluded.source_version IS NULL OR excluded.source_version IS config_cache.source_version THEN config_cache.api_key ELSE NULL END, "
+                         "source_version = COALESCE(excluded.source_version, config_cache.source_version)",
+                         [ (a.machine, a.source_endpoint, a.source_path, a.cachePath(), size, CacheStatus.ABSENT.name, now, a.source_version) for _, a, size in refs ])
+        conn.executemany("INSERT OR IGNORE INTO config_cache_refs(job_id, machine, source_endpoint, source_path) VALUES (?,?,?,?)",
+                         [ (job_id, a.machine, a.source_endpoint, a.source_path) for job_id, a, _ in refs ])
    
+    def setJobGroup(self, job_group : str, priority : int | None = None, weight : float | None = None, deadline : float | None = None):
+        """
+        Set the scheduling parameters of a job group, by which startWorkflows shares the active workflow slots between groups. Parameters given as None are left unchanged (or take their defaults)
+        Args:
+           priority - Groups of higher priority are started first (default 0)
+           weight - Within a priority, groups without a deadline share the slots in proportion to their weights (default 1)
+           deadline - The time (seconds since the epoch) by which the group should be complete; within a priority, groups with a deadline are started earliest deadline first. 0 removes the deadline
+        """
+        if weight != None and weight <= 0:
+            raise Exception("Job group weight must be positive")
+        with self.conn as conn:
+            conn.execute("INSERT OR IGNORE INTO job_groups(job_group) VALUES (?)", (job_group,))
+            if priority != None:
+                conn.execute("UPDATE job_groups SET priority = ? WHERE job_group = ?", (int(priority), job_group))
+            if weight != None:
+                conn.execute("UPDATE job_groups SET weight = ? WHERE job_group = ?", (float(weight), job_group))
+            if deadline != None:
+                conn.execute("UPDATE job_groups SET deadline = ? WHERE job_group = ?", (int(deadline) if deadline > 0 else None, job_group))
+
+    def getJobGroups(self)->list:
+        """
+        Return a list of dictionaries, one per job group with unfinished or configured jobs, with entries "job_group", "priority", "weight", "deadline", "pending" (workflows not started),
+        "started" (started and unfinished) and "finished"
+        """
+        with self.conn as conn:
+            params = { r['job_group'] : dict(r) for r in conn.execute("SELECT job_group, priority, weight, deadline FROM job_groups").fetchall() }
+            counts = conn.execute("SELECT job_group, SUM(workflow_stage = -1 AND head_action_status = ?) AS pending, SUM(workflow_stage >= 0 AND head_action_class != ?) AS started, "
+                                  "SUM(head_action_class = ?) AS finished FROM jobs GROUP BY job_group", (ActionStatus.PENDING.name, ActionClass.NONE.name, ActionClass.NONE.name)).fetchall()
+        out = []
+        for r in counts:
+            entry = params.pop(r['job_group'], { "job_group" : r['job_group'], "priority" : 0, "weight" : 1., "deadline" : None })
+            entry.update( { "pending" : int(r['pending']), "started" : int(r['started']), "finished" : int(r['finished']) } )
+            out.append(entry)
+        out += [ dict(p, pending=0, started=0, finished=0) for p in params.values() ]
+        return out
+
+    def _selectPending(self, conn : sqlite3.Connection, count, not_started_only=False)->list:
+        """
+        Choose up to count pending workflows to start, sharing them between job groups: groups of higher priority first; within a priority, groups with a deadline earliest deadline first,
+        then the others by weighted fair share, i.e. the group with the fewest started workflows (including those chosen here) per unit weight. Within a group jobs start in job order
+        not_started_only: exclude pending jobs whose workflow is already underway
+        Return: a list of job ids in the order chosen
+        """
+        if count <= 0:
+            return []
+        stage_cond = " AND workflow_stage = -1" if not_started_only else ""
+        groups = conn.execute(f"SELECT j.job_group AS job_group, SUM(j.head_action_status = ? AND j.held_machine IS NULL{' AND j.workflow_stage = -1' if not_started_only else ''}) AS pending, "
+                              "SUM(j.workflow_stage >= 0 AND j.head_action_status != ?) AS started, COALESCE(g.priority, 0) AS priority, COALESCE(g.weight, 1) AS weight, g.deadline AS deadline "
+                              "FROM jobs j LEFT JOIN job_groups g ON g.job_group = j.job_group WHERE j.head_action_class != ? GROUP BY j.job_group",
+                              (ActionStatus.PENDING.name, ActionStatus.FAILED.name, ActionClass.NONE.name)).fetchall()
+        groups = [ dict(g) for g in groups if g['pending'] > 0 ]
+        if len(groups) == 1:
+            #No sharing is required
+            return [ r[0] for r in conn.execute(f"SELECT job_id FROM jobs WHERE job_group IS ? AND head_action_status = ? AND held_machine IS NULL{stage_cond} ORDER BY job_id ASC LIMIT ?",
+                                                  (groups[0]['job_group'], ActionStatus.PENDING.name, count)).fetchall() ]
+
+        def _key(g):
+            no_deadline = g['deadline'] == None
+            return (-g['priority'], no_deadline, 0 if no_deadline else g['deadline'], g['started'] / g['weight'] if no_deadline else 0)
+        share = {} #job_group -> number of jobs to take
+        heap = [ (_key(g), n) for n, g in enumerate(groups) ]
+        heapq.heapify(heap)
+        for _ in range(count):
+            if len(heap) == 0:
+                break
+            _, n = heapq.heappop(heap)
+            g = groups[n]
+            share[g['job_group']] = share.get(g['job_group'], 0) + 1
+            g['pending'] -= 1
+            g['started'] += 1
+            if g['pending'] > 0:
+                heapq.heappush(heap, (_key(g), n))
+
+        out = []
+        for job_group, take in share.items():
+            out += [ r[0] for r in conn.execute(f"SELECT job_id FROM jobs WHERE job_group IS ? AND head_action_status = ? AND held_machine IS NULL{stage_cond} ORDER BY job_id ASC LIMIT ?",
+                                                 (job_group, ActionStatus.PENDING.name, take)).fetchall() ]
+        return out
+
     def jobStatus(self, job_id):
         with self.conn as conn:
             row = dict(conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone())
@@ -340,16 +1130,23 @@ class JobData:
            ("VALID_IN", [job_id1, job_id2, ...]) - Progress valid workflows (those whose head action status is either ActionStatus.PENDING or ActionStatus.COMPLETED, not in a failure state) based on a list of job indices.
         """
 
+        placement = None
+        unplaced = False
+        if self.placement != None and condition[0] == "VALID_IN":
+            placement = self._placementState()
+
         pending_actions = []        
         completed_actions = [] #list of action ids of completed actions
+        completed_computes = [] #list of (job_id, workflow_stage) of completed compute actions
+        finished_jobs = []
         
         with self.conn as conn:
             if condition[0] == "COMPLETE" and condition[1] == None:
-                progress_actions = conn.execute("SELECT job_id, workflow, workflow_stage, head_action_type, head_action_status, head_action_id, head_action_class FROM jobs WHERE head_action_class != ? AND head_action_status = ?",
+                progress_actions = conn.execute("SELECT job_id, num_stages, workflow_stage, head_action_type, head_action_status, head_action_id, head_action_class FROM jobs WHERE head_action_class != ? AND head_action_status = ?",
                                                 (ActionClass.NONE.name,ActionStatus.COMPLETED.name)).fetchall()
             elif condition[0] == "VALID_IN" and isinstance(condition[1],list):
                 placeholders = ",".join("?" for _ in condition[1])
-                progress_actions = conn.execute(f"SELECT job_id, workflow, workflow_stage, head_action_type, head_action_status, head_action_id, head_action_class FROM jobs WHERE head_action_class != ? AND job_id IN ({placeholders}) AND head_action_status IN (?,?)",
+                progress_actions = conn.execute(f"SELECT job_id, num_stages, workflow_stage, head_action_type, head_action_status, head_action_id, head_action_class FROM jobs WHERE head_action_class != ? AND job_id IN ({placeholders}) AND head_action_status IN (?,?)",
                                                 ( ActionClass.NONE.name, *condition[1], ActionStatus.PENDING.name, ActionStatus.COMPLETED.name )
                                                 )
             else:
@@ -357,31 +1154,57 @@ class JobData:
                 
             for a in progress_actions:              
                 #Get information on the next workflow task
-                workflow = _unser(a['workflow'])
                 workflow_stage = a['workflow_stage']
 
+                #Workflows for ANY_MACHINE are placed when they start; without an available machine they remain pending
+                if placement != None and workflow_stage == -1 and not self._placeWorkflow(conn, a['job_id'], a['num_stages'], placement):
+                    unplaced = True
+                    continue
+
                 #Record completed actions so we can update any monitors
                 if a['head_action_status'] == ActionStatus.COMPLETED.name:
                     completed_actions.append(  (a['head_action_id'], getattr(ActionClass, a['head_action_class'], None) ) )
+                    if a['head_action_class'] == ActionClass.COMPUTE.name:
+                        completed_computes.append( (a['job_id'], workflow_stage) )
                 
                 job_id = a['job_id']
                 next_workflow_stage = workflow_stage+1
 
-                next_action = None if next_workflow_stage == len(workflow) else workflow[next_workflow_stage]
+                next_action = None if next_workflow_stage == a['num_stages'] else self._loadAction(conn, job_id, next_workflow_stage)
                 next_action_class = ActionClass.NONE if next_action == None else actionClass(next_action)
                 next_action_status = ActionStatus.COMPLETED if next_action == None else ActionStatus.PENDING
+                held_machine = None
+                if next_action == None:
+                    finished_jobs.append(job_id)
+                if getattr(next_action, "pack_key", None) != None:
+                    next_action_status = ActionStatus.HELD #initiated with the rest of its pack by releaseHeldPacks
+                elif self.pipeline != None and next_action_class == ActionClass.COMPUTE:
+                    next_action_status = ActionStatus.HELD #initiated when a compute slot is free by releaseHeldComputes
+                elif next_action != None and self._isDown(next_action.machine):
+                    #Workflows are not started on a down machine, and the next action of a started workflow is held; both are released by releaseMachineHolds
+                    if workflow_stage == -1:
+                        conn.execute("UPDATE jobs SET held_machine = ? WHERE job_id = ?", (next_action.machine, job_id))
+                        continue
+                    next_action_status = ActionStatus.HELD
+                    held_machine = next_action.machine
                 
                 wfmanLog(f"Progressing job {job_id} action {a['head_action_type']} status {a['head_action_status']} to action {type(next_action).__name__}")
                 
                 #Update the next action and put into pending status
-                conn.execute("UPDATE jobs SET head_action_type = ?, head_action_class = ?, head_action_status = ?, head_action_id = ?, last_status_change = ?, workflow_stage = ? WHERE job_id = ?",
-                             (type(next_action).__name__,  next_action_class.name, next_action_status.name, -1, int(time.time()), next_workflow_stage, job_id )
+                conn.execute("UPDATE jobs SET head_action_type = ?, head_action_class = ?, head_action_status = ?, head_action_id = ?, last_status_change = ?, workflow_stage = ?, held_machine = ?, attempts = 0, failure_cause = NULL, retry_at = NULL WHERE job_id = ?",
+                             (type(next_action).__name__,  next_action_class.name, next_action_status.name, -1, int(time.time()), next_workflow_stage, held_machine, job_id )
                               )
 
                 #Gather information to initiate next action
                 if next_action_status == ActionStatus.PENDING:
-                    pending_actions.append( (next_action_class, next_action, job_id ) )
+                    pending_actions.append( (next_action_class, next_action, job_id, next_workflow_stage ) )
+
+            #Finished jobs no longer hold their cached configurations
+            conn.executemany("DELETE FROM config_cache_refs WHERE job_id = ?", [ (job_id,) for job_id in finished_jobs ])
+
 
+        if placement != None:
+            self._placement_retry_at = time.time() + self.placement.retry_delay if unplaced else None
 
         #Inform GUI regarding completed actions (requires database activity)
         for action_id, action_class in completed_actions:
@@ -391,49 +1214,641 @@ class JobData:
             elif action_class == ActionClass.COMPUTE:
                 updateGUI('update_compute', json.dumps(info))
 
-        #Initiate the required actions
-        head_action_updates = [] #(job_id, head_action_id, head_action_status, head_action_class)
+        if self.record_performance and len(completed_computes) > 0:
+            self._recordPerformance(completed_computes)
+
+        if len(finished_jobs) > 0:
+            self.evictConfigCache()
+
+        self._initiateActions(pending_actions)
+        self.releaseMachineHolds()
+        self.releaseHeldPacks()
+        self.releaseHeldComputes()
 
-        for action_class, action, job_id in pending_actions:
+    def _isDown(self, machine)->bool:
+        """Whether the machine was down when last checked. Machines not yet checked are assumed up, such that the healthy path makes no status queries"""
+        return self.health.cachedStatus(machine) == False
+
+    def recheckMachines(self, machines=None):
+        """
+        Query the status of the given machines (if None, of the down machines whose cached status has expired), e.g. after an operation on them failed
+        Return: the subset of the machines that are down
+        """
+        if machines == None:
+            now = time.time()
+            machines = [ m for m, expiry in self.health.downMachines().items() if expiry <= now ]
+        else:
+            for m in machines:
+                self.health.invalidate(m)
+        return set( m for m in machines if not self.health.isUp(m) )
+
+    def releaseMachineHolds(self):
+        """
+        Release the jobs waiting on machines that are back up: pending workflows become eligible to start, and held actions are initiated
+        (held computes under a pipeline policy are instead initiated by releaseHeldComputes as slots allow)
+        """
+        with self.conn as conn:
+            machines = [ r[0] for r in conn.execute("SELECT DISTINCT held_machine FROM jobs WHERE held_machine IS NOT NULL").fetchall() ]
+        machines = [ m for m in machines if self.health.isUp(m) ]
+        if len(machines) == 0:
+            return
+
+        pending_actions = []
+        with self.conn as conn:
+            for m in machines:
+                rows = conn.execute("SELECT job_id, workflow_stage, head_action_status, head_action_class FROM jobs WHERE held_machine = ?", (m,)).fetchall()
+                wfmanLog(f"Machine {m} is up, releasing {len(rows)} jobs waiting on it")
+                conn.execute("UPDATE jobs SET held_machine = NULL WHERE held_machine = ?", (m,))
+                for r in rows:
+                    if r['head_action_status'] != ActionStatus.HELD.name or (self.pipeline != None and r['head_action_class'] == ActionClass.COMPUTE.name):
+                        continue
+                    conn.execute("UPDATE jobs SET head_action_status = ?, last_status_change = ? WHERE job_id = ?", (ActionStatus.PENDING.name, int(time.time()), r['job_id']))
+                    pending_actions.append( (ActionClass[r['head_action_class']], self._loadAction(conn, r['job_id'], r['workflow_stage']), r['job_id'], r['workflow_stage']) )
+        self._initiateActions(pending_actions)
+
+    def _placementState(self)->dict:
+        """
+        Gather the state of the placement target machines used by _placeWorkflow: whether they are up, their estimated queue wait and their current load
+        Return: dict machine -> { "up", "wait", "load" }
+        """
+        state = { m : { "up" : self.health.isUp(m) } for m in self.placement.targets }
+        with self.conn as conn:
+            for m in state:
+                waits = sorted( r[0] for r in conn.execute("SELECT started_at - submitted_at FROM computes WHERE machine = ? AND started_at IS NOT NULL AND submitted_at IS NOT NULL ORDER BY action_id DESC LIMIT ?",
+                                                           (m, self.placement.history)).fetchall() )
+                state[m]["wait"] = waits[len(waits)//2] if len(waits) > 0 else self.placement.default_wait
+                queued = int(conn.execute("SELECT COUNT(DISTINCT api_key) FROM computes WHERE machine = ? AND action_status = ? AND api_status IN ('new','queued')",
+                                          (m, ActionStatus.ACTIVE.name)).fetchone()[0])
+                #Workflows started on the machine that have not yet reached their compute stage
+                staging = int(conn.execute("SELECT COUNT(*) FROM jobs j JOIN workflow_stages s ON s.job_id = j.job_id AND s.stage = j.workflow_stage "
+                                           "WHERE s.machine = ? AND j.workflow_stage >= 0 AND s.action_type = ? AND j.head_action_status IN (?,?)",
+                                           (m, TransferToAction.__name__, ActionStatus.ACTIVE.name, ActionStatus.COMPLETED.name)).fetchone()[0])
+                state[m]["load"] = queued + staging
+        return state
+
+    def _placeWorkflow(self, conn : sqlite3.Connection, job_id, num_stages, state : dict)->bool:
+        """
+        If the workflow has actions for ANY_MACHINE, choose its machine under the placement policy and rewrite the actions within an open transaction. The load of the chosen machine in state is updated
+        Return: False if the workflow must be placed but no target machine is up, otherwise True
+        """
+        stages = [ r['stage'] for r in conn.execute("SELECT stage FROM workflow_stages WHERE job_id = ? AND machine = ?", (job_id, ANY_MACHINE)).fetchall() ]
+        if len(stages) == 0:
+            return True
+        workflow = [ self._loadAction(conn, job_id, stage) for stage in range(num_stages) ]
+        cached = [ a for a in workflow if getattr(a, "cached", False) ]
+
+        p = self.placement
+        best = None
+        for m, ms in state.items():
+            if not ms["up"]:
+                continue
+            score = ms["wait"] + p.queue_penalty * ms["load"]
+            for a in cached:
+                entry = conn.execute("SELECT status FROM config_cache WHERE machine = ? AND source_endpoint = ? AND source_path = ?", (m, a.source_endpoint, a.source_path)).fetchone()
+                if entry != None and entry['status'] in (CacheStatus.PRESENT.name, CacheStatus.STAGING.name):
+                    score -= p.staged_credit
+            if best == None or score < best[1]:
+                best = (m, score)
+        if best == None:
+            wfmanLog(f"No placement target is available for job {job_id}, leaving it pending")
+            return False
+
+        machine = best[0]
+        wfmanLog(f"Placing job {job_id} on {machine} (expected wait {int(best[1])}s)")
+        state[machine]["load"] += 1
+        conn.execute("UPDATE workflow_stages SET machine = ? WHERE job_id = ? AND machine = ?", (machine, job_id, ANY_MACHINE))
+        for stage in stages:
+            params = { "machine" : machine }
+            if isinstance(workflow[stage], ComputeActionBase):
+                params.update( { k : v for k, v in p.targets[machine].items() if k in ("account", "queue") } )
+            conn.executemany("UPDATE action_params SET value = ? WHERE job_id = ? AND stage = ? AND name = ?",
+                             [ (json.dumps(v), job_id, stage, k) for k, v in params.items() ])
+            workflow[stage] = dataclasses.replace(workflow[stage], **params)
+
+        #Placed configurations are referenced in the cache of the chosen machine until the job finishes
+        self._referenceCachedConfigs(conn, [ (job_id, a, _configBytes(workflow)) for a in workflow if getattr(a, "cached", False) ], int(time.time()))
+        return True
+
+    def _recordPerformance(self, completed_computes):
+        """
+        Parse the logs of completed Hadrons computes and record their run times in the performance database.
+        The logs are downloaded and parsed on a background thread, such that the manager is not blocked
+        """
+        runs = [] #(job_id, action, rundir)
+        for job_id, stage in completed_computes:
+            action = self._loadAction(self.conn, job_id, stage)
+            if isinstance(action, HadronsComputeAction):
+                runs.append( (job_id, action, replaceSandboxSubstring(replaceJobIdSubstring(action.spec.job_rundir, job_id), action.machine)) )
+        if len(runs) == 0:
+            return
+        perf_model = self.perf_model if self.perf_model != None else getPerfModel()
+
+        def _record(run):
+            job_id, action, rundir = run
+            try:
+                log = downloadFile(action.machine, f"{rundir}/run.log")
+                if log != None:
+                    perf_model.recordRun(action.machine, action.spec.xml_spec, action.spec.grid, action.mpi, log,
+                                         machine_ranks_per_node.get(action.machine, 4), rundir)
+            except Exception as e:
+                wfmanLog(f"Could not record the performance of job {job_id}: {e}")
+
+        if self._perf_pool == None:
+            self._perf_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="perf_record")
+        self._perf_pool.submit(boundedMap, _record, runs, max_workers=self.max_poll_workers, key=lambda r: r[1].machine, max_per_key=self.max_poll_per_machine)
+
+    def waitForPerformanceRecords(self):
+        """Block until the run times of the computes completed so far have been recorded"""
+        if self._perf_pool != None:
+            self._perf_pool.submit(lambda: None).result()
+
+    def _initiateActions(self, pending_actions):
+        """
+        Initiate the actions (action_class, action, job_id, workflow_stage) of the given jobs, whose head is the corresponding workflow stage, and record them
+        """
+        #Initiate the required actions concurrently. The remote operations of independent jobs do not depend on one another
+        for action_class, action, job_id, _ in pending_actions:
             wfmanLog(f"Initiating action of type {action_class.name} for {job_id}")
-            aman = self.action_man[action_class]
-            action_id = aman.startAction(action, job_id)
-            action_status, _ = aman.queryStatus(action_id)
-            head_action_updates.append( (job_id, action_id, action_status, action_class) )
-            
-        ####WARNING: If the manager is killed here we can think the action is pending but it is already underway. The action DBs will know about it but not the main DB. How to fix?
-        #Maybe instead of PENDING we have some other marker, e.g. SCHEDULING. Then if we come across an entry with this status we will know to check the action DB to see if it was actually scheduled
-        
-        #Update job state DB
+        #The intent to initiate is committed before any remote operation, such that an interrupted initiation is found and reconciled by recoverInterrupted rather than repeated
+        tokens = self._markScheduling([ [job_id] for _, _, job_id, _ in pending_actions ])
+        try:
+            outcomes, followers = self._resolveCachedTransfers(pending_actions) #index -> (api_key, api_status), index -> index of the action whose transfer is shared
+            indices = [ i for i in range(len(pending_actions)) if i not in outcomes and i not in followers ]
+            results = boundedMap(lambda i: self.action_man[pending_actions[i][0]].initiate(pending_actions[i][1], pending_actions[i][2], tokens[i]), indices,
+                                 max_workers=self.max_initiate_workers, return_exceptions=True)
+            for i, res in zip(indices, results):
+                outcomes[i] = res
+            for i, leader in followers.items():
+                outcomes[i] = outcomes[leader]
+
+            #A failed initiation is held until its machine is back up if the machine has gone down, and otherwise fails the job
+            down = self.recheckMachines(set( pending_actions[i][1].machine for i, res in outcomes.items() if isinstance(res, Exception) ))
+
+            #Record the new actions and update the job state DB. For each job the action record and the head action update are committed together
+            head_action_updates = [] #(job_id, head_action_id, head_action_status, head_action_class)
+            with self.conn as conn:
+                for i, (action_class, action, job_id, workflow_stage) in enumerate(pending_actions):
+                    res = outcomes[i]
+                    if isinstance(res, Exception):
+                        wfmanLog(f"Initiation of action of type {action_class.name} for {job_id} failed: {res}")
+                        if action.machine in down:
+                            conn.execute("UPDATE jobs SET head_action_status = ?, held_machine = ?, last_status_change = ? WHERE job_id = ?",
+                                         (ActionStatus.HELD.name, action.machine, int(time.time()), job_id))
+                        else:
+                            conn.execute("UPDATE jobs SET head_action_status = ?, last_status_change = ? WHERE job_id = ?", (ActionStatus.FAILED.name, int(time.time()), job_id))
+                        continue
+                    api_key, api_status = res
+                    aman = self.action_man[action_class]
+                    action_id = aman._recordAction(conn, action, job_id, api_key, api_status, workflow_stage, tokens[i])
+                    status = aman.api_action_status_map[api_status]
+                    conn.execute("UPDATE jobs SET head_action_status = ?, head_action_id = ?, last_status_change = ? WHERE job_id = ?",
+                                 (status.name, action_id, int(time.time()), job_id )
+                                 )
+                    head_action_updates.append( (job_id, action_id, status, action_class) )
+                    if getattr(action, "cached", False) and api_key != "cached":
+                        cache_status = { ActionStatus.ACTIVE : CacheStatus.STAGING, ActionStatus.COMPLETED : CacheStatus.PRESENT }.get(status, CacheStatus.ABSENT)
+                        conn.execute("UPDATE config_cache SET status = ?, api_key = ?, last_used = ? WHERE machine = ? AND source_endpoint = ? AND source_path = ?",
+                                     (cache_status.name, api_key, int(time.time()), action.machine, action.source_endpoint, action.source_path))
+
+            #Inform GUI regarding new actions (requires database activity)
+            for _, action_id, _, action_class in head_action_updates:
+                info = self.action_man[action_class].getActionInfo(action_id)
+                if action_class == ActionClass.TRANSFER:
+                    updateGUI('add_transfer', json.dumps(info))
+                elif action_class == ActionClass.COMPUTE:
+                    updateGUI('add_compute', json.dumps(info))
+        except Exception:
+            self._recovery_needed = True #the jobs left in the SCHEDULING state are reconciled by recoverInterrupted on the next pass
+            raise
+
+    def _markScheduling(self, groups)->list:
+        """
+        Put the head actions of the given jobs into the SCHEDULING state under a new idempotency token, committed before they are initiated
+        groups: a list of lists of job ids; the jobs of a group (e.g. a pack) are initiated by a single API operation and share a token
+        Return: the token of each group
+        """
+        tokens = [ uuid.uuid4().hex for _ in groups ]
+        if len(tokens) == 0:
+            return tokens
+        with self.conn as conn:
+            conn.executemany("UPDATE jobs SET head_action_status = ?, intent_token = ? WHERE job_id = ?",
+                             [ (ActionStatus.SCHEDULING.name, token, job_id) for token, group in zip(tokens, groups) for job_id in group ])
+        return tokens
+
+    def _refreshConfigCache(self, conn : sqlite3.Connection):
+        """Update the status of cache entries whose transfer has finished"""
+        for action_status, cache_status in ( (ActionStatus.COMPLETED, CacheStatus.PRESENT), (ActionStatus.FAILED, CacheStatus.ABSENT) ):
+            conn.execute("UPDATE config_cache SET status = ? WHERE status = ? AND EXISTS (SELECT 1 FROM transfers t WHERE t.api_key = config_cache.api_key AND t.action_status = ?)",
+                         (cache_status.name, CacheStatus.STAGING.name, action_status.name))
+
+    def _resolveCachedTransfers(self, pending_actions):
+        """
+        Resolve the cached stage-in transfers among the pending actions without initiating them where possible: a file present in the cache completes immediately,
+        and a file being staged for another job shares that job's transfer. Of several pending transfers of the same uncached file only the first is initiated
+        Return: dict index -> (api_key, api_status) for the resolved actions, dict index -> index of the action whose transfer is shared
+        """
+        outcomes = {}
+        followers = {}
+        leaders = {}
+        with self.conn as conn:
+            self._refreshConfigCache(conn)
+            now = int(time.time())
+            for i, (_, action, job_id, _) in enumerate(pending_actions):
+                if not getattr(action, "cached", False):
+                    continue
+                key = (action.machine, action.source_endpoint, action.source_path)
+                if key in leaders:
+                    followers[i] = leaders[key]
+                    continue
+                entry = conn.execute("SELECT status, api_key FROM config_cache WHERE machine = ? AND source_endpoint = ? AND source_path = ?", key).fetchone()
+                t = None #the transfer staging the file, if any
+                if entry != None and entry['status'] == CacheStatus.STAGING.name:
+                    t = conn.execute("SELECT api_status FROM transfers WHERE api_key = ? ORDER BY action_id DESC LIMIT 1", (entry['api_key'],)).fetchone()
+                if entry != None and entry['status'] == CacheStatus.PRESENT.name:
+                    wfmanLog(f"Configuration {action.source_path} for job {job_id} is present in the cache on {action.machine}, skipping transfer")
+                    outcomes[i] = ("cached", "SUCCEEDED")
+                elif t != None:
+                    wfmanLog(f"Configuration {action.source_path} for job {job_id} is being staged to the cache on {action.machine}, sharing transfer {entry['api_key']}")
+                    outcomes[i] = (entry['api_key'], t['api_status'])
+                else:
+                    #Absent, or staged by a transfer that is no longer recorded: initiate the transfer
+                    leaders[key] = i
+                    continue
+                conn.execute("UPDATE config_cache SET last_used = ? WHERE machine = ? AND source_endpoint = ? AND source_path = ?", (now, *key))
+        return outcomes, followers
+
+    def evictConfigCache(self):
+        """
+        Remove the least recently used configurations that are not referenced by unfinished jobs from the cache on each machine, while the total size of the present entries exceeds config_cache_bytes.
+        Sizes are the estimates recorded at enqueue. Files that cannot be removed are retained and retried on the next eviction. Unreferenced entries that were never staged
+        (e.g. as their transfer failed) are discarded without a remote operation
+        """
+        if self.config_cache_bytes == None:
+            return
+        unreferenced = "NOT EXISTS (SELECT 1 FROM config_cache_refs r WHERE r.machine = c.machine AND r.source_endpoint = c.source_endpoint AND r.source_path = c.source_path)"
+        victims = [] #(machine, source_endpoint, source_path, cache_path)
+        with self.conn as conn:
+            self._refreshConfigCache(conn)
+            conn.execute("DELETE FROM config_cache WHERE status = ? AND NOT EXISTS (SELECT 1 FROM config_cache_refs r WHERE r.machine = config_cache.machine "
+                         "AND r.source_endpoint = config_cache.source_endpoint AND r.source_path = config_cache.source_path)", (CacheStatus.ABSENT.name,))
+            for m in conn.execute("SELECT machine, SUM(size_bytes) AS total FROM config_cache WHERE status = ? GROUP BY machine", (CacheStatus.PRESENT.name,)).fetchall():
+                excess = m['total'] - self.config_cache_bytes
+                if excess <= 0:
+                    continue
+                for e in conn.execute(f"SELECT source_endpoint, source_path, cache_path, size_bytes FROM config_cache c WHERE machine = ? AND status = ? AND {unreferenced} "
+                                      "ORDER BY last_used ASC", (m['machine'], CacheStatus.PRESENT.name)).fetchall():
+                    if excess <= 0:
+                        break
+                    victims.append( (m['machine'], e['source_endpoint'], e['source_path'], e['cache_path']) )
+                    excess -= e['size_bytes']
+
+        removed = self._removeCachedFiles(victims)
+        if len(removed) > 0:
+            wfmanLog(f"Evicted {len(removed)} configurations from the cache")
+
+    def _removeCachedFiles(self, entries)->list:
+        """
+        Remove the files of the given cache entries (machine, source_endpoint, source_path, cache_path) from their machines and delete the entries of those removed
+        Return: the keys (machine, source_endpoint, source_path) of the removed entries
+        """
+        removed = []
+        for machine, source_endpoint, source_path, cache_path in entries:
+            try:
+                if remoteRm(machine, cache_path):
+                    removed.append( (machine, source_endpoint, source_path) )
+            except Exception as e:
+                wfmanLog(f"Removal of cached configuration {machine}:{cache_path} failed: {e}")
+        if len(removed) > 0:
+            with self.conn as conn:
+                conn.executemany("DELETE FROM config_cache WHERE machine = ? AND source_endpoint = ? AND source_path = ?", removed)
+        return removed
+
+    def invalidateConfigCache(self, source_endpoint : str, source_path : str, machine : str | None = None)->int:
+        """
+        Discard the cached copies of a configuration, e.g. after the source file has changed. A changed file is detected at enqueue only if the transfers give its source_version, otherwise the cache is keyed by the source path alone.
+        Jobs that stage the configuration from now on transfer it again, replacing the cached file; jobs that have already staged it are unaffected.
+        Copies not referenced by unfinished jobs are removed from their machines
+        Args:
+           source_endpoint, source_path - The source of the configuration
+           machine - If not None, only the copy on this machine is discarded
+        Return: the number of cached copies discarded
+        """
+        query = "SELECT c.machine, c.cache_path, EXISTS (SELECT 1 FROM config_cache_refs r WHERE r.machine = c.machine AND r.source_endpoint = c.source_endpoint AND r.source_path = c.source_path) AS referenced " \
+                "FROM config_cache c WHERE c.source_endpoint = ? AND c.source_path = ?"
+        args = (source_endpoint, source_path)
+        if machine != None:
+            query += " AND c.machine = ?"
+            args += (machine,)
+        with self.conn as conn:
+            entries = conn.execute(query, args).fetchall()
+            conn.executemany("UPDATE config_cache SET status = ?, api_key = NULL WHERE machine = ? AND source_endpoint = ? AND source_path = ?",
+                             [ (CacheStatus.ABSENT.name, e['machine'], source_endpoint, source_path) for e in entries ])
+        wfmanLog(f"Invalidated {len(entries)} cached copies of {source_endpoint}:{source_path}")
+        self._removeCachedFiles([ (e['machine'], source_endpoint, source_path, e['cache_path']) for e in entries if not e['referenced'] ])
+        return len(entries)
+
+    def releaseHeldPacks(self):
+        """
+        Initiate the packs of held actions for which all members have arrived. Members that have failed before reaching the packed stage are not waited upon
+        """
+        ready = [] #(action_class, [ (job_id, workflow_stage, action) ])
+        with self.conn as conn:
+            keys = [ r[0] for r in conn.execute("SELECT DISTINCT pack_key FROM jobs WHERE head_action_status = ? AND pack_key IS NOT NULL", (ActionStatus.HELD.name,)).fetchall() ]
+            if len(keys) == 0:
+                return
+            placeholders = ",".join("?" for _ in keys)
+            by_pack = {}
+            for r in conn.execute(f"SELECT job_id, workflow_stage, head_action_status, head_action_class, pack_key FROM jobs WHERE pack_key IN ({placeholders}) ORDER BY job_id ASC", tuple(keys)).fetchall():
+                by_pack.setdefault(r['pack_key'], []).append(r)
+                
+            for key, rows in by_pack.items():
+                held = [ r for r in rows if r['head_action_status'] == ActionStatus.HELD.name ]
+                stage = min(r['workflow_stage'] for r in held)
+                outstanding = [ r['job_id'] for r in rows if r['workflow_stage'] < stage and r['head_action_status'] not in (ActionStatus.HELD.name, ActionStatus.FAILED.name) ]
+                if len(outstanding) > 0:
+                    continue
+                members = [ (r['job_id'], r['workflow_stage'], self._loadAction(conn, r['job_id'], r['workflow_stage'])) for r in held ]
+                if self._isDown(members[0][2].machine):
+                    continue #released once the machine is back up
+                ready.append( (ActionClass[held[0]['head_action_class']], members) )
+
+            if self.pipeline != None:
+                #Each compute pack occupies a single compute slot
+                free = self.pipeline.max_computes_active - self._activeComputes(conn)
+                compute_packs = [ p for p in ready if p[0] == ActionClass.COMPUTE ]
+                ready = [ p for p in ready if p[0] != ActionClass.COMPUTE ] + compute_packs[:max(free, 0)]
+
+        for action_class, members in ready:
+            wfmanLog(f"Initiating pack of {len(members)} actions of type {action_class.name} for jobs {[ m[0] for m in members ]}")
+        tokens = self._markScheduling([ [ m[0] for m in members ] for _, members in ready ])
+        try:
+            results = boundedMap(lambda n: self.action_man[ready[n][0]].initiatePack([ (job_id, action) for job_id, _, action in ready[n][1] ], tokens[n]), range(len(ready)),
+                                 max_workers=self.max_initiate_workers, return_exceptions=True)
+
+            #Record an action for each member, sharing the API key of the pack. On failure the members remain held and initiation is retried on the next pass, or once the machine is back up if it has gone down
+            self.recheckMachines(set( members[0][2].machine for (_, members), res in zip(ready, results) if isinstance(res, Exception) ))
+            new_actions = [] #(action_id, action_class)
+            with self.conn as conn:
+                for (action_class, members), res, token in zip(ready, results, tokens):
+                    if isinstance(res, Exception):
+                        wfmanLog(f"Initiation of pack for jobs {[ m[0] for m in members ]} failed: {res}")
+                        conn.executemany("UPDATE jobs SET head_action_status = ? WHERE job_id = ?", [ (ActionStatus.HELD.name, m[0]) for m in members ])
+                        continue
+                    api_key, api_status = res
+                    aman = self.action_man[action_class]
+                    status = aman.api_action_status_map[api_status]
+                    for job_id, workflow_stage, action in members:
+                        action_id = aman._recordAction(conn, action, job_id, api_key, api_status, workflow_stage, token)
+                        conn.execute("UPDATE jobs SET head_action_status = ?, head_action_id = ?, last_status_change = ? WHERE job_id = ?",
+                                     (status.name, action_id, int(time.time()), job_id )
+                                     )
+                        new_actions.append( (action_id, action_class) )
+
+            for action_id, action_class in new_actions:
+                info = self.action_man[action_class].getActionInfo(action_id)
+                if action_class == ActionClass.TRANSFER:
+                    updateGUI('add_transfer', json.dumps(info))
+                elif action_class == ActionClass.COMPUTE:
+                    updateGUI('add_compute', json.dumps(info))
+        except Exception:
+            self._recovery_needed = True #the jobs left in the SCHEDULING state are reconciled by recoverInterrupted on the next pass
+            raise
+
+
+    def releaseHeldComputes(self):
+        """
+        Under a pipeline policy, initiate the held compute actions of unpacked jobs in job order while compute slots are free. On failure the actions remain held and initiation is retried on the next pass
+        """
+        if self.pipeline == None:
+            return
+        with self.conn as conn:
+            free = self.pipeline.max_computes_active - self._activeComputes(conn)
+            if free <= 0:
+                return
+            #Computes on down machines are skipped, such that they do not occupy the free slots
+            down = [ m for m in self.health.downMachines() ]
+            placeholders = ",".join("?" for _ in down)
+            rows = conn.execute("SELECT j.job_id, j.workflow_stage FROM jobs j JOIN workflow_stages s ON s.job_id = j.job_id AND s.stage = j.workflow_stage "
+                                f"WHERE j.head_action_status = ? AND j.head_action_class = ? AND j.pack_key IS NULL AND s.machine NOT IN ({placeholders}) ORDER BY j.job_id ASC LIMIT ?",
+                                (ActionStatus.HELD.name, ActionClass.COMPUTE.name, *down, free)).fetchall()
+            pending_actions = [ (ActionClass.COMPUTE, self._loadAction(conn, r['job_id'], r['workflow_stage']), r['job_id'], r['workflow_stage']) for r in rows ]
+        if len(pending_actions) > 0:
+            wfmanLog(f"Releasing held compute actions of jobs {[ p[2] for p in pending_actions ]} into {free} free compute slots")
+            self._initiateActions(pending_actions)
+
+    def recoverInterrupted(self):
+        """
+        Reconcile the jobs left by an interrupted manager: those whose head action was being initiated (in the SCHEDULING state), and those progressed to a stage that was never initiated.
+        An action recorded under the job's idempotency token becomes its head. Otherwise the action type reports whether an initiation was made under the token (recoverAction, or recoverPack for packs),
+        which is then recorded, or the action is initiated again. Jobs on down machines are left for a later pass, and those of action types that cannot report fail rather than risk a duplicate initiation.
+        Only these jobs are touched; the others keep their recorded statuses
+        """
+        self._recovery_needed = False
+        groups = {} #token -> [ (job_id, workflow_stage, action_class, action) ]
         with self.conn as conn:
-            for job_id, action_id, status, _ in head_action_updates:
-                conn.execute("UPDATE jobs SET head_action_status = ?, head_action_id = ?, last_status_change = ? WHERE job_id = ?",
-                             (status.name, action_id, int(time.time()), job_id )
-                             )
+            for r in conn.execute("SELECT job_id, workflow_stage, head_action_class, intent_token FROM jobs WHERE head_action_status = ? ORDER BY job_id ASC", (ActionStatus.SCHEDULING.name,)).fetchall():
+                action_class = ActionClass[r['head_action_class']]
+                entry = conn.execute(f"SELECT action_id, action_status FROM {self.action_man[action_class].table_name} WHERE token = ? AND job_id = ?", (r['intent_token'], r['job_id'])).fetchone()
+                if entry != None:
+                    wfmanLog(f"Recovered the recorded action {entry['action_id']} of job {r['job_id']}")
+                    conn.execute("UPDATE jobs SET head_action_status = ?, head_action_id = ?, last_status_change = ? WHERE job_id = ?", (entry['action_status'], entry['action_id'], int(time.time()), r['job_id']))
+                    continue
+                groups.setdefault(r['intent_token'], []).append( (r['job_id'], r['workflow_stage'], action_class, self._loadAction(conn, r['job_id'], r['workflow_stage'])) )
+            stranded = conn.execute("SELECT job_id, workflow_stage, head_action_class FROM jobs WHERE head_action_status = ? AND workflow_stage >= 0 AND head_action_class != ? ORDER BY job_id ASC",
+                                    (ActionStatus.PENDING.name, ActionClass.NONE.name)).fetchall()
+            stranded = [ (ActionClass[r['head_action_class']], self._loadAction(conn, r['job_id'], r['workflow_stage']), r['job_id'], r['workflow_stage']) for r in stranded ]
+        if len(groups) == 0 and len(stranded) == 0:
+            return
 
-        #Inform GUI regarding new actions (requires database activity)
-        for _, action_id, _, action_class in head_action_updates:
+        #Ask the action types whether the interrupted initiations were made
+        down = self.recheckMachines(set( members[0][3].machine for members in groups.values() ))
+        resolved = [] #(members, token, api_key, api_status)
+        again = [] #members
+        unrecoverable = [] #members
+        for token, members in groups.items():
+            job_id, _, action_class, action = members[0]
+            if action.machine in down:
+                self._recovery_needed = True
+                continue
+            packed = getattr(action, "pack_key", None) != None
+            recover = getattr(type(action), "recoverPack", None) if packed else getattr(action, "recoverAction", None)
+            if recover == None:
+                unrecoverable.append(members)
+                continue
+            try:
+                api_key = recover([ (m[0], m[3]) for m in members ], token) if packed else recover(job_id, token)
+                if api_key == None:
+                    again.append(members)
+                else:
+                    resolved.append( (members, token, api_key, self.action_man[action_class]._queryStatusInternal(action.machine, api_key)) )
+            except Exception as e:
+                wfmanLog(f"Recovery of the interrupted initiation for jobs {[ m[0] for m in members ]} failed, retrying on the next pass: {e}")
+                self._recovery_needed = True
+
+        pending_actions = []
+        new_actions = [] #(action_id, action_class)
+        with self.conn as conn:
+            now = int(time.time())
+            for members, token, api_key, api_status in resolved:
+                aman = self.action_man[members[0][2]]
+                status = aman.api_action_status_map[api_status]
+                for job_id, workflow_stage, action_class, action in members:
+                    wfmanLog(f"Recovered the interrupted initiation of job {job_id} as {api_key}")
+                    action_id = aman._recordAction(conn, action, job_id, api_key, api_status, workflow_stage, token)
+                    conn.execute("UPDATE jobs SET head_action_status = ?, head_action_id = ?, last_status_change = ? WHERE job_id = ?", (status.name, action_id, now, job_id))
+                    new_actions.append( (action_id, action_class) )
+            for members in again:
+                for job_id, workflow_stage, action_class, action in members:
+                    wfmanLog(f"The interrupted initiation of job {job_id} was not made, initiating it again")
+                    if getattr(action, "pack_key", None) != None or (self.pipeline != None and action_class == ActionClass.COMPUTE):
+                        conn.execute("UPDATE jobs SET head_action_status = ? WHERE job_id = ?", (ActionStatus.HELD.name, job_id))
+                    else:
+                        pending_actions.append( (action_class, action, job_id, workflow_stage) )
+            for members in unrecoverable:
+                wfmanLog(f"Cannot determine whether the interrupted initiation of jobs {[ m[0] for m in members ]} was made; marking them failed")
+                conn.executemany("UPDATE jobs SET head_action_status = ?, failure_cause = ?, last_status_change = ? WHERE job_id = ?", [ (ActionStatus.FAILED.name, "unrecoverable", now, m[0]) for m in members ])
+            for p in stranded:
+                wfmanLog(f"Job {p[2]} was progressed to stage {p[3]} but not initiated, initiating it")
+                if self.pipeline != None and p[0] == ActionClass.COMPUTE:
+                    conn.execute("UPDATE jobs SET head_action_status = ? WHERE job_id = ?", (ActionStatus.HELD.name, p[2]))
+                else:
+                    pending_actions.append(p)
+
+        for action_id, action_class in new_actions:
             info = self.action_man[action_class].getActionInfo(action_id)
             if action_class == ActionClass.TRANSFER:
                 updateGUI('add_transfer', json.dumps(info))
             elif action_class == ActionClass.COMPUTE:
                 updateGUI('add_compute', json.dumps(info))
+        self._initiateActions(pending_actions)
 
-                
+    def _classifyFailure(self, job_id, action_class, action, head_action_id, api_status, pack_job_id)->str:
+        """
+        Classify the cause of the failure of a job's head action (see retry_policy.classifyFailure). Hadrons computes are classified from the err.log and run.log of their run directory,
+        and of their pack's directory for packed jobs (the members of a pack are failed individually from their exit codes; see _resolvePackMembers)
+        """
+        if head_action_id == -1:
+            return "initiation"
+        if action_class == ActionClass.TRANSFER:
+            return "transfer"
+        if not isinstance(action, HadronsComputeAction):
+            return classifyFailure("", api_status)
+        def _download(path):
+            try:
+                return downloadFile(action.machine, path)
+            except Exception as e:
+                wfmanLog(f"Could not download {action.machine}:{path}: {e}")
+                return None
+        rundirs = [ replaceSandboxSubstring(replaceJobIdSubstring(action.spec.job_rundir, job_id), action.machine) ]
+        if action.pack_key != None:
+            rundirs.append(HadronsComputeAction._packRundir([ (pack_job_id, action) ]))
+        logs = [ _download(f"{d}/{f}") for d in rundirs for f in ("err.log", "run.log") ]
+        return classifyFailure("\n".join(l for l in logs if l != None), api_status)
+
+    def retryFailedActions(self):
+        """
+        Under the retry policies, classify the causes of newly failed head actions and schedule retries of those the policy of their class permits, after its backoff.
+        Retries that are due are initiated again, after a timeout with a longer walltime
+        """
+        if self.retry == None:
+            return
+        now = int(time.time())
+        entries = [] #(job_id, workflow_stage, attempts, action_class, action, head_action_id, api_status, pack_job_id)
+        with self.conn as conn:
+            for r in conn.execute("SELECT job_id, workflow_stage, head_action_class, head_action_id, attempts FROM jobs WHERE head_action_status = ? AND failure_cause IS NULL AND head_action_class != ?",
+                                  (ActionStatus.FAILED.name, ActionClass.NONE.name)).fetchall():
+                action_class = ActionClass[r['head_action_class']]
+                table = self.action_man[action_class].table_name
+                row = conn.execute(f"SELECT api_key, api_status FROM {table} WHERE action_id = ?", (r['head_action_id'],)).fetchone()
+                pack_job_id = None if row == None else conn.execute(f"SELECT MIN(job_id) FROM {table} WHERE api_key = ?", (row['api_key'],)).fetchone()[0]
+                entries.append( (r['job_id'], r['workflow_stage'], r['attempts'], action_class, self._loadAction(conn, r['job_id'], r['workflow_stage']), r['head_action_id'],
+                                 None if row == None else row['api_status'], pack_job_id) )
 
+        causes = boundedMap(lambda e: self._classifyFailure(e[0], *e[3:]), entries, max_workers=self.max_initiate_workers, return_exceptions=True)
+
+        pending_actions = []
+        with self.conn as conn:
+            for (job_id, workflow_stage, attempts, action_class, action, head_action_id, _, _), cause in zip(entries, causes):
+                if isinstance(cause, Exception):
+                    cause = "unknown"
+                policy = self.retry.get(action_class)
+                retry_at = None
+                if policy != None and policy.retries(cause, attempts+1):
+                    retry_at = now + int(policy.delay(attempts+1))
+                    wfmanLog(f"Action {type(action).__name__} of job {job_id} failed ({cause}), retry {attempts+1} of {policy.max_attempts-1} in {retry_at - now}s")
+                else:
+                    wfmanLog(f"Action {type(action).__name__} of job {job_id} failed ({cause}) and will not be retried")
+                conn.execute("UPDATE jobs SET failure_cause = ?, retry_at = ? WHERE job_id = ?", (cause, retry_at, job_id))
+
+            for r in conn.execute("SELECT job_id, workflow_stage, head_action_class, failure_cause FROM jobs WHERE head_action_status = ? AND retry_at IS NOT NULL AND retry_at <= ? ORDER BY job_id ASC",
+                                  (ActionStatus.FAILED.name, now)).fetchall():
+                job_id, stage = r['job_id'], r['workflow_stage']
+                action_class = ActionClass[r['head_action_class']]
+                action = self._loadAction(conn, job_id, stage)
+                policy = self.retry[action_class]
+                if r['failure_cause'] == "timeout" and isinstance(action, ComputeActionBase):
+                    walltime = scaleWalltime(action.time, policy.walltime_factor, policy.max_walltime)
+                    wfmanLog(f"Increasing the walltime of job {job_id} from {action.time} to {walltime}")
+                    conn.execute("UPDATE action_params SET value = ? WHERE job_id = ? AND stage = ? AND name = ?", (json.dumps(walltime), job_id, stage, "time"))
+                    action = dataclasses.replace(action, time=walltime)
+                held = getattr(action, "pack_key", None) != None or (self.pipeline != None and action_class == ActionClass.COMPUTE)
+                conn.execute("UPDATE jobs SET head_action_status = ?, head_action_id = -1, attempts = attempts + 1, failure_cause = NULL, retry_at = NULL, last_status_change = ? WHERE job_id = ?",
+                             ((ActionStatus.HELD if held else ActionStatus.PENDING).name, now, job_id))
+                if not held:
+                    pending_actions.append( (action_class, action, job_id, stage) )
+        if len(pending_actions) > 0:
+            wfmanLog(f"Retrying the actions of jobs {[ p[2] for p in pending_actions ]}")
+        self._initiateActions(pending_actions)
+
+    def _activeComputes(self, conn : sqlite3.Connection)->int:
+        """The number of compute jobs in flight, counting the members of a pack once"""
+        return int(conn.execute("SELECT COUNT(DISTINCT api_key) FROM computes WHERE action_status = ?", (ActionStatus.ACTIVE.name,)).fetchone()[0])
+
+    def _pipelineCandidates(self, conn : sqlite3.Connection)->list:
+        """
+        Under a pipeline policy, return the ids of the pending workflows that can be started without exceeding the stage-in budget, the prefetch depth or the scratch space
+        """
+        p = self.pipeline
+        staging = int(conn.execute("SELECT COUNT(*) FROM jobs WHERE head_action_status = ? AND head_action_type = ?", (ActionStatus.ACTIVE.name, TransferToAction.__name__)).fetchone()[0])
+        staged = int(conn.execute("SELECT COUNT(*) FROM jobs WHERE head_action_status = ? AND head_action_class = ?", (ActionStatus.HELD.name, ActionClass.COMPUTE.name)).fetchone()[0])
+        rem = min(p.max_transfers_active - staging, p.depth() - staging - staged)
+        if rem <= 0:
+            return []
+        chosen = self._selectPending(conn, rem, not_started_only=True)
+        scratch = { r[0] : r[1] for r in conn.execute(f"SELECT job_id, scratch_bytes FROM jobs WHERE job_id IN ({','.join('?' for _ in chosen)})", tuple(chosen)).fetchall() }
+        candidates = [ { "job_id" : job_id, "scratch_bytes" : scratch[job_id] } for job_id in chosen ]
+        if p.scratch_bytes == None:
+            return [ c['job_id'] for c in candidates ]
+
+        used = int(conn.execute("SELECT COALESCE(SUM(scratch_bytes), 0) FROM jobs WHERE workflow_stage >= 0 AND head_action_class != ?", (ActionClass.NONE.name,)).fetchone()[0])
+        out = []
+        for c in candidates:
+            if used + c['scratch_bytes'] > p.scratch_bytes:
+                if used == 0:
+                    wfmanLog(f"Job {c['job_id']} requires an estimated {c['scratch_bytes']} bytes of scratch, more than the available {p.scratch_bytes}; starting it regardless")
+                else:
+                    break #wait for running workflows to finish, preserving the job order
+            used += c['scratch_bytes']
+            out.append(c['job_id'])
+        return out
 
     def startWorkflows(self, job_ids : list | None = None):
         """
-        Start the workflows specified by the list of job ids. If None, additional workflows will be started until the total number of active workflows reaches the maximum
+        Start the workflows specified by the list of job ids. If None, additional workflows will be started until the total number of active workflows reaches the maximum,
+        or under a pipeline policy, as far as its budgets allow, shared between the job groups according to their priorities, deadlines and weights (see setJobGroup)
         """
-        if job_ids == None:        
+        if job_ids == None and self.pipeline != None:
+            with self.conn as conn:
+                job_ids = self._pipelineCandidates(conn)
+            if len(job_ids) > 0:
+                wfmanLog("Pipeline activating",len(job_ids),"workflows with job ids", job_ids)
+        elif job_ids == None:        
             with self.conn as conn:
                 count = int(conn.execute("SELECT COUNT(*) FROM jobs WHERE head_action_status = ?", (ActionStatus.ACTIVE.name,) ).fetchone()[0])
                 rem =  self.max_workflows_active - count
 
                 if rem > 0:
-                    toschedule = conn.execute("SELECT job_id FROM jobs WHERE head_action_status = ? ORDER BY job_id ASC LIMIT ?", (ActionStatus.PENDING.name, rem)).fetchall()                   
-                    job_ids = [ j[0] for j in toschedule ]
+                    job_ids = self._selectPending(conn, rem)
                     if len(job_ids) > 0:
                         wfmanLog("Number of active workflows",count,"want to activate",rem,"more.\nActivating",len(job_ids),"workflows with job ids", job_ids)
 
@@ -456,34 +1871,90 @@ class JobData:
 
         Return: dict  job_id -> new status
         """       
+        self.recheckMachines() #down machines are checked for their return at the interval of their cached status
+
         with self.conn as conn:
-            active_actions = conn.execute("SELECT head_action_id, job_id, head_action_type, head_action_class FROM jobs WHERE head_action_status = ?", (ActionStatus.ACTIVE.name, )).fetchall()
+            active_actions = conn.execute("SELECT head_action_id, job_id, workflow_stage, head_action_type, head_action_class, pack_key FROM jobs WHERE head_action_status = ?", (ActionStatus.ACTIVE.name, )).fetchall()
 
-        updates = {}
+        #Gather the cached statuses and the polling tasks for stale actions of every class
+        by_class = {}
         for t in active_actions:
-            job_id = t['job_id']
-            action_class = getattr(ActionClass, t['head_action_class'], None)
-            aman = self.action_man[action_class] 
-            action_status, _ = aman.queryStatus(t['head_action_id'], update_freq=poll_freq, force_update = force_poll)
-            if action_status != ActionStatus.ACTIVE:
-                updates[job_id] = action_status
-            if job_id in updates:
-                wfmanLog(f"Progressed job {job_id} action {t['head_action_type']} of class {action_class.name} to {updates[job_id].name}")
-                
-        #Update head action state
-        if len(updates) > 0:
-            with self.conn as conn:
-                for job_id, status in updates.items():
-                    conn.execute("UPDATE jobs SET head_action_status = ? WHERE job_id = ?",(status.name, job_id))
+            by_class.setdefault(getattr(ActionClass, t['head_action_class'], None), []).append(t)
+
+        statuses = {} #action_class -> { action_id -> (action_status, api_status) }
+        tasks = []
+        for action_class, class_actions in by_class.items():
+            aman = self.action_man[action_class]
+            statuses[action_class], stale = aman._splitStale([ t['head_action_id'] for t in class_actions ], poll_freq, force_poll)
+            stale = [ t for t in stale if not self._isDown(t['machine']) ] #polling of down machines is suspended; their actions retain their last known status
+            tasks += [ (aman, machine, rows) for machine, rows in aman._pollTasks(stale) ]
+
+        #Poll the API concurrently; the tick latency is that of the slowest single query
+        polled = pollConcurrently(tasks, self.max_poll_workers, self.max_poll_per_machine)
+        self.recheckMachines(set( machine for (_, machine, rows), res in zip(tasks, polled) if len(res) == 0 and len(rows) > 0 )) #a failed query may indicate an outage
+
+        updates = {}
+        finished_packed = [] #(job_id, action_id, action) for members of packs that have left the ACTIVE state
+        with self.conn as conn:
+            #Record the polled statuses for all classes in one transaction
+            for action_class, aman in self.action_man.items():
+                api_statuses = {}
+                for (task_aman, _, _), res in zip(tasks, polled):
+                    if task_aman is aman:
+                        api_statuses.update(res)
+                if len(api_statuses) > 0:
+                    statuses[action_class].update(aman._writeStatuses(conn, api_statuses))
+
+            for action_class, class_actions in by_class.items():
+                for t in class_actions:
+                    job_id = t['job_id']
+                    if t['head_action_id'] not in statuses[action_class]:
+                        continue #status query failed, retry on the next tick
+                    action_status, _ = statuses[action_class][t['head_action_id']]
+                    if action_status != ActionStatus.ACTIVE:
+                        updates[job_id] = action_status
+                        wfmanLog(f"Progressed job {job_id} action {t['head_action_type']} of class {action_class.name} to {updates[job_id].name}")
+                        if t['pack_key'] != None and action_status in (ActionStatus.COMPLETED, ActionStatus.FAILED):
+                            finished_packed.append( (job_id, t['head_action_id'], self._loadAction(conn, job_id, t['workflow_stage'])) )
+
+            #Update head action state
+            conn.executemany("UPDATE jobs SET head_action_status = ? WHERE job_id = ?", [ (status.name, job_id) for job_id, status in updates.items() ])
+
+        if len(finished_packed) > 0:
+            self._resolvePackMembers(finished_packed, updates)
         return updates
 
+    def _resolvePackMembers(self, finished_packed, updates):
+        """
+        The members of a pack share its batch job and hence its API status, but one member's run can fail while the others succeed.
+        Set the status of each member of a finished pack from the exit code of its own run, retaining the pack's status where that cannot be read
+        finished_packed: list of (job_id, action_id, action)
+        updates: dict job_id -> new status, updated in place
+        """
+        exit_codes = boundedMap(lambda m: m[2].packExitCode(m[0]) if hasattr(m[2], "packExitCode") else None, finished_packed,
+                                max_workers=self.max_poll_workers, key=lambda m: m[2].machine, max_per_key=self.max_poll_per_machine)
+        table = self.action_man[ActionClass.COMPUTE].table_name
+        with self.conn as conn:
+            for (job_id, action_id, action), exit_code in zip(finished_packed, exit_codes):
+                if exit_code == None:
+                    continue
+                status = ActionStatus.COMPLETED if exit_code == 0 else ActionStatus.FAILED
+                if status != updates[job_id]:
+                    wfmanLog(f"The run of job {job_id} in pack {action.pack_key} exited with code {exit_code}, setting its status to {status.name}")
+                    updates[job_id] = status
+                    conn.execute("UPDATE jobs SET head_action_status = ? WHERE job_id = ?", (status.name, job_id))
+                    conn.execute(f"UPDATE {table} SET action_status = ? WHERE action_id = ?", (status.name, action_id))
+
 
     def progressActiveState(self, poll_freq=30, force_poll=False):
         """
         Updates knowledge of action state and then progresses the workflow for those actions that have completed
         poll_freq: control the minimum time lag between manager polls of the API for status updates. Queries within this period return only the cached status.
         force_poll: force the manager to poll the API for status updates, use wisely!"""
+        if self._recovery_needed:
+            self.recoverInterrupted()
         self.progressActiveActions(poll_freq=poll_freq, force_poll=force_poll)
+        self.retryFailedActions()
         self.progressActiveWorkflows()
     
     def countWorkflowsWithStatus(self, statuses : ActionStatus | list[ActionStatus]):
@@ -501,6 +1972,47 @@ class JobData:
             else:
                 raise Exception("Unexpected type for 'statuses'", type(statuses))
 
+    def countPendingRetries(self)->int:
+        """The number of workflows whose failed head action is due to be retried"""
+        with self.conn as conn:
+            return int(conn.execute("SELECT COUNT(*) FROM jobs WHERE head_action_status = ? AND retry_at IS NOT NULL", (ActionStatus.FAILED.name,)).fetchone()[0])
+
+    def getPollSchedule(self, poll_freq=30)->list:
+        """
+        Get the times at which the head actions of active workflows are next due a status poll
+        Return: a list of tuples (due_time, action_class, action_id)
+        """
+        out = []
+        down = self.health.downMachines()
+        for action_class, aman in self.action_man.items():
+            out += [ (due, action_class, action_id) for due, action_id in aman.getPollSchedule(poll_freq, exclude_machines=tuple(down.keys())) ]
+        out += [ (recheck, ActionClass.NONE, -1) for recheck in down.values() ] #check whether down machines are back up
+        if self._placement_retry_at != None:
+            out.append( (self._placement_retry_at, ActionClass.NONE, -1) ) #retry the placement of pending workflows
+        if self.retry != None:
+            with self.conn as conn:
+                retry_at = conn.execute("SELECT MIN(retry_at) FROM jobs WHERE head_action_status = ? AND retry_at IS NOT NULL", (ActionStatus.FAILED.name,)).fetchone()[0]
+            if retry_at != None:
+                out.append( (retry_at, ActionClass.NONE, -1) ) #retry failed actions
+        return out
+
+    def hasImmediateWork(self)->bool:
+        """
+        Return True if there are workflows that can be progressed without waiting on the API, i.e. completed head actions with remaining workflow stages or pending workflows and free active slots
+        """
+        with self.conn as conn:
+            if conn.execute("SELECT 1 FROM jobs WHERE head_action_class != ? AND head_action_status = ? LIMIT 1", (ActionClass.NONE.name, ActionStatus.COMPLETED.name) ).fetchone() != None:
+                return True
+            if self._placement_retry_at != None and time.time() < self._placement_retry_at:
+                return False #pending workflows are waiting for a placement target
+            if self.pipeline != None:
+                return len(self._pipelineCandidates(conn)) > 0
+            if self.max_workflows_active > 0:
+                count = int(conn.execute("SELECT COUNT(*) FROM jobs WHERE head_action_status = ?", (ActionStatus.ACTIVE.name,) ).fetchone()[0])
+                if count < self.max_workflows_active and conn.execute("SELECT 1 FROM jobs WHERE head_action_status = ? AND held_machine IS NULL LIMIT 1", (ActionStatus.PENDING.name,) ).fetchone() != None:
+                    return True
+        return False
+    
     def getActiveActions(self, action_class : ActionClass)->dict:
         """
         Get all active actions and returning a list of dictionaries, each containing "api_key", "api_status" and other custom fields defined on a per-action basis
@@ -510,16 +2022,30 @@ class JobData:
 
             
 class JobManager:
-    def __init__(self, filename: str | None = None, poll_freq=30, max_workflows_active=10):
+    def __init__(self, filename: str | None = None, poll_freq=30, max_workflows_active=10, max_initiate_workers=4, pipeline : PipelinePolicy | None = None,
+                 config_cache_bytes : int | None = None, perf_model : PerfModel | None = None, placement : PlacementPolicy | None = None, machine_health : MachineHealth | None = None,
+                 retry : dict | None = None, record_performance=True):
         """
         poll_freq: how often the action monitors poll the API for status updates
         max_workflows_active: if >0, the manager will attempt to maintain this many active workflows, activating more when others finish; if 0, they must be activated manually
+        max_initiate_workers: the maximum number of workflow actions that are initiated concurrently
+        pipeline: if not None, workflows are scheduled under this policy such that stage-in overlaps compute, instead of the max_workflows_active limit
+        config_cache_bytes: the size in bytes of the configuration cache on each machine beyond which unreferenced configurations are evicted. Required to enqueue cached transfers
+        perf_model: the database in which the run times of completed Hadrons computes are recorded; if None, the process-wide database (see perf_model.getPerfModel)
+        record_performance: if False, the run times of completed computes are not recorded
+        placement: if not None, workflows enqueued for ANY_MACHINE are assigned to one of its target machines when they start
+        machine_health: the cached machine availability; workflows on a down machine are paused and resumed when it is back up while the others progress
+        retry: if not None, dict ActionClass -> RetryPolicy under which failed actions are retried (see defaultRetryPolicies)
         """
         
-        self.job_data = JobData(filename, max_workflows_active=max_workflows_active)
+        self.job_data = JobData(filename, max_workflows_active=max_workflows_active, max_initiate_workers=max_initiate_workers, pipeline=pipeline,
+                                config_cache_bytes=config_cache_bytes, perf_model=perf_model, placement=placement, machine_health=machine_health, retry=retry,
+                                record_performance=record_performance)
         self._stop = threading.Event()
+        self._wake = threading.Event()
         self._thread = None
         self._lock = threading.Lock()
+        self._due = [] #priority queue of (due_time, action_class, action_id) for the next status checks
         self.poll_freq = poll_freq
 
     def isAlive(self):
@@ -532,6 +2058,19 @@ class JobManager:
         self._thread = threading.Thread(target=self._run)
         self._thread.start()
 
+    def notify(self):
+        """
+        Wake the manager thread so that it reacts immediately, e.g. after workflows are enqueued or modified, or on an external notification
+        """
+        self._wake.set()
+
+    def nextCheckDue(self)->float | None:
+        """
+        The time at which the manager next polls the API, or None if it is idle until notified
+        """
+        due = self._due
+        return due[0][0] if len(due) > 0 else None
+        
     def stop(self, wait_until_done=True):
         """
         Ask the manager thread to stop and wait until it does.
@@ -539,40 +2078,82 @@ class JobManager:
         """
         def __nincomplete():
             with self._lock:
-                return self.job_data.countWorkflowsWithStatus([ ActionStatus.PENDING, ActionStatus.ACTIVE, ActionStatus.COMPLETED ]) #note, complete (non-null) actions are awaiting progression
+                return self.job_data.countWorkflowsWithStatus([ ActionStatus.PENDING, ActionStatus.ACTIVE, ActionStatus.COMPLETED, ActionStatus.HELD, ActionStatus.SCHEDULING ]) \
+                    + self.job_data.countPendingRetries() #note, complete (non-null) actions are awaiting progression
         
         if wait_until_done:
             while(__nincomplete() > 0):
                 time.sleep(2)
         
         self._stop.set()
+        self._wake.set()
 
         if self._thread is not None:
             self._thread.join()
+        self.job_data.waitForPerformanceRecords()
 
-    def _run(self):
-        self._lock.acquire()
+    def _tick(self):
+        """
+        Progress the workflows and rebuild the schedule of status checks. Must be called under lock
+        """
+        self.job_data.progressActiveState(poll_freq=self.poll_freq) #attempt to progress active workflows; only actions due a poll query the API
+        self.job_data.startWorkflows() #start new workflows as required
+        
+        due = self.job_data.getPollSchedule(self.poll_freq)
+        heapq.heapify(due)
+        self._due = due
         
+    def _run(self):
         while not self._stop.is_set():
-            #A safe checkpoint for allowing the user to obtain a lock and modify the state (e.g. manually activating workflows, restarting after failure, etc)
-            self._lock.release()
-            time.sleep(0.5)
-            self._lock.acquire()
-            
-            if self._stop.is_set():
-                break
+            #Outside of the tick the lock is free for the user to obtain and modify the state (e.g. manually activating workflows, restarting after failure, etc)
+            with self._lock:
+                if self._stop.is_set():
+                    break
+                self._wake.clear()
+                try:
+                    self._tick()
+                    immediate = self.job_data.hasImmediateWork()
+                except Exception as e:
+                    #The state is committed per transaction, so the next tick resumes from where this one failed
+                    wfmanLog(f"Manager tick failed, retrying in {self.poll_freq}s: {e}")
+                    self.job_data._recovery_needed = True #reconcile any initiation the failure interrupted
+                    self._due = [ (time.time() + self.poll_freq, ActionClass.NONE, -1) ]
+                    immediate = False
+
+            #Sleep until the next status check is due or we are woken by a notification. With nothing due we wait indefinitely
+            if immediate:
+                continue
+            due = self.nextCheckDue()
+            self._wake.wait(timeout = None if due == None else max(due - time.time(), 0.))
 
-            self.job_data.startWorkflows() #start new workflows as required
-            self.job_data.progressActiveState(poll_freq=self.poll_freq) #attempt to progress active workflows
-            time.sleep(2)
-        self._lock.release()
+    def setJobGroup(self, job_group : str, priority : int | None = None, weight : float | None = None, deadline : float | None = None):
+        """
+        Set the scheduling parameters of a job group; see JobData.setJobGroup. Takes effect when workflows are next started
+        """
+        return self(lambda jd: jd.setJobGroup(job_group, priority=priority, weight=weight, deadline=deadline))
+
+    def getJobGroups(self)->list:
+        """
+        Return the scheduling parameters and progress of the job groups; see JobData.getJobGroups
+        """
+        with self._lock:
+            return self.job_data.getJobGroups()
+
+    def invalidateConfigCache(self, source_endpoint : str, source_path : str, machine : str | None = None)->int:
+        """
+        Discard the cached copies of a configuration whose source file has changed, such that it is transferred again; see JobData.invalidateConfigCache
+        """
+        return self(lambda jd: jd.invalidateConfigCache(source_endpoint, source_path, machine))
 
     def __call__(self, op_lambda):
         """
         Perform an operation on the JobData database under lock
         """
-        with self._lock:
-            return op_lambda(self.job_data)
+        try:
+            with self._lock:
+                return op_lambda(self.job_data)
+        finally:
+            self.notify()
         
     def __enter__(self):
         """
@@ -583,6 +2164,7 @@ class JobManager:
         
     def __exit__(self,exc_type, exc_val, exc_tb):
         self._lock.release() #unlock before exception!
+        self.notify() #the user may have modified the state
         if exc_type:
             raise Exception("Caught exception",exc_type,exc_val,exc_tb)
             
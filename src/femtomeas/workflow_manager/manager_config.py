@@ -31,6 +31,9 @@ else:
 class HadronsConfig(BaseModel):
     bin: str = Field(..., description="The path to the 'bin' directory of the Hadrons install")
     env: str = Field("", description="Bash commands required to set up the Hadrons environment")
+    template: str | None = Field(None, description="The name of a built-in set of batch script templates, or the path of a job script template file. Defaults to the machine name in lower case")
+    pack_template: str | None = Field(None, description="For a template file, the path of the template file for packs of runs")
+    template_params: dict[str, str | int] = Field({}, description="Overrides of the machine parameters of the template, e.g. shm, device_mem, ranks_per_node")
 
 class AgentConfig(BaseModel):
     i2api_key_path: str = Field(..., description="Path to a file containing the AmSC I2 API key")
@@ -0,0 +1,225 @@
+import sqlite3
+import math
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Tuple, List
+from .logging import wfmanLog
+from .hadrons import rankGeometries
+
+#A Grid/Hadrons log line:  "<tag> : <level> : <timestamp> : <message>", where the timestamp is the time elapsed since the start of the run,
+#either in seconds ("12.345678 s") or as hh:mm:ss(.ffffff)
+_log_line = re.compile(r"^\s*(\w+)\s*:\s*(\w+)\s*:\s*(?:(\d+(?:\.\d*)?)\s*s|(\d+):(\d{2}):(\d{2}(?:\.\d*)?))\s*:\s?(.*)$")
+_module_step = re.compile(r"Measurement step \d+/\d+ \(module '([^']+)'\)")
+_solver_converged = re.compile(r"[Cc]onverged on iteration\s+(\d+)")
+
+def parseHadronsLog(text : str)->dict | None:
+    """
+    Extract timing information from the log of a Hadrons run, as written with the Message and Performance log levels enabled
+    Return: None if the log contains no timestamped lines, otherwise a dictionary with entries
+       "wall_seconds" - the elapsed time at the last log line
+       "module_seconds" - a dictionary mapping the module name to the time spent in its measurement step
+       "solver_iterations" - the total number of iterations of converged solves
+    """
+    wall = None
+    modules = {}
+    current = None #(module, start time)
+    iterations = 0
+    for line in text.splitlines():
+        m = _log_line.match(line)
+        if m == None:
+            continue
+        if m.group(3) != None:
+            stamp = float(m.group(3))
+        else:
+            stamp = 3600*int(m.group(4)) + 60*int(m.group(5)) + float(m.group(6))
+        wall = stamp if wall == None else max(wall, stamp)
+        msg = m.group(7)
+
+        s = _module_step.search(msg)
+        if s != None:
+            if current != None:
+                modules[current[0]] = modules.get(current[0], 0.) + stamp - current[1]
+            current = (s.group(1), stamp)
+            continue
+        s = _solver_converged.search(msg)
+        if s != None:
+            iterations += int(s.group(1))
+
+    if wall == None:
+        return None
+    if current != None:
+        modules[current[0]] = modules.get(current[0], 0.) + wall - current[1]
+    return { "wall_seconds" : wall, "module_seconds" : modules, "solver_iterations" : iterations }
+
+def _moduleKey(module, base_type)->str:
+    opts = module.find("options")
+    if base_type == "MAction::DWF" and opts != None and opts.find("Ls") != None:
+        return f"{base_type}(Ls={opts.find('Ls').text.strip()})" #the cost of DWF scales with Ls
+    return base_type
+
+def workloadKey(xml_spec : bytes)->Tuple[str,str]:
+    """
+    Summarize the workload of a Hadrons XML by the types of its action and solver modules (template arguments removed)
+    Return: (action, solver), each a '+'-separated sorted list of module types
+    """
+    root = ET.fromstring(xml_spec)
+    actions, solvers = set(), set()
+    for module in root.iter("module"):
+        mtype = module.find("id/type")
+        if mtype == None or mtype.text == None:
+            continue
+        base_type = mtype.text.strip().split('<')[0]
+        if base_type.startswith("MAction::"):
+            actions.add(_moduleKey(module, base_type))
+        elif base_type.startswith("MSolver::"):
+            solvers.add(base_type)
+    return "+".join(sorted(actions)), "+".join(sorted(solvers))
+
+def defaultPerfModelFile()->str:
+    """The default location of the performance database, overridable with the FEMTOMEAS_PERF_DB environment variable"""
+    return os.getenv("FEMTOMEAS_PERF_DB", str(Path("~/.femtomeas/hadrons_perf.db").expanduser()))
+
+class PerfModel:
+    """
+    A per-machine database of the run times of completed Hadrons jobs, keyed by lattice volume, action and solver, from which the run time of new jobs is
+    predicted and the node count and walltime are recommended
+    """
+    def __init__(self, filename : str | None = None):
+        """
+        filename: the SQLite database file; if None the database is held in memory
+        """
+        self._lock = threading.Lock()
+        db_path = ":memory:" if filename == None else str(Path(filename).expanduser())
+        if filename != None:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.filename = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA busy_timeout = 5000")
+        with self.conn as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS hadrons_runs (
+            id INTEGER PRIMARY KEY,
+            machine TEXT NOT NULL,
+            volume INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            solver TEXT NOT NULL,
+            ranks INTEGER NOT NULL,
+            nodes INTEGER NOT NULL,
+            wall_seconds REAL NOT NULL,
+            solver_iterations INTEGER,
+            run_dir TEXT UNIQUE,
+            recorded_at REAL NOT NULL
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_hadrons_runs_key ON hadrons_runs(machine, action, solver, volume)")
+
+    def record(self, machine : str, grid : Tuple[int,int,int,int], action : str, solver : str, ranks : int, wall_seconds : float,
+               ranks_per_node : int = 4, solver_iterations : int | None = None, run_dir : str | None = None):
+        """
+        Record the run time of a job. A repeated run_dir replaces the earlier entry
+        """
+        with self._lock, self.conn as conn:
+            conn.execute("INSERT OR REPLACE INTO hadrons_runs(machine, volume, action, solver, ranks, nodes, wall_seconds, solver_iterations, run_dir, recorded_at) VALUES (?,?,?,?,?,?,?,?,?,?)",
+                         (machine, math.prod(grid), action, solver, ranks, (ranks + ranks_per_node - 1) // ranks_per_node, wall_seconds, solver_iterations, run_dir, time.time()))
+
+    def recordRun(self, machine : str, xml_spec : bytes, grid : Tuple[int,int,int,int], mpi : Tuple[int,int,int,int], log_text : str,
+                  ranks_per_node : int = 4, run_dir : str | None = None)->dict | None:
+        """
+        Parse the log of a completed run and record it
+        Return: the parsed timing information (see parseHadronsLog), or None if the log had none
+        """
+        info = parseHadronsLog(log_text)
+        if info == None:
+            wfmanLog(f"No timing information found in the Hadrons log of {machine}:{run_dir}")
+            return None
+        action, solver = workloadKey(xml_spec)
+        self.record(machine, grid, action, solver, math.prod(mpi), info["wall_seconds"], ranks_per_node, info["solver_iterations"], run_dir)
+        return info
+
+    def _samples(self, machine, action, solver)->list:
+        with self._lock, self.conn as conn:
+            return conn.execute("SELECT volume, ranks, wall_seconds FROM hadrons_runs WHERE machine = ? AND action = ? AND solver = ?", (machine, action, solver)).fetchall()
+
+    @staticmethod
+    def _fit(samples)->Tuple[float,float]:
+        #Least-squares fit of log(t) = log(A) + p log(V/ranks); with a single local volume, or an unphysical slope, ideal scaling p=1 is assumed
+        xs = [ math.log(v / r) for v, r, _ in samples ]
+        ys = [ math.log(t) for _, _, t in samples ]
+        n = len(xs)
+        xm, ym = sum(xs)/n, sum(ys)/n
+        sxx = sum( (x-xm)**2 for x in xs )
+        p = 1.
+        if sxx > 1e-6:
+            p = sum( (x-xm)*(y-ym) for x, y in zip(xs,ys) ) / sxx
+            p = min(max(p, 0.5), 1.5)
+        return math.exp(ym - p*xm), p
+
+    def predict(self, machine : str, grid : Tuple[int,int,int,int], action : str, solver : str, ranks : int)->float | None:
+        """
+        Predict the run time in seconds of a job, or None if there are no records for the machine, action and solver.
+        Records with the same volume and rank count are used directly; otherwise the run time is extrapolated in the local volume per rank
+        """
+        samples = [ tuple(s) for s in self._samples(machine, action, solver) if s[2] > 0 ]
+        if len(samples) == 0:
+            return None
+        volume = math.prod(grid)
+        exact = sorted( t for v, r, t in samples if v == volume and r == ranks )
+        if len(exact) > 0:
+            return exact[len(exact)//2]
+        A, p = self._fit(samples)
+        return A * (volume / ranks)**p
+
+    def recommend(self, machine : str, grid : Tuple[int,int,int,int], action : str, solver : str, max_walltime : float | None = None,
+                  ranks_per_node : int = 4, max_nodes : int = 64, margin : float = 1.25, overhead : float = 300.)->dict | None:
+        """
+        Recommend the node count and walltime for a job, choosing the node count with the smallest predicted cost in node-hours
+        Node counts whose local volume per rank exceeds the largest recorded for the workload are excluded, as the job may not fit in memory
+        Args:
+           max_walltime - If not None, the longest acceptable walltime in seconds (e.g. the queue limit)
+           margin - The factor by which the predicted run time is scaled to obtain the walltime
+           overhead - Seconds added to the walltime for job startup, I/O, etc
+        Return: None if there are no records for the workload or no node count is acceptable, otherwise a dictionary with entries
+           "nodes", "ranks", "rank_geom", "predicted_seconds", "walltime_seconds", "samples"
+        """
+        samples = self._samples(machine, action, solver)
+        if len(samples) == 0:
+            return None
+        volume = math.prod(grid)
+        max_local = max( v / r for v, r, _ in samples )
+
+        best = None
+        nodes = 1
+        while nodes <= max_nodes:
+            ranks = nodes * ranks_per_node
+            geoms = rankGeometries(ranks, grid, ranks_per_node)
+            if volume / ranks <= max_local and len(geoms) > 0:
+                predicted = self.predict(machine, grid, action, solver, ranks)
+                walltime = int(math.ceil( (predicted * margin + overhead) / 60. )) * 60
+                if max_walltime == None or walltime <= max_walltime:
+                    cost = nodes * walltime
+                    if best == None or cost < best["nodes"] * best["walltime_seconds"]:
+                        best = { "nodes" : nodes, "ranks" : ranks, "rank_geom" : geoms[0][0], "predicted_seconds" : predicted,
+                                 "walltime_seconds" : walltime, "samples" : len(samples) }
+            nodes *= 2
+        return best
+
+_model = None
+_model_lock = threading.Lock()
+
+def getPerfModel()->PerfModel:
+    """Return the process-wide performance database, opening it at the default location on first use"""
+    global _model
+    with _model_lock:
+        if _model == None:
+            _model = PerfModel(defaultPerfModelFile())
+        return _model
+
+def setPerfModelFile(filename : str | None):
+    """Use the given file for the process-wide performance database (None for an in-memory database)"""
+    global _model
+    with _model_lock:
+        _model = PerfModel(filename)
@@ -0,0 +1,75 @@
+import math
+import re
+from dataclasses import dataclass
+
+#Causes of action failures, as assigned by classifyFailure
+#  timeout - the job exceeded its walltime
+#  node_failure - a hardware, network or scheduler fault unrelated to the job itself (node failure, preemption, GPU/interconnect errors)
+#  memory - the job ran out of host or device memory; repeating it with the same resources fails again
+#  input - Hadrons or Grid reported an error in the run itself (e.g. the XML or a missing input file)
+#  cancelled - the job was cancelled by the user or the facility
+#  transfer - a data transfer failed or was suspended
+#  initiation - the action could not be initiated although its machine is up
+#  unrecoverable - it could not be determined whether an interrupted initiation was made (see JobData.recoverInterrupted)
+#  unknown - none of the above could be identified
+_failure_patterns = [ ("timeout", re.compile(r"DUE TO TIME LIMIT|TIME LIMIT|\bTIMEOUT\b")),
+                      ("memory", re.compile(r"[Oo]ut of memory|OUT_OF_MEMORY|oom[-_]kill|cudaErrorMemoryAllocation|hipErrorOutOfMemory")),
+                      ("node_failure", re.compile(r"NODE_FAIL|DUE TO NODE FAILURE|[Nn]ode failure|PREEMPTED|DUE TO PREEMPTION|uncorrectable ECC|cudaErrorECCUncorrectable|"
+                                                  r"Xid \d+|NCCL error|[Cc]ommunication failure|[Cc]onnection reset|cxi_|PMI.*(?:fail|error)|Bus error")),
+                      ("input", re.compile(r"(?:Grid|Hadrons)\s*:\s*Error|XML (?:parse )?error|[Cc]ould not open|No such file or directory")) ]
+
+def classifyFailure(log_text : str, api_status : str | None = None)->str:
+    """
+    Classify the cause of a failed compute job from its logs (e.g. the concatenated err.log and run.log) and final API status
+    Return: one of "timeout", "memory", "node_failure", "input", "cancelled" or "unknown"
+    """
+    for cause, pattern in _failure_patterns:
+        if pattern.search(log_text) != None:
+            return cause
+    if api_status != None and api_status.lower() in ("canceled", "cancelled"):
+        return "cancelled"
+    return "unknown"
+
+def scaleWalltime(walltime : str, factor : float, max_walltime : str | None = None)->str:
+    """
+    Scale a walltime given either as a number (in the units expected by the API) or as [hh:]mm:ss, preserving its format and capping it at max_walltime (same format)
+    """
+    def _parse(t):
+        t = str(t).strip()
+        if ":" not in t:
+            return float(t)
+        secs = 0.
+        for part in t.split(":"):
+            secs = 60*secs + float(part)
+        return secs
+    value = math.ceil(_parse(walltime) * factor)
+    if max_walltime != None:
+        value = min(value, _parse(max_walltime))
+    value = int(value)
+    if ":" not in str(walltime):
+        return str(value)
+    return f"{value // 3600:02d}:{(value % 3600) // 60:02d}:{value % 60:02d}"
+
+@dataclass
+class RetryPolicy:
+    """
+    The policy under which failed actions of a class are retried
+    max_attempts: the maximum number of times an action is initiated, including the first
+    backoff: the delay in seconds before the first retry, multiplied by backoff_factor for each subsequent retry
+    walltime_factor: after a timeout, compute actions are retried with their walltime scaled by this factor, up to max_walltime (in the format of the action's time)
+    retry_causes: the failure causes (see classifyFailure) for which the action is retried; others fail the workflow
+    """
+    max_attempts : int = 3
+    backoff : float = 300.
+    backoff_factor : float = 2.
+    walltime_factor : float = 1.5
+    max_walltime : str | None = None
+    retry_causes : tuple = ("timeout", "node_failure", "transfer", "initiation", "unknown")
+
+    def delay(self, attempt : int)->float:
+        """The delay before the given retry (1 for the first)"""
+        return self.backoff * self.backoff_factor**(attempt-1)
+
+    def retries(self, cause : str, attempts : int)->bool:
+        """Whether an action that has been initiated the given number of times and failed with the given cause is retried"""
+        return cause in self.retry_causes and attempts < self.max_attempts
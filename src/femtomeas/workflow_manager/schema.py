@@ -0,0 +1,37 @@
+import sqlite3
+from typing import Callable, List
+
+#Versioning of the job manager database layout. The version is stored in the SQLite user_version pragma.
+#Version N of the schema is obtained by applying migrations 1..N in order, each of which must also be valid for a newly created database
+
+def getSchemaVersion(conn : sqlite3.Connection)->int:
+    return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+def setSchemaVersion(conn : sqlite3.Connection, version : int):
+    conn.execute(f"PRAGMA user_version = {int(version)}")
+
+def tableExists(conn : sqlite3.Connection, table : str)->bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() != None
+
+def tableColumns(conn : sqlite3.Connection, table : str)->List[str]:
+    """Return the column names of a table, or an empty list if it does not exist"""
+    return [ r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall() ]
+
+def addColumn(conn : sqlite3.Connection, table : str, column : str, decl : str):
+    """Add a column to a table if it is not already present"""
+    if column not in tableColumns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def migrateSchema(conn : sqlite3.Connection, migrations : List[Callable[[sqlite3.Connection], None]])->int:
+    """
+    Bring the database up to date by applying, in order, the migrations beyond its current version. migrations[i] produces version i+1 from version i.
+    Should be called within a transaction such that a failed migration leaves the database untouched
+    Return: the new schema version
+    """
+    version = getSchemaVersion(conn)
+    if version > len(migrations):
+        raise Exception(f"Database schema version {version} is newer than the latest supported version {len(migrations)}")
+    for v in range(version, len(migrations)):
+        migrations[v](conn)
+        setSchemaVersion(conn, v+1)
+    return len(migrations)
@@ -99,6 +99,23 @@ def remoteMkdir(machine: str, path: str, create_parents = True, allow_unsafe = F
 
 
 
+def remoteRm(machine: str, path: str, allow_unsafe = False)-> bool:
+    """
+    Remove a file on the remote machine
+    Args:
+       allow_unsafe - Allow removal of files other than within the sandbox
+    Return: True if successful, False otherwise
+    """
+    if not allow_unsafe and not checkSafePath(machine, path):
+        raise Exception("Path is not a subdirectory of the sandbox path")
+
+    if not pathlib.Path(path).is_absolute():
+        raise Exception("Path must be absolute")
+
+    ret = remoteRun(machine, f"rm -f '{path}' && echo 'Removed'").strip().split('\n')
+    return ret[-1] == 'Removed'
+
+
 def queryMachineStatus(machine: str)-> bool:
     """
     Query the status of a machine
@@ -134,6 +151,23 @@ def uploadBytes(machine: str, remote_path: str, content: io.BytesIO, allow_unsaf
     return sfAPIclientExecute(machine, _doit)
 
 
+def downloadFile(machine: str, remote_path: str)->str:
+    """
+    Download a (small) remote file. Returns the file contents as a string
+    Args:
+       machine - The name of the machine. Valid values are 'Perlmutter'
+       remote_path - The absolute path on the remote machine
+    """
+    wfapiLog(f"Downloading file {machine}:{remote_path}")
+    if not pathlib.Path(remote_path).is_absolute():
+        raise Exception("Path must be absolute")
+
+    def _doit(client, m):
+        pth = sfapi_client.paths.RemotePath(path=remote_path, compute=client.compute(m))
+        return pth.download().read()
+    return sfAPIclientExecute(machine, _doit)
+
+
 #SFAPI returns job handles, IRI uses job IDs
 sfapi_jobs = {}
 
@@ -199,6 +233,12 @@ def getJobState(machine: str, jobid: str) -> str:
         raise Exception(f"Unknown job state: {str(job.state)}")
     return sfapi_state_map[job.state]
 
+def getJobStates(machine: str, jobids: List[str]) -> dict:
+    """
+    Query the states of many jobs. The SF API client tracks jobs by handle so these are updated individually
+    """
+    return { jobid : getJobState(machine, jobid) for jobid in jobids }
+
 def cancelJob(machine: str, jobid: str):
     if jobid not in sfapi_jobs.keys():
         raise Exception("Job is not in the list of known jobs")
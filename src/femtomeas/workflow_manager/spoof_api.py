@@ -49,6 +49,10 @@ def remoteMkdir(machine: str, path: str, create_parents = True, allow_unsafe = F
     wfapiLog(f"Creating directory {machine}:{path}")
     return 1
 
+def remoteRm(machine: str, path: str, allow_unsafe = False)-> bool:
+    wfapiLog(f"Removing file {machine}:{path}")
+    return True
+
 def uploadBytes(machine: str, remote_path: str, content: io.BytesIO, allow_unsafe = False) -> bool:
     wfapiLog(f"Uploading binary data to {machine}:{remote_path}")
     return True
@@ -104,6 +108,12 @@ def getJobState(machine: str, jobid: str) -> str:
     wfapiLog(f"Queried job state {machine}:{jobid}, got {status}")
     return status
 
+def getJobStates(machine: str, jobids: List[str]) -> dict:
+    now = timemodule.time()
+    out = { jobid : ("completed" if now >= compute_jobs[jobid] else "active") for jobid in jobids }
+    wfapiLog(f"Queried {len(jobids)} job states on {machine}")
+    return out
+
 def downloadFile(machine: str, remote_path: str)->str:
     wfapiLog(f"Downloading file {machine}:{remote_path}")
     return "FAKE CONTENTS"
@@ -0,0 +1,107 @@
+import threading
+import time
+from typing import Callable
+from .logging import wfapiLog
+
+class ManagedToken:
+    """
+    An OAuth access token that is refreshed in the background ahead of its expiry.
+    The token data is replaced atomically such that in-flight requests see either the old or the new token, and a request rejected as unauthorized can
+    force a refresh with renew(); concurrent renewals of the same stale token result in a single refresh
+    """
+    def __init__(self, name : str, auth_data : dict, refresh : Callable[[dict], dict | None], on_refresh : Callable[[dict], None] | None = None,
+                 margin=300, retry_delay=60):
+        """
+        name: a label for logging
+        auth_data: the token data, containing at least "access_token" and optionally the expiry time as "expires_at_seconds" (Globus) or "expires_at" (authlib)
+        refresh: a function taking the current token data and returning new token data, or None on failure. Entries absent from the new data (e.g. an unrotated refresh token) are retained
+        on_refresh: called with the new token data after each successful refresh, e.g. to save it to disk
+        margin: the token is refreshed this many seconds before it expires
+        retry_delay: the delay in seconds before a failed background refresh is retried
+        """
+        self.name = name
+        self.margin = margin
+        self.retry_delay = retry_delay
+        self._auth = dict(auth_data)
+        self._refresh_func = refresh
+        self._on_refresh = on_refresh
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def expiresAt(self, auth_data : dict | None = None)->float | None:
+        auth_data = self._auth if auth_data == None else auth_data
+        exp = auth_data.get("expires_at_seconds", auth_data.get("expires_at"))
+        return None if exp == None else float(exp)
+
+    def _due(self, auth_data, margin)->bool:
+        exp = self.expiresAt(auth_data)
+        return exp != None and time.time() >= exp - margin
+
+    def current(self)->str:
+        """Return the current access token, refreshing first if it has expired"""
+        auth_data = self._auth
+        if self._due(auth_data, 0):
+            return self._refresh(auth_data["access_token"])
+        return auth_data["access_token"]
+
+    def renew(self, stale : str)->str:
+        """
+        Refresh the token after it was rejected, unless it has already been replaced
+        stale: the rejected access token
+        Return: the access token to retry with
+        """
+        return self._refresh(stale)
+
+    def _refresh(self, stale : str)->str:
+        with self._refresh_lock:
+            auth_data = self._auth
+            if auth_data["access_token"] != stale:
+                return auth_data["access_token"] #already refreshed by another thread
+            try:
+                new_data = self._refresh_func(auth_data)
+            except Exception as e:
+                wfapiLog(f"Refresh of {self.name} token raised: {e}")
+                new_data = None
+            if new_data == None:
+                wfapiLog(f"Refresh of {self.name} token failed")
+                return auth_data["access_token"]
+
+            merged = dict(auth_data)
+            merged.update(new_data)
+            self._auth = merged #atomic replacement
+            exp = self.expiresAt(merged)
+            wfapiLog(f"Refreshed {self.name} token" + ("" if exp == None else f", valid for ~{int(exp - time.time())} seconds"))
+            if self._on_refresh != None:
+                try:
+                    self._on_refresh(merged)
+                except Exception as e:
+                    wfapiLog(f"Failed to store refreshed {self.name} token: {e}")
+            return merged["access_token"]
+
+    def _run(self):
+        while not self._stop.is_set():
+            auth_data = self._auth
+            exp = self.expiresAt(auth_data)
+            if exp == None:
+                return #no expiry, nothing to do
+            delay = exp - self.margin - time.time()
+            if delay > 0:
+                self._stop.wait(delay)
+                continue
+            if self._refresh(auth_data["access_token"]) == auth_data["access_token"] or self._due(self._auth, self.margin):
+                self._stop.wait(self.retry_delay) #failed (or the new token is short-lived), try again later
+
+    def start(self):
+        """Start the background refresh thread"""
+        if self._thread != None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"token-refresh-{self.name}")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread != None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,172 @@
+import httpx
+import email.utils
+import importlib.util
+import random
+import threading
+import time
+from .logging import wfapiLog
+
+#Per-operation timeouts in seconds, keyed by the leading components of the API sub-URL; the longest matching prefix is used
+operation_timeouts = { "" : 60.,
+                       "filesystem/upload" : 300.,
+                       "filesystem/download" : 300.,
+                       "compute/job" : 120.,
+                       "compute/status" : 30.,
+                       "status" : 30.,
+                       "task" : 30. }
+connect_timeout = 10.
+
+def timeoutFor(suburl : str)->httpx.Timeout:
+    """The timeout for an API operation with the given sub-URL"""
+    key = max( (k for k in operation_timeouts if suburl.startswith(k)), key=len)
+    return httpx.Timeout(operation_timeouts[key], connect=connect_timeout)
+
+def retryAfter(resp : httpx.Response)->float | None:
+    """The delay in seconds requested by a Retry-After header (as seconds or an HTTP date), or None if absent"""
+    val = resp.headers.get("Retry-After")
+    if val == None:
+        return None
+    try:
+        return max(float(val), 0.)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(val).timestamp() - time.time(), 0.)
+    except (TypeError, ValueError):
+        return None
+
+class Transport:
+    """
+    HTTP transport shared by the API backends, providing a pooled keep-alive connection (HTTP/2 if the h2 package is available), per-operation timeouts and retries.
+    Idempotent requests (GET, PUT, DELETE) are retried with jittered exponential backoff on connection errors and 502/503/504 responses.
+    Any request is retried if it was never sent (connection failure) or was rejected with 429, or with 503 and a Retry-After header, honoring the Retry-After delay.
+    A 503 without Retry-After may be returned by a gateway after the request has reached the service, so it is retried only for idempotent requests.
+    A request rejected with 401 using a managed token (see token_manager.ManagedToken) is retried once after renewing the token
+    """
+    idempotent_methods = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+    retry_statuses = (502, 503, 504)
+    rejected_statuses = (429,) #the server did not process the request, as is a 503 with a Retry-After header
+
+    def __init__(self, max_connections=32, max_keepalive_connections=16, keepalive_expiry=120., http2 : bool | None = None,
+                 max_attempts=5, backoff_base=0.5, backoff_max=30., max_retry_after=300.):
+        """
+        http2: enable HTTP/2; if None it is enabled if the h2 package is available
+        max_attempts: the maximum number of attempts for a request, including the first
+        backoff_base, backoff_max: the backoff before retry n (from 0) is drawn uniformly from [0, min(backoff_max, backoff_base * 2^n)]
+        max_retry_after: the longest Retry-After delay in seconds that is honored; longer requests result in the response being returned
+        """
+        if http2 == None:
+            http2 = importlib.util.find_spec("h2") != None
+        self.http2 = http2
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.client = httpx.Client(http2=http2,
+                                   limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections, keepalive_expiry=keepalive_expiry),
+                                   headers={ "accept" : "application/json" },
+                                   timeout=httpx.Timeout(operation_timeouts[""], connect=connect_timeout))
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    @staticmethod
+    def _rewind(files):
+        #File-like upload content must be re-read on retry
+        if files:
+            for v in files.values():
+                f = v[1] if isinstance(v, tuple) else v
+                if hasattr(f, "seek"):
+                    f.seek(0)
+
+    def request(self, method : str, url : str, token = None, suburl : str = "", headers : dict | None = None, idempotent : bool | None = None, **kwargs)->httpx.Response:
+        """
+        Perform a request, retrying as appropriate
+        Args:
+           token - If not None, the bearer token for the Authorization header, either as a string or an object providing current() and renew(stale) such as a ManagedToken
+           suburl - The API operation, used to select the timeout
+           headers - Additional headers
+           idempotent - Whether the request may be safely repeated; if None this is determined by the method
+           kwargs - Passed to httpx.Client.request, e.g. params, json, data, files
+        Return: the final response. Exceptions are raised only if the request could not be completed at all
+        """
+        method = method.upper()
+        if idempotent == None:
+            idempotent = method in self.idempotent_methods
+        req_headers = {} if headers == None else dict(headers)
+        managed = token != None and hasattr(token, "renew")
+        access_token = token.current() if managed else token
+        renewed = False
+        kwargs.setdefault("timeout", timeoutFor(suburl))
+
+        attempt = 0
+        while True:
+            if access_token != None:
+                req_headers["Authorization"] = f"Bearer {access_token}"
+            self._rewind(kwargs.get("files"))
+            try:
+                resp = self.client.request(method, url, headers=req_headers, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                #The request was not sent
+                if attempt + 1 >= self.max_attempts:
+                    raise
+                delay = self._backoff(attempt)
+                wfapiLog(f"{method} {suburl} connection failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            except httpx.TransportError as e:
+                #The request may have been processed
+                if not idempotent or attempt + 1 >= self.max_attempts:
+                    raise
+                delay = self._backoff(attempt)
+                wfapiLog(f"{method} {suburl} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            else:
+                if resp.status_code == 401 and managed and not renewed:
+                    #The token may have expired or been revoked while the request was in flight; a rejected request was not processed
+                    renewed = True
+                    stale = access_token
+                    access_token = token.renew(stale)
+                    if access_token != stale:
+                        wfapiLog(f"{method} {suburl} was unauthorized, retrying with a renewed token")
+                        continue
+                    return resp
+                if attempt + 1 >= self.max_attempts:
+                    return resp
+                delay = retryAfter(resp)
+                if resp.status_code in self.rejected_statuses or (resp.status_code == 503 and delay != None):
+                    if delay == None:
+                        delay = self._backoff(attempt)
+                    elif delay > self.max_retry_after:
+                        return resp
+                elif idempotent and resp.status_code in self.retry_statuses:
+                    delay = self._backoff(attempt)
+                else:
+                    return resp
+                wfapiLog(f"{method} {suburl} returned {resp.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url, **kwargs)->httpx.Response:
+        return self.request("GET", url, **kwargs)
+
+    def put(self, url, **kwargs)->httpx.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def post(self, url, **kwargs)->httpx.Response:
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url, **kwargs)->httpx.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        self.client.close()
+
+#The transport shared by all API backends in this process
+_transport = None
+_transport_lock = threading.Lock()
+
+def getTransport()->Transport:
+    """Return the shared transport, creating it on first use"""
+    global _transport
+    with _transport_lock:
+        if _transport == None:
+            _transport = Transport()
+        return _transport
@@ -0,0 +1,75 @@
+#Benchmark of the job manager loop against the SPOOF backend with a large number of enqueued workflows
+#Usage: python bench_job_manager.py [--jobs 100000] [--active 100] [--ticks 20] [--db /path/to/bench.db] [--drop-indexes]
+import os
+os.environ["FEMTOMEAS_API_IMPL"] = "SPOOF"
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+from femtomeas.workflow_manager.api_general import setupWorkflowAgent
+from femtomeas.workflow_manager.manager import *
+from femtomeas.workflow_manager.hadrons import setHadronsInfo
+from femtomeas.meas_config_agent.hadrons_xml import HadronsXML
+import femtomeas.workflow_manager.logging as wflogging
+
+parser = argparse.ArgumentParser(description="Benchmark the job manager tick with many enqueued workflows")
+parser.add_argument("--jobs", type=int, default=100000, help="Number of workflows to enqueue")
+parser.add_argument("--active", type=int, default=100, help="Maximum number of active workflows")
+parser.add_argument("--ticks", type=int, default=20, help="Number of manager ticks to time")
+parser.add_argument("--db", type=str, default=None, help="Database file (default: a temporary file)")
+parser.add_argument("--drop-indexes", action="store_true", help="Drop the job and action indexes to measure the unindexed behavior")
+args = parser.parse_args()
+
+#Silence the per-action logging and make the fake actions complete quickly
+wflogging.wfman_log_func = lambda *a, **k: None
+wflogging.api_log_func = lambda *a, **k: None
+random.randint = lambda a, b: 1
+
+setupWorkflowAgent("/path/to/sfapi_key", "/path/to/iriapi_key", { "Perlmutter" : "/path/to/sandbox" })
+setHadronsInfo({ "Perlmutter" : { "bin" : "/path/to/hadrons/bin", "env" : "" } } )
+
+db = args.db
+if db is None:
+    db = os.path.join(tempfile.mkdtemp(), "bench_jobs.db")
+jd = JobData(db, max_workflows_active=args.active)
+
+if args.drop_indexes:
+    with jd.conn as conn:
+        for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'").fetchall():
+            conn.execute(f"DROP INDEX {r['name']}")
+
+xml = HadronsXML()
+xml.setTrajCounter(0, 1, 1)
+spec = HadronsJobSpec("/path/to/sandbox/<JOBID>", xml, grid=(8,8,8,16))
+
+t0 = time.time()
+stage_out = TransferFromAction("Perlmutter", "/path/to/sandbox/<JOBID>", "dtn", "/path/to/results")
+jd.enqueueJobs([ [ TransferToAction("dtn", f"/path/to/configs/ckpoint_lat.{i}", "Perlmutter", f"/path/to/sandbox/configs/ckpoint_lat.{i}"),
+                   HadronsComputeAction(machine="Perlmutter", account="account", queue="debug", time="300", spec=spec, mpi=(1,1,1,2)),
+                   stage_out ] for i in range(args.jobs) ], "bench")
+t_enqueue = time.time() - t0
+print(f"Enqueued {args.jobs} workflows in {t_enqueue:.2f}s ({1e6*t_enqueue/max(args.jobs,1):.1f}us per workflow)")
+
+#The tick includes the (fake) API calls; the scheduling queries made by the manager loop between ticks are timed separately
+tick_times = []
+query_times = []
+for t in range(args.ticks):
+    t0 = time.time()
+    jd.progressActiveState(poll_freq=0)
+    jd.startWorkflows()
+    tick_times.append(time.time() - t0)
+
+    t0 = time.time()
+    jd.getPollSchedule(30)
+    jd.hasImmediateWork()
+    jd.countWorkflowsWithStatus([ ActionStatus.PENDING, ActionStatus.ACTIVE, ActionStatus.COMPLETED ])
+    query_times.append(time.time() - t0)
+    time.sleep(0.5)
+
+active = jd.countWorkflowsWithStatus(ActionStatus.ACTIVE)
+print(f"Tick time over {args.ticks} ticks with {active} active workflows: mean {1e3*statistics.mean(tick_times):.1f}ms, median {1e3*statistics.median(tick_times):.1f}ms, max {1e3*max(tick_times):.1f}ms")
+print(f"Scheduling queries: mean {1e3*statistics.mean(query_times):.2f}ms, max {1e3*max(query_times):.2f}ms")
+print(f"Database {db}: {os.path.getsize(db)/1024**2:.1f} MB")
@@ -0,0 +1,38 @@
+import os
+os.environ["FEMTOMEAS_API_IMPL"] = "SPOOF"
+
+import pytest
+import femtomeas.workflow_manager.globals as globals
+import femtomeas.workflow_manager.spoof_api as spoof_api
+import femtomeas.workflow_manager.perf_model as perf_model
+from femtomeas.workflow_manager.api_general import setupWorkflowAgent
+from femtomeas.workflow_manager.hadrons import setHadronsInfo
+from femtomeas.meas_config_agent.hadrons_xml import HadronsXML
+
+#Scripts run by hand against real facilities or with local input files; not collected by pytest
+collect_ignore = [ "test_api_wrappers.py", "test_submission_agent.py", "test_workflow_manager.py", "auto_evaluate.py", "bench_job_manager.py" ]
+
+@pytest.fixture
+def spoof(monkeypatch):
+    """
+    The SPOOF API with a sandbox on Perlmutter, whose fake transfers and batch jobs complete after a second. Run times are recorded in an in-memory performance database
+    """
+    monkeypatch.setattr(spoof_api.random, "randint", lambda a, b: 1)
+    monkeypatch.setattr(perf_model, "_model", perf_model.PerfModel(None))
+    monkeypatch.setattr(globals, "remote_workdir", None)
+    setupWorkflowAgent("/path/to/sfapi_key", "/path/to/iriapi_key", { "Perlmutter" : "/path/to/sandbox" })
+    setHadronsInfo({ "Perlmutter" : { "bin" : "/path/to/bin", "env" : "source /path/to/env.sh" } })
+    return spoof_api
+
+@pytest.fixture
+def xml():
+    """A small Hadrons XML with a DWF action and a CG solver"""
+    xml = HadronsXML()
+    xml.setTrajCounter(0, 1, 1)
+    xml.setRunID(1234)
+    xml.addModule("gauge", "MGauge::Unit")
+    opt = xml.addModule("DWF", "MAction::DWF")
+    HadronsXML.setValues(opt, [ ("gauge", "gauge"), ("Ls", 12), ("mass", 0.01), ("M5", 1.8), ("boundary", "1 1 1 -1"), ("twist", "0. 0. 0. 0.") ])
+    opt = xml.addModule("CG", "MSolver::RBPrecCG")
+    HadronsXML.setValues(opt, [ ("action", "DWF"), ("maxIteration", 10000), ("residual", 1e-8), ("eigenPack", "") ])
+    return xml
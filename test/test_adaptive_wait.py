@@ -0,0 +1,51 @@
+import pytest
+import femtomeas.workflow_manager.adaptive_wait as adaptive_wait
+from femtomeas.workflow_manager.adaptive_wait import AdaptiveWaiter
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake clock advanced by sleeps, returning the list of delays slept"""
+    now = [ 0. ]
+    delays = []
+    def sleep(s):
+        delays.append(s)
+        now[0] += s
+    monkeypatch.setattr(adaptive_wait.time, "sleep", sleep)
+    monkeypatch.setattr(adaptive_wait.time, "monotonic", lambda: now[0])
+    return delays
+
+def pollAfter(polls):
+    """A poll function that completes on the given poll"""
+    count = [ 0 ]
+    def poll():
+        count[0] += 1
+        return count[0] >= polls, count[0]
+    return poll
+
+def test_delays_back_off_exponentially_up_to_the_maximum(clock):
+    w = AdaptiveWaiter(min_delay=0.02, max_delay=0.5, factor=2.)
+    assert w.wait("op", pollAfter(8)) == 8
+    assert clock == pytest.approx([ 0.02, 0.02, 0.04, 0.08, 0.16, 0.32, 0.5, 0.5 ])
+
+def test_first_poll_follows_the_observed_completion_times(clock):
+    w = AdaptiveWaiter(min_delay=0.02, max_delay=4.)
+    for elapsed in (1.0, 1.2, 1.1):
+        w.record("op", elapsed)
+    assert w.initialDelay("op") == pytest.approx(0.88)
+    assert w.initialDelay("other") == 0.02
+    w.wait("op", pollAfter(1))
+    assert clock == pytest.approx([ 0.88 ])
+    assert w.stats()["op"]["count"] == 4
+
+def test_history_is_bounded(clock):
+    w = AdaptiveWaiter(history=3)
+    for elapsed in (10., 10., 1., 1., 1.):
+        w.record("op", elapsed)
+    assert w.stats()["op"] == { "count" : 3, "median" : 1., "max" : 1. }
+
+def test_timeout(clock):
+    w = AdaptiveWaiter(min_delay=0.1, max_delay=1., timeout=5.)
+    with pytest.raises(Exception, match="Timed out"):
+        w.wait("op", pollAfter(1000))
+    assert sum(clock) == pytest.approx(5.1, abs=0.2)
+    assert w.wait("op", pollAfter(3), timeout=None) == 3
@@ -0,0 +1,47 @@
+import threading
+import time
+import pytest
+from femtomeas.workflow_manager.concurrency import boundedMap
+
+class Peak:
+    """Track the peak number of concurrent calls, overall and per key"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak = {}
+    def __call__(self, key):
+        with self.lock:
+            for k in (None, key):
+                self.active[k] = self.active.get(k, 0) + 1
+                self.peak[k] = max(self.peak.get(k, 0), self.active[k])
+        time.sleep(0.05)
+        with self.lock:
+            for k in (None, key):
+                self.active[k] -= 1
+
+def test_results_are_in_input_order():
+    assert boundedMap(lambda x: (time.sleep(0.01 * (5 - x)), x*x)[1], list(range(5)), max_workers=5) == [ 0, 1, 4, 9, 16 ]
+    assert boundedMap(lambda x: x, []) == []
+
+def test_concurrency_is_bounded_overall_and_per_key():
+    peak = Peak()
+    items = [ "a" ] * 6 + [ "b" ] * 6
+    boundedMap(lambda k: peak(k), items, max_workers=5, key=lambda k: k, max_per_key=2)
+    assert peak.peak[None] <= 4 and peak.peak["a"] == 2 and peak.peak["b"] == 2
+
+def test_calls_run_concurrently():
+    t0 = time.time()
+    boundedMap(lambda x: time.sleep(0.2), list(range(4)), max_workers=4)
+    assert time.time() - t0 < 0.6
+
+def test_exceptions_are_returned_or_raised_after_all_calls():
+    def f(x):
+        if x == 1:
+            raise ValueError("bad item")
+        return x
+    res = boundedMap(f, [0, 1, 2], return_exceptions=True)
+    assert res[0] == 0 and isinstance(res[1], ValueError) and res[2] == 2
+    calls = []
+    with pytest.raises(ValueError):
+        boundedMap(lambda x: calls.append(x) or f(x), [0, 1, 2])
+    assert sorted(calls) == [0, 1, 2]
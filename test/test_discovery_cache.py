@@ -0,0 +1,114 @@
+import threading
+import pytest
+import femtomeas.workflow_manager.discovery_cache as discovery_cache
+import femtomeas.workflow_manager.iri_api as iri_api
+from femtomeas.workflow_manager.discovery_cache import DiscoveryCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake wall clock, as a one-element list holding the current time"""
+    now = [ 1000. ]
+    monkeypatch.setattr(discovery_cache.time, "time", lambda: now[0])
+    return now
+
+def fetcher(values):
+    """A fetch function returning the given values in turn, and the list of values fetched"""
+    fetched = []
+    def fetch():
+        fetched.append(values[len(fetched)])
+        return fetched[-1]
+    return fetch, fetched
+
+def test_value_is_fetched_once_within_its_lifetime(clock):
+    cache = DiscoveryCache()
+    fetch, fetched = fetcher([ { "compute" : "a" }, { "compute" : "b" } ])
+    assert cache.get("Perlmutter", "status/resources", fetch) == { "compute" : "a" }
+    clock[0] += 24*3600 - 1
+    assert cache.get("Perlmutter", "status/resources", fetch) == { "compute" : "a" }
+    assert len(fetched) == 1
+
+def test_entries_are_keyed_by_machine_and_endpoint(clock):
+    cache = DiscoveryCache()
+    assert cache.get("Perlmutter", "status/resources", lambda: 1) == 1
+    assert cache.get("Aurora", "status/resources", lambda: 2) == 2
+    assert cache.get("Perlmutter", "account/projects", lambda: 3) == 3
+    assert cache.get("Perlmutter", "status/resources", lambda: 4) == 1
+
+def test_stale_value_is_used_while_refreshed_in_the_background(clock):
+    cache = DiscoveryCache()
+    cache.get("Perlmutter", "account/projects", lambda: "old")
+    clock[0] += 6*3600 + 1
+    release = threading.Event()
+    refreshed = threading.Event()
+    def fetch():
+        release.wait(5)
+        refreshed.set()
+        return "new"
+    assert cache.get("Perlmutter", "account/projects", fetch) == "old"
+    assert cache.get("Perlmutter", "account/projects", lambda: pytest.fail("refreshed twice")) == "old"
+    release.set()
+    assert refreshed.wait(5)
+    for i in range(500):
+        if not cache._revalidating:
+            break
+        threading.Event().wait(0.01)
+    assert cache.get("Perlmutter", "account/projects", lambda: pytest.fail("refreshed value not stored")) == "new"
+
+def test_expired_value_is_refreshed_before_use(clock):
+    cache = DiscoveryCache()
+    fetch, fetched = fetcher([ "old", "new" ])
+    cache.get("Perlmutter", "account/projects", fetch)
+    clock[0] += 6*3600 + 7*24*3600 + 1
+    assert cache.get("Perlmutter", "account/projects", fetch) == "new"
+    assert fetched == [ "old", "new" ]
+
+def test_unknown_endpoints_use_the_default_lifetime(clock):
+    cache = DiscoveryCache()
+    fetch, fetched = fetcher([ 1, 2 ])
+    cache.get("Perlmutter", "other", fetch)
+    clock[0] += discovery_cache.default_ttl[0] + discovery_cache.default_ttl[1] + 1
+    assert cache.get("Perlmutter", "other", fetch) == 2
+
+def test_force_refresh(clock):
+    cache = DiscoveryCache()
+    fetch, fetched = fetcher([ 1, 2 ])
+    cache.get("Perlmutter", "status/resources", fetch)
+    assert cache.get("Perlmutter", "status/resources", fetch, force_refresh=True) == 2
+    assert cache.get("Perlmutter", "status/resources", lambda: 3) == 2
+
+def test_invalidate(clock):
+    cache = DiscoveryCache()
+    for machine in ("Perlmutter", "Aurora"):
+        for endpoint in ("status/resources", "account/projects"):
+            cache.get(machine, endpoint, lambda: "old")
+    cache.invalidate(machine="Aurora", endpoint="account/projects")
+    assert cache.get("Aurora", "account/projects", lambda: "new") == "new"
+    assert cache.get("Aurora", "status/resources", lambda: "new") == "old"
+    cache.invalidate(endpoint="status/resources")
+    assert cache.get("Perlmutter", "status/resources", lambda: "new") == "new"
+    assert cache.get("Perlmutter", "account/projects", lambda: "new") == "old"
+    cache.invalidate()
+    assert cache.get("Perlmutter", "account/projects", lambda: "newer") == "newer"
+
+def test_cache_persists_across_instances(clock, tmp_path):
+    filename = str(tmp_path / "sub" / "discovery_cache.db")
+    DiscoveryCache(filename).get("Perlmutter", "status/resources", lambda: { "compute" : "a", "login" : "b" })
+    assert DiscoveryCache(filename).get("Perlmutter", "status/resources", lambda: pytest.fail("not persisted")) == { "compute" : "a", "login" : "b" }
+
+def test_process_wide_cache_file(clock, tmp_path, monkeypatch):
+    filename = str(tmp_path / "discovery_cache.db")
+    monkeypatch.setattr(discovery_cache, "_cache", None)
+    monkeypatch.setenv("FEMTOMEAS_DISCOVERY_CACHE", filename)
+    assert discovery_cache.getDiscoveryCache().filename == filename
+    assert discovery_cache.getDiscoveryCache() is discovery_cache.getDiscoveryCache()
+    discovery_cache.setDiscoveryCacheFile(None)
+    assert discovery_cache.getDiscoveryCache().filename == ":memory:"
+
+def test_resource_id_refreshes_a_map_missing_the_resource(clock, monkeypatch):
+    monkeypatch.setattr(discovery_cache, "_cache", DiscoveryCache())
+    fetch, fetched = fetcher([ { "compute" : "c1" }, { "compute" : "c1", "login" : "l1" } ])
+    monkeypatch.setattr(iri_api, "_fetchResourceMap", lambda machine: fetch())
+    assert iri_api.getResourceID("Perlmutter") == "c1"
+    assert iri_api.getResourceID("Perlmutter", "login") == "l1"
+    assert iri_api.getResourceID("Perlmutter", "login") == "l1"
+    assert len(fetched) == 2
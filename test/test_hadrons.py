@@ -0,0 +1,103 @@
+import pytest
+import femtomeas.workflow_manager.hadrons as hadrons
+from femtomeas.workflow_manager.hadrons import haloCost, rankGeometries, defaultRankGeom, setHadronsInfo
+
+def test_single_node_decomposition_is_on_node_in_the_time_direction():
+    ranked = rankGeometries(4, (8,8,8,16))
+    assert ranked[0][0] == (1,1,1,4)
+    assert all( ranked[i][1] <= ranked[i+1][1] for i in range(len(ranked)-1) )
+
+def test_default_rank_geometry_on_many_nodes():
+    assert defaultRankGeom(256, (64,64,64,128))[1] == [32,16,16,16]
+
+def test_geometries_divide_the_lattice_with_even_local_extents():
+    for geom, _ in rankGeometries(16, (8,8,8,16)):
+        assert geom[0]*geom[1]*geom[2]*geom[3] == 16
+        assert all( (L // n) % 2 == 0 and L % n == 0 for L, n in zip((8,8,8,16), geom) )
+
+def test_inter_node_faces_cost_more():
+    assert haloCost((1,1,1,4), (8,8,8,16), ranks_per_node=4) < haloCost((1,1,1,4), (8,8,8,16), ranks_per_node=1)
+    assert haloCost((1,1,1,1), (8,8,8,16)) == 0.
+
+def test_indivisible_ranks_are_rejected():
+    with pytest.raises(Exception):
+        defaultRankGeom(3, (8,8,8,16))
+
+def inlineScript(queue, account, nodes, time, job_run_dir, bind, ranks, mpi_str, grid_str, env, bin):
+    """The Perlmutter batch script formerly written inline by submitHadronsJob"""
+    return f"""#!/bin/bash
+#SBATCH -q {queue}
+#SBATCH -C gpu
+#SBATCH -A {account}
+#SBATCH --ntasks-per-node=4
+#SBATCH --exclusive
+#SBATCH --gpus-per-task=1
+#SBATCH -N {nodes}
+#SBATCH -t {time}
+#SBATCH -o {job_run_dir}/run.log
+
+now=$(date)        
+echo "Hadrons job started at ${{now}}"
+        
+BIND="{bind}"
+export MPICH_OFI_NIC_POLICY=GPU
+
+#Hadrons uses an SQLite database that has I/O failures on Lustre. We need to actually run in a temporary directory then move everything back        
+SCRATCH_DIR=${{SCRATCH}}/${{SLURM_JOB_ID}}
+mkdir -p ${{SCRATCH_DIR}}        
+cd ${{SCRATCH_DIR}}
+        
+cat <<EOF > wrap.sh
+#!/bin/bash
+export CUDA_VISIBLE_DEVICES=\\${{SLURM_LOCALID}}  
+echo "Rank \\${{SLURM_PROCID}}, local rank \\${{SLURM_LOCALID}} : visible devices \\${{CUDA_VISIBLE_DEVICES}}"
+cd ${{SCRATCH_DIR}}
+\\$*
+EOF
+        
+chmod u+x wrap.sh
+{env}
+        
+srun -c 32 --gpu-bind=none ${{BIND}} -n {ranks} ./wrap.sh {bin}/HadronsXmlRun {job_run_dir}/run.xml --mpi {mpi_str} --grid {grid_str} --accelerator-threads 8 --shm 3072 --device-mem 15360 --threads 8 --log Iterative,Message,Error,Warning,Performance --comms-overlap --comms-concurrent --shm-mpi 1
+mv ${{SCRATCH_DIR}}/* {job_run_dir}/
+cd {job_run_dir}        
+rmdir ${{SCRATCH_DIR}}
+now=$(date)
+echo "Hadrons job completed at ${{now}}"
+"""
+
+def uploads(monkeypatch):
+    """Record the contents of the files uploaded by the hadrons module, by remote path"""
+    uploaded = {}
+    monkeypatch.setattr(hadrons, "uploadBytes", lambda machine, path, buf: uploaded.__setitem__(path, buf.getvalue()))
+    return uploaded
+
+@pytest.mark.parametrize("mpi, nodes, bind", [ ((1,1,1,2), 1, ""), ((1,1,2,4), 2, "--cpu-bind=verbose,map_ldom:3,2,1,0") ])
+def test_job_script_matches_the_inline_script(spoof, monkeypatch, mpi, nodes, bind):
+    uploaded = uploads(monkeypatch)
+    run_dir = "/path/to/sandbox/jobdir"
+    hadrons.submitHadronsJob("Perlmutter", b"<grid/>", run_dir, account="amsc013_g", queue="debug", time="300", grid=(8,8,8,16), mpi=mpi)
+    ranks = mpi[0]*mpi[1]*mpi[2]*mpi[3]
+    expect = inlineScript("debug", "amsc013_g", nodes, "300", run_dir, bind, ranks, hadrons.sizesToGridArgList(mpi), "8.8.8.16",
+                          "source /path/to/env.sh", "/path/to/bin")
+    #The template differs from the inline script only in trailing whitespace
+    assert uploaded[f"{run_dir}/batch_script.sh"].decode().splitlines() == [ l.rstrip() for l in expect.splitlines() ]
+    assert uploaded[f"{run_dir}/run.xml"] == b"<grid/>"
+
+def test_job_script_guard_precedes_the_run(spoof, monkeypatch):
+    uploaded = uploads(monkeypatch)
+    run_dir = "/path/to/sandbox/jobdir"
+    hadrons.submitHadronsJob("Perlmutter", b"<grid/>", run_dir, account="amsc013_g", queue="debug", time="300", grid=(8,8,8,16), mpi=(1,1,1,2), token="tok")
+    lines = uploaded[f"{run_dir}/batch_script.sh"].decode().splitlines()
+    start = lines.index('echo "Hadrons job started at ${now}"')
+    guard = hadrons.submissionGuard(run_dir, "tok").splitlines()
+    assert lines[start+1:start+1+len(guard)] == guard
+    assert lines[start+1+len(guard):start+3+len(guard)] == [ "", 'BIND=""' ]
+    assert uploaded[f"{run_dir}/submission"].decode().split()[0] == "tok"
+
+def test_template_parameters_are_overridable(spoof, monkeypatch):
+    uploaded = uploads(monkeypatch)
+    setHadronsInfo({ "Perlmutter" : { "bin" : "/path/to/bin", "template_params" : { "shm" : 2048 } } })
+    hadrons.submitHadronsJob("Perlmutter", b"<grid/>", "/path/to/sandbox/jobdir", account="amsc013_g", queue="debug", time="300", grid=(8,8,8,16), mpi=(1,1,1,2))
+    script = uploaded["/path/to/sandbox/jobdir/batch_script.sh"].decode()
+    assert "--shm 2048 " in script and "--device-mem 15360 " in script
@@ -0,0 +1,37 @@
+import pytest
+from femtomeas.meas_config_agent.hadrons_xml import HadronsXML, HadronsXMLTemplate
+from femtomeas.meas_config_agent.gauge import GaugeFieldConfig, LoadGauge, UnitGauge
+from femtomeas.meas_config_agent.state import State
+
+def state(config):
+    return State(actions=[], sources=[], solvers=[], propagators=[], observable_configs=[], gauge=GaugeFieldConfig(config=config, Lx=8, Ly=8, Lz=8, Lt=16))
+
+@pytest.mark.parametrize("override_path", [ None, "/path/to/sandbox/config_cache/abc", "/path/with <special> & 'quoted' chars" ])
+def test_rendered_template_matches_the_serialized_document(override_path):
+    s = state(LoadGauge(source_uuid="dtn", stub="/path/to/src/ckpoint_lat", start=1000, step=20, end=1100))
+    template = s.toHadronsXMLsingleConfTemplate()
+    for i in range(6):
+        assert s.toHadronsXMLsingleConfBytes(template, i, override_path=override_path) == s.toHadronsXMLsingleConf(i, override_path=override_path).toBytes()
+
+def test_template_without_fields():
+    s = state(UnitGauge())
+    template = s.toHadronsXMLsingleConfTemplate()
+    assert template.fields == []
+    assert s.toHadronsXMLsingleConfBytes(template, 0) == s.toHadronsXMLsingleConf(0).toBytes()
+
+def test_out_of_range_configuration_and_missing_values_are_rejected():
+    s = state(LoadGauge(source_uuid=None, stub="/path/to/src/ckpoint_lat", start=1000, step=20, end=1100))
+    template = s.toHadronsXMLsingleConfTemplate()
+    with pytest.raises(Exception):
+        s.toHadronsXMLsingleConfBytes(template, 6)
+    with pytest.raises(Exception, match="Missing values"):
+        template.render(file="/path/to/cfg")
+
+def test_placeholders_are_substituted_in_place():
+    def document(file):
+        xml = HadronsXML()
+        HadronsXML.setValue(xml.addModule("gauge", "MIO::LoadNersc"), "file", file)
+        return xml
+    template = HadronsXMLTemplate(document(HadronsXMLTemplate.placeholder("file")))
+    assert template.fields == [ "file" ]
+    assert template.render(file="/path/to/cfg.1000") == document("/path/to/cfg.1000").toBytes()
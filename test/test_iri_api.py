@@ -0,0 +1,37 @@
+import pytest
+import femtomeas.workflow_manager.iri_api as iri_api
+import femtomeas.workflow_manager.iri_sfapi_hybrid as iri_sfapi_hybrid
+
+@pytest.fixture(params=[ iri_api, iri_sfapi_hybrid ], ids=[ "IRI", "IRI_SF_HYBRID" ])
+def api(request, monkeypatch):
+    """An IRI backend whose compute status endpoints answer from a fake scheduler, and the list of requests made"""
+    mod = request.param
+    current = { "101" : "active", "102" : "queued" }
+    finished = { "100" : "completed", "103" : "failed" }
+    requests = []
+    def get(machine, suburl, params = None, base='iriapi_base'):
+        requests.append( (suburl, params) )
+        parts = suburl.split("/")
+        if len(parts) == 3:
+            jobs = dict(current, **finished) if params['historical'] else current
+            return [ { "id" : jobid, "status" : { "state" : state } } for jobid, state in jobs.items() ]
+        return { "status" : { "state" : dict(current, **finished)[parts[3]] } }
+    monkeypatch.setattr(mod, "get", get)
+    monkeypatch.setattr(mod, "getResourceID", lambda machine, rtype="compute": "rid")
+    return mod, requests
+
+def test_job_states_from_the_current_listing(api):
+    api, requests = api
+    assert api.getJobStates("Perlmutter", [ "101", "102" ]) == { "101" : "active", "102" : "queued" }
+    assert requests == [ ("compute/status/rid", { "historical" : False }) ]
+
+def test_finished_jobs_are_queried_individually(api):
+    api, requests = api
+    assert api.getJobStates("Perlmutter", [ "100", "101", "103" ]) == { "100" : "completed", "101" : "active", "103" : "failed" }
+    assert requests[0] == ("compute/status/rid", { "historical" : False })
+    assert sorted( r[0] for r in requests[1:] ) == [ "compute/status/rid/100", "compute/status/rid/103" ]
+
+def test_no_request_for_no_jobs(api):
+    api, requests = api
+    assert api.getJobStates("Perlmutter", []) == {}
+    assert requests == []
@@ -0,0 +1,427 @@
+import time
+import tempfile
+import pytest
+import femtomeas.workflow_manager.manager as wm
+import femtomeas.workflow_manager.hadrons as hadrons
+from femtomeas.workflow_manager.manager import JobData, JobManager, ActionStatus, ActionClass, CacheStatus, HadronsJobSpec, HadronsComputeAction, TransferToAction, TransferFromAction
+from femtomeas.meas_config_agent.hadrons_xml import HadronsXML
+
+def runUntilIdle(jd, timeout=60):
+    """Progress the workflows until none is pending, active, held or awaiting progression"""
+    t0 = time.time()
+    while jd.countWorkflowsWithStatus([ActionStatus.PENDING, ActionStatus.ACTIVE, ActionStatus.COMPLETED, ActionStatus.HELD, ActionStatus.SCHEDULING]) > 0:
+        assert time.time() - t0 < timeout
+        jd.startWorkflows()
+        jd.progressActiveState(poll_freq=0)
+        time.sleep(0.2)
+
+def computeAction(xml, **kwargs):
+    spec = HadronsJobSpec("/path/to/sandbox/<JOBID>", xml, grid=(8,8,8,16))
+    params = dict(machine="Perlmutter", account="amsc013_g", queue="debug", time="300", spec=spec, mpi=(1,1,1,2))
+    params.update(kwargs)
+    return HadronsComputeAction(**params)
+
+def test_scheduling_job_without_a_recorded_action_is_initiated_again(spoof):
+    jd = JobData()
+    jobid = jd.enqueueJob([ TransferToAction("dtn", "/path/to/src", "Perlmutter", "/path/to/sandbox/dest") ])
+    jd.startWorkflows()
+    with jd.conn as conn:
+        conn.execute("DELETE FROM transfers")
+        conn.execute("UPDATE jobs SET head_action_status = ?, head_action_id = -1 WHERE job_id = ?", (ActionStatus.SCHEDULING.name, jobid))
+    jd.recoverInterrupted()
+    status = jd.jobStatus(jobid)
+    assert status['head_action_status'] == ActionStatus.ACTIVE and status['head_action_id'] != -1
+
+def test_interrupted_initiation_is_reconciled_on_next_pass(spoof):
+    jd = JobData()
+    jd.progressActiveState() #the startup recovery pass
+    jobid = jd.enqueueJob([ TransferToAction("dtn", "/path/to/src", "Perlmutter", "/path/to/sandbox/dest") ])
+    resolve_cached = jd._resolveCachedTransfers
+    def fail(*args):
+        raise Exception("injected failure")
+    jd._resolveCachedTransfers = fail
+    with pytest.raises(Exception, match="injected failure"):
+        jd.startWorkflows()
+    assert jd.jobStatus(jobid)['head_action_status'] == ActionStatus.SCHEDULING
+
+    jd._resolveCachedTransfers = resolve_cached
+    jd.progressActiveState()
+    status = jd.jobStatus(jobid)
+    assert status['head_action_status'] == ActionStatus.ACTIVE and status['head_action_id'] != -1
+
+def cachedWorkflow(xml, i, **kwargs):
+    return [ TransferToAction("dtn", f"/path/to/src/ckpoint_lat.{i}", "Perlmutter", "/path/to/sandbox/config_cache/ens", cached=True, **kwargs), computeAction(xml) ]
+
+def test_second_campaign_uses_cached_configurations(spoof, xml):
+    jd = JobData(config_cache_bytes=10*wm.estimateConfigBytes((8,8,8,16)))
+    for group in ("first", "second"):
+        jd.enqueueJobs([ cachedWorkflow(xml, i) for i in range(4) ], group)
+        runUntilIdle(jd)
+    assert jd.conn.execute("SELECT COUNT(*) FROM transfers WHERE api_key = 'cached'").fetchone()[0] == 4
+
+def test_cached_transfers_require_a_cache_bound(spoof, xml):
+    jd = JobData()
+    with pytest.raises(Exception, match="config_cache_bytes"):
+        jd.enqueueJob(cachedWorkflow(xml, 0))
+    assert jd.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
+
+def test_changed_source_version_is_transferred_again(spoof, xml):
+    jd = JobData(config_cache_bytes=10*wm.estimateConfigBytes((8,8,8,16)))
+    jd.enqueueJob(cachedWorkflow(xml, 0, source_version="100:1700000000"))
+    runUntilIdle(jd)
+    jd.enqueueJob(cachedWorkflow(xml, 0, source_version="100:1700000000")) #unchanged
+    runUntilIdle(jd)
+    jd.enqueueJob(cachedWorkflow(xml, 0, source_version="120:1700050000")) #replaced at the same path
+    runUntilIdle(jd)
+    keys = [ r[0] for r in jd.conn.execute("SELECT api_key FROM transfers ORDER BY job_id").fetchall() ]
+    assert keys[1] == "cached" and keys[2] not in ("cached", keys[0])
+    entry = jd.conn.execute("SELECT status, source_version FROM config_cache").fetchone()
+    assert (entry['status'], entry['source_version']) == (CacheStatus.PRESENT.name, "120:1700050000")
+
+def test_staging_entry_without_its_transfer_is_initiated(spoof, xml):
+    jd = JobData(config_cache_bytes=10*wm.estimateConfigBytes((8,8,8,16)))
+    jobid = jd.enqueueJob(cachedWorkflow(xml, 0))
+    with jd.conn as conn:
+        conn.execute("UPDATE config_cache SET status = ?, api_key = 'lost_transfer'", (CacheStatus.STAGING.name,))
+    jd.startWorkflows()
+    key = jd.conn.execute("SELECT api_key FROM transfers WHERE job_id = ?", (jobid,)).fetchone()[0]
+    assert key not in ("cached", "lost_transfer")
+    runUntilIdle(jd)
+    assert jd.conn.execute("SELECT status FROM config_cache").fetchone()[0] == CacheStatus.PRESENT.name
+
+def test_unstaged_entries_are_discarded_and_invalidated_entries_removed(spoof, monkeypatch):
+    removed = []
+    monkeypatch.setattr(wm, "remoteRm", lambda machine, path: removed.append(path) or False) #removal of files that do not exist fails
+    jd = JobData(config_cache_bytes=100)
+    with jd.conn as conn:
+        conn.executemany("INSERT INTO config_cache(machine, source_endpoint, source_path, cache_path, size_bytes, status, last_used) VALUES (?,?,?,?,?,?,?)",
+                         [ ("Perlmutter", "dtn", f"/src/cfg.{i}", f"/path/to/sandbox/config_cache/cfg.{i}", 100, status.name, i) for i, status in enumerate([CacheStatus.ABSENT, CacheStatus.ABSENT, CacheStatus.PRESENT]) ])
+    jd.evictConfigCache()
+    assert removed == []
+    assert [ r[0] for r in jd.conn.execute("SELECT source_path FROM config_cache").fetchall() ] == [ "/src/cfg.2" ]
+    monkeypatch.setattr(wm, "remoteRm", lambda machine, path: removed.append(path) or True)
+    assert jd.invalidateConfigCache("dtn", "/src/cfg.2") == 1
+    assert removed == [ "/path/to/sandbox/config_cache/cfg.2" ] and jd.conn.execute("SELECT COUNT(*) FROM config_cache").fetchone()[0] == 0
+
+def test_pack_runs_under_a_single_batch_job(spoof, xml):
+    jd = JobData(max_workflows_active=4)
+    jd.enqueueJobs([ [ TransferToAction("dtn", f"/path/to/src/{i}", "Perlmutter", "/path/to/sandbox/dest"), computeAction(xml, pack_key="pack0", pack_size=3) ] for i in range(3) ])
+    runUntilIdle(jd)
+    #All members ran under a single batch job but completed individually
+    assert len(set( r[0] for r in jd.conn.execute("SELECT api_key FROM computes").fetchall() )) == 1
+    assert jd.countWorkflowsWithStatus([ActionStatus.FAILED]) == 0
+
+def test_pack_members_complete_or_fail_from_their_exit_codes(spoof, xml, monkeypatch):
+    jd = JobData(max_workflows_active=4)
+    first, last = jd.enqueueJobs([ [ computeAction(xml, pack_key="pack0", pack_size=3) ] for i in range(3) ])
+    monkeypatch.setattr(wm, "downloadFile", lambda machine, path: "1\n" if path == f"/path/to/sandbox/{first+1}/exit_code" else "0\n")
+    runUntilIdle(jd)
+    assert jd.jobStatus(first+1)['head_action_status'] == ActionStatus.FAILED
+    assert jd.jobStatus(first)['head_action_class'] == ActionClass.NONE and jd.jobStatus(last)['head_action_class'] == ActionClass.NONE
+
+@pytest.mark.parametrize("time, pack_time", [ ("300", "900"), ("05:00", "00:15:00"), ("01:30:00", "04:30:00") ])
+def test_sequential_pack_time_scales_the_walltime(spoof, xml, monkeypatch, time, pack_time):
+    import femtomeas.workflow_manager.hadrons as hadrons
+    submitted = {}
+    monkeypatch.setattr(hadrons, "executeBatchJobCompat", lambda machine, body, **kwargs: submitted.update(kwargs) or "1")
+    members = [ (i, f"/path/to/sandbox/{i}", xml.toBytes()) for i in range(3) ]
+    hadrons.submitHadronsPack("Perlmutter", members, "/path/to/sandbox/pack0", "amsc013_g", "debug", time, (8,8,8,16), (1,1,1,2))
+    assert submitted['time'] == pack_time
+
+def test_placement_spreads_workflows_over_machines(spoof, xml, monkeypatch):
+    import femtomeas.workflow_manager.globals as globals
+    from femtomeas.workflow_manager.hadrons import setHadronsInfo
+    monkeypatch.setitem(globals.remote_workdir, "Aurora", "/path/to/aurora/sandbox")
+    setHadronsInfo({ "Perlmutter" : { "bin" : "/path/to/bin" }, "Aurora" : { "bin" : "/path/to/bin", "template" : "perlmutter" } })
+    jd = JobData(placement=wm.PlacementPolicy({ "Perlmutter" : { "account" : "amsc013_g" }, "Aurora" : { "account" : "amsc013", "queue" : "prod" } }))
+    spec = HadronsJobSpec("<SANDBOX>/<JOBID>", xml, grid=(8,8,8,16))
+    first, last = jd.enqueueJobs([ [ TransferToAction("dtn", f"/path/to/src/{i}", wm.ANY_MACHINE, "<SANDBOX>/dest"),
+                                     HadronsComputeAction(machine=wm.ANY_MACHINE, account="amsc013_g", queue="debug", time="300", spec=spec, mpi=(1,1,1,2)) ] for i in range(2) ])
+    jd.startWorkflows()
+    workflows = [ jd.getWorkflow(j) for j in (first, last) ]
+    assert set( w[1].machine for w in workflows ) == { "Perlmutter", "Aurora" }
+    assert all( w[0].machine == w[1].machine and w[1].account == ("amsc013" if w[1].machine == "Aurora" else "amsc013_g") for w in workflows )
+
+def test_status_query_records_the_start_time(spoof, xml):
+    jd = JobData()
+    jobid = jd.enqueueJob([ computeAction(xml) ])
+    jd.startWorkflows()
+    action_id = jd.jobStatus(jobid)['head_action_id']
+    with jd.conn as conn:
+        conn.execute("UPDATE computes SET started_at = NULL, api_status = 'queued'")
+    assert jd.action_man[ActionClass.COMPUTE].queryStatus(action_id, force_update=True) == (ActionStatus.ACTIVE, "active")
+    assert jd.conn.execute("SELECT started_at FROM computes WHERE action_id = ?", (action_id,)).fetchone()[0] != None
+
+hadrons_log = "Grid : Message : 1.0 s : start\nHadrons : Message : 5.0 s : ---------------- Measurement step 1/1 (module 'prop') ----------------\nGrid : Message : 600.0 s : done\n"
+
+def test_performance_model_sizes_a_job_from_a_recorded_run(xml):
+    from femtomeas.workflow_manager.perf_model import PerfModel, workloadKey
+    pm = PerfModel(None)
+    pm.recordRun("Perlmutter", xml.toBytes(), (8,8,8,16), (1,1,1,4), hadrons_log)
+    action, solver = workloadKey(xml.toBytes())
+    assert pm.predict("Perlmutter", (8,8,8,16), action, solver, 4) == 600.
+    rec = pm.recommend("Perlmutter", (8,8,8,16), action, solver)
+    assert rec["nodes"] == 1 and rec["walltime_seconds"] >= 600
+
+def test_run_times_are_recorded_in_the_process_wide_model_by_default(spoof, xml, monkeypatch):
+    from femtomeas.workflow_manager.perf_model import getPerfModel, workloadKey
+    monkeypatch.setattr(wm, "downloadFile", lambda machine, path: hadrons_log)
+    jd = JobData()
+    jd.enqueueJob([ computeAction(xml, mpi=(1,1,1,4)) ])
+    runUntilIdle(jd)
+    jd.waitForPerformanceRecords()
+    action, solver = workloadKey(xml.toBytes())
+    assert getPerfModel().predict("Perlmutter", (8,8,8,16), action, solver, 4) == 600.
+
+def test_run_times_are_not_recorded_when_disabled(spoof, xml, monkeypatch):
+    from femtomeas.workflow_manager.perf_model import getPerfModel, workloadKey
+    downloads = []
+    monkeypatch.setattr(wm, "downloadFile", lambda machine, path: downloads.append(path) or hadrons_log)
+    jd = JobData(record_performance=False)
+    jd.enqueueJob([ computeAction(xml, mpi=(1,1,1,4)) ])
+    runUntilIdle(jd)
+    jd.waitForPerformanceRecords()
+    action, solver = workloadKey(xml.toBytes())
+    assert downloads == [] and getPerfModel().predict("Perlmutter", (8,8,8,16), action, solver, 4) == None
+
+def test_workflows_on_a_down_machine_wait_until_it_returns(spoof, xml):
+    from femtomeas.workflow_manager.machine_health import MachineHealth
+    up = { "Perlmutter" : False }
+    jd = JobData(machine_health=MachineHealth(query=lambda m: up[m], down_ttl=1))
+    jd.health.markDown("Perlmutter")
+    jobid = jd.enqueueJob([ TransferToAction("dtn", "/path/to/src", "Perlmutter", "/path/to/sandbox/dest"), computeAction(xml) ])
+    jd.startWorkflows()
+    assert jd.jobStatus(jobid)['workflow_stage'] == -1
+    up["Perlmutter"] = True
+    time.sleep(1.5)
+    jd.progressActiveState()
+    jd.startWorkflows()
+    assert jd.jobStatus(jobid)['workflow_stage'] == 0
+
+def test_timed_out_compute_is_retried_with_a_longer_walltime(spoof, xml, monkeypatch):
+    from femtomeas.workflow_manager.retry_policy import RetryPolicy
+    failed = [] #the first job fails
+    def getJobStates(machine, jobids):
+        out = spoof.getJobStates(machine, jobids)
+        for jobid in jobids:
+            if len(failed) == 0 or failed[0] == jobid:
+                failed.append(jobid)
+                out[jobid] = "failed"
+        return out
+    times = []
+    def submitHadronsJob(machine, xml_bytes, rundir, account, queue, walltime, *args, **kwargs):
+        times.append(walltime)
+        return spoof.executeBatchJobCompat(machine, "", 1, 4, 1, walltime, queue, account, rundir)
+    monkeypatch.setattr(wm, "getJobStates", getJobStates)
+    monkeypatch.setattr(wm, "getJobState", lambda machine, jobid: getJobStates(machine, [jobid])[jobid])
+    monkeypatch.setattr(wm, "downloadFile", lambda machine, path: "*** JOB 1 CANCELLED DUE TO TIME LIMIT ***" if path.endswith("run.log") else "")
+    monkeypatch.setattr(wm, "submitHadronsJob", submitHadronsJob)
+    jd = JobData(retry={ ActionClass.COMPUTE : RetryPolicy(backoff=0, walltime_factor=2) })
+    jobid = jd.enqueueJob([ computeAction(xml) ])
+    t0 = time.time()
+    while jd.countWorkflowsWithStatus([ActionStatus.PENDING, ActionStatus.ACTIVE, ActionStatus.COMPLETED]) + jd.countPendingRetries() > 0:
+        assert time.time() - t0 < 60
+        jd.startWorkflows()
+        jd.progressActiveState(poll_freq=0)
+        time.sleep(0.2)
+    assert times == [ "300", "600" ]
+    assert jd.jobStatus(jobid)['head_action_class'] == ActionClass.NONE
+
+def test_failure_without_a_policy_ends_the_workflow(spoof, xml, monkeypatch):
+    from femtomeas.workflow_manager.retry_policy import RetryPolicy
+    monkeypatch.setattr(wm, "getJobStates", lambda machine, jobids: { jobid : "failed" for jobid in jobids })
+    monkeypatch.setattr(wm, "getJobState", lambda machine, jobid: "failed")
+    monkeypatch.setattr(wm, "downloadFile", lambda machine, path: "NODE_FAIL")
+    jd = JobData(retry={ ActionClass.TRANSFER : RetryPolicy() })
+    jobid = jd.enqueueJob([ computeAction(xml) ])
+    runUntilIdle(jd)
+    row = jd.conn.execute("SELECT head_action_status, failure_cause, retry_at FROM jobs WHERE job_id = ?", (jobid,)).fetchone()
+    assert tuple(row) == (ActionStatus.FAILED.name, "node_failure", None) and jd.countPendingRetries() == 0
+
+def enqueueTransfers(jd, group, n):
+    return [ jd.enqueueJob([ TransferToAction("dtn", f"/path/to/src{i}", "Perlmutter", "/path/to/sandbox/dest") ], group) for i in range(n) ]
+
+def startedCount(jd, jobids):
+    return sum( jd.jobStatus(j)['workflow_stage'] == 0 for j in jobids )
+
+def test_higher_priority_group_starts_ahead_of_an_earlier_group(spoof):
+    jd = JobData(max_workflows_active=3)
+    big = enqueueTransfers(jd, "big", 6)
+    urgent = enqueueTransfers(jd, "urgent", 2)
+    jd.setJobGroup("urgent", priority=1)
+    jd.startWorkflows()
+    assert startedCount(jd, urgent) == 2 and startedCount(jd, big) == 1
+    groups = { g['job_group'] : g for g in jd.getJobGroups() }
+    assert groups['urgent']['priority'] == 1 and groups['big']['pending'] == 5
+
+def test_groups_share_slots_by_weight(spoof):
+    jd = JobData(max_workflows_active=4)
+    heavy = enqueueTransfers(jd, "heavy", 6)
+    light = enqueueTransfers(jd, "light", 6)
+    jd.setJobGroup("heavy", weight=3)
+    jd.startWorkflows()
+    assert startedCount(jd, heavy) == 3 and startedCount(jd, light) == 1
+
+def test_earliest_deadline_starts_first(spoof):
+    jd = JobData(max_workflows_active=2)
+    late = enqueueTransfers(jd, "late", 2)
+    soon = enqueueTransfers(jd, "soon", 2)
+    jd.setJobGroup("late", deadline=time.time() + 7200)
+    jd.setJobGroup("soon", deadline=time.time() + 3600)
+    jd.startWorkflows()
+    assert startedCount(jd, soon) == 2 and startedCount(jd, late) == 0
+
+def test_unset_group_parameters_are_left_unchanged(spoof):
+    jd = JobData()
+    jd.setJobGroup("g", priority=2, weight=0.5)
+    jd.setJobGroup("g", deadline=time.time() + 3600)
+    group = [ g for g in jd.getJobGroups() if g['job_group'] == "g" ][0]
+    assert (group['priority'], group['weight']) == (2, 0.5) and group['deadline'] != None
+    with pytest.raises(Exception):
+        jd.setJobGroup("g", weight=0)
+
+def test_workflows_are_stored_in_the_typed_schema(spoof, xml):
+    jd = JobData()
+    spec = HadronsJobSpec("/path/to/sandbox/jobdir", xml, grid=(8,8,8,16))
+    t1 = TransferToAction("dtn", "/path/to/src", "Perlmutter", "/path/to/sandbox/dest")
+    t2 = HadronsComputeAction(machine="Perlmutter", account="amsc013_g", queue="debug", time="300", spec=spec, mpi=(1,1,1,2))
+    jobid1 = jd.enqueueJob([t1,t2])
+    jobid2 = jd.enqueueJob([t1,t2])
+    wf = jd.getWorkflow(jobid1)
+    assert wf[0] == t1
+    assert wf[1].mpi == t2.mpi and wf[1].spec.grid == spec.grid and wf[1].spec.xml_spec == spec.xml_spec
+    #The XML is stored only once
+    assert jd.conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 1
+    #Bulk enqueue assigns a contiguous range of job ids
+    first, last = jd.enqueueJobs([ [t1,t2] for i in range(10) ], "bulk")
+    assert (first, last) == (jobid2+1, jobid2+10)
+    assert jd.getWorkflow(last)[0] == t1
+
+def test_database_is_reopened_with_its_workflows(spoof, xml, tmp_path):
+    jd = JobData(str(tmp_path / "jobs.db"))
+    jobid = jd.enqueueJob([ TransferToAction("dtn", "/path/to/src", "Perlmutter", "/path/to/sandbox/dest"), computeAction(xml) ], "g")
+    jd.conn.close()
+    jd = JobData(str(tmp_path / "jobs.db"))
+    wf = jd.getWorkflow(jobid)
+    assert wf[0].source_path == "/path/to/src" and wf[1].spec.grid == (8,8,8,16)
+    assert jd.jobStatus(jobid)['head_action_status'] == ActionStatus.PENDING
+
+def test_pipeline_stages_ahead_of_compute_within_its_budgets(spoof, xml):
+    grid = (8,8,8,16)
+    jd = JobData(pipeline=wm.PipelinePolicy(max_transfers_active=3, max_computes_active=2, scratch_bytes=5*wm.estimateConfigBytes(grid)))
+    jd.enqueueJobs([ [ TransferToAction("dtn", f"/path/to/src/{i}", "Perlmutter", "/path/to/sandbox/dest"), computeAction(xml),
+                       TransferFromAction("Perlmutter", "/path/to/sandbox/<JOBID>", "dtn", "/path/to/dest") ] for i in range(10) ])
+    t0 = time.time()
+    while jd.countWorkflowsWithStatus([ActionStatus.PENDING, ActionStatus.ACTIVE, ActionStatus.COMPLETED, ActionStatus.HELD]) > 0:
+        assert time.time() - t0 < 60
+        jd.startWorkflows()
+        jd.progressActiveState(poll_freq=0)
+        computes = jd.conn.execute("SELECT COUNT(DISTINCT api_key) FROM computes WHERE action_status = 'ACTIVE'").fetchone()[0]
+        started = jd.conn.execute("SELECT COUNT(*) FROM jobs WHERE workflow_stage >= 0 AND head_action_class != 'NONE'").fetchone()[0]
+        assert computes <= 2 and started <= 5
+        time.sleep(0.2)
+    assert jd.countWorkflowsWithStatus([ActionStatus.FAILED]) == 0
+
+def test_computes_on_a_machine_are_polled_with_one_bulk_query(spoof, xml, monkeypatch):
+    queries = []
+    monkeypatch.setattr(wm, "getJobStates", lambda machine, jobids: queries.append(sorted(jobids)) or spoof.getJobStates(machine, jobids))
+    jd = JobData()
+    jd.enqueueJobs([ [ computeAction(xml) ] for i in range(3) ])
+    jd.startWorkflows()
+    jd.progressActiveActions(force_poll=True)
+    assert len(queries) == 1 and len(queries[0]) == 3
+
+def test_failed_status_query_keeps_the_last_known_status(spoof, xml, monkeypatch):
+    def fail(machine, jobids):
+        raise Exception("status endpoint unavailable")
+    monkeypatch.setattr(wm, "getJobStates", fail)
+    jd = JobData()
+    jobid = jd.enqueueJob([ computeAction(xml) ])
+    jd.startWorkflows()
+    time.sleep(1.1)
+    jd.progressActiveActions(force_poll=True)
+    assert jd.jobStatus(jobid)['head_action_status'] == ActionStatus.ACTIVE
+    monkeypatch.setattr(wm, "getJobStates", spoof.getJobStates)
+    jd.progressActiveActions(force_poll=True)
+    assert jd.jobStatus(jobid)['head_action_status'] == ActionStatus.COMPLETED
+
+def test_actions_are_initiated_concurrently(spoof, monkeypatch):
+    def globusCopyToMachine(*args):
+        time.sleep(0.3)
+        return spoof.globusCopyToMachine(*args)
+    monkeypatch.setattr(wm, "globusCopyToMachine", globusCopyToMachine)
+    jd = JobData(max_initiate_workers=4)
+    jobids = enqueueTransfers(jd, None, 4)
+    t0 = time.time()
+    jd.startWorkflows()
+    assert time.time() - t0 < 0.9
+    assert all( jd.jobStatus(j)['head_action_status'] == ActionStatus.ACTIVE for j in jobids )
+
+def test_failed_initiation_fails_only_its_job(spoof, monkeypatch):
+    def globusCopyToMachine(machine, dest_path, source_endpoint, source_path):
+        if source_path == "/path/to/src1":
+            raise Exception("transfer rejected")
+        return spoof.globusCopyToMachine(machine, dest_path, source_endpoint, source_path)
+    monkeypatch.setattr(wm, "globusCopyToMachine", globusCopyToMachine)
+    jd = JobData()
+    jobids = enqueueTransfers(jd, None, 3)
+    jd.startWorkflows()
+    assert [ jd.jobStatus(j)['head_action_status'] for j in jobids ] == [ ActionStatus.ACTIVE, ActionStatus.FAILED, ActionStatus.ACTIVE ]
+
+def test_immediate_work_and_poll_schedule(spoof):
+    jd = JobData(max_workflows_active=1)
+    enqueueTransfers(jd, None, 2)
+    assert jd.hasImmediateWork() #pending workflows and a free slot
+    jd.startWorkflows()
+    assert not jd.hasImmediateWork() #the slot is taken
+    schedule = jd.getPollSchedule(poll_freq=30)
+    assert len(schedule) == 1 and schedule[0][1] == ActionClass.TRANSFER and time.time() < schedule[0][0] <= time.time() + 31
+    assert not JobData(max_workflows_active=0).hasImmediateWork()
+
+def test_manager_reacts_to_a_notification_without_waiting_for_the_poll(spoof):
+    jman = JobManager(poll_freq=60)
+    jman.start()
+    try:
+        time.sleep(0.2)
+        assert jman.nextCheckDue() == None #idle until notified
+        jobid = jman(lambda jd: jd.enqueueJob([ TransferToAction("dtn", "/path/to/src", "Perlmutter", "/path/to/sandbox/dest") ]))
+        t0 = time.time()
+        while jman(lambda jd: jd.jobStatus(jobid))['head_action_status'] != ActionStatus.ACTIVE:
+            assert time.time() - t0 < 2
+            time.sleep(0.05)
+        assert jman.nextCheckDue() > time.time() + 30 #the next poll follows poll_freq
+    finally:
+        jman.stop(wait_until_done=False)
+    assert not jman.isAlive()
+
+def uploadedFiles(monkeypatch):
+    """Record the contents of the files uploaded for Hadrons jobs, by remote path, and forbid local temporary files"""
+    uploaded = {}
+    monkeypatch.setattr(hadrons, "uploadBytes", lambda machine, path, buf: uploaded.__setitem__(path, buf.getvalue()))
+    monkeypatch.setattr(hadrons, "uploadSmallFile", lambda *args: pytest.fail("uploaded from a local file"))
+    monkeypatch.setattr(tempfile, "mkstemp", lambda *args, **kwargs: pytest.fail("created a temporary file"))
+    return uploaded
+
+def withEigenPack(xml, filestem):
+    """A copy of the XML with an eigenvector loading module reading from the given file stem"""
+    out = HadronsXML()
+    out.fromBytes(xml.toBytes())
+    opt = out.addModule("eig", "MIO::LoadFermionEigenPack")
+    HadronsXML.setValues(opt, [ ("filestem", filestem), ("multiFile", "false"), ("size", 100), ("Ls", 12) ])
+    return out
+
+def test_run_xml_is_uploaded_from_memory(spoof, monkeypatch, tmp_path, xml):
+    uploaded = uploadedFiles(monkeypatch)
+    a = computeAction(xml)
+    a.initiateAction(7)
+    #The file formerly written by writeXML and uploaded from disk
+    a.spec.writeXML(str(tmp_path / "run.xml"))
+    assert uploaded["/path/to/sandbox/7/run.xml"] == (tmp_path / "run.xml").read_bytes()
+    assert "/path/to/sandbox/7/batch_script.sh" in uploaded
+
+def test_sandbox_placeholder_is_replaced_in_the_uploaded_xml(spoof, monkeypatch, tmp_path, xml):
+    uploaded = uploadedFiles(monkeypatch)
+    a = computeAction(withEigenPack(xml, "<SANDBOX>/eig/vec"))
+    a.initiateAction(7)
+    HadronsJobSpec("/path/to/sandbox/<JOBID>", withEigenPack(xml, "/path/to/sandbox/eig/vec"), grid=(8,8,8,16)).writeXML(str(tmp_path / "run.xml"))
+    assert uploaded["/path/to/sandbox/7/run.xml"] == (tmp_path / "run.xml").read_bytes()
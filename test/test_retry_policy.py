@@ -0,0 +1,24 @@
+import pytest
+from femtomeas.workflow_manager.retry_policy import RetryPolicy, classifyFailure, scaleWalltime
+
+@pytest.mark.parametrize("log, api_status, cause", [
+    ("slurmstepd: error: *** JOB 1234 ON nid001 CANCELLED AT 2024-01-01T00:00:00 DUE TO TIME LIMIT ***", None, "timeout"),
+    ("srun: error: nid001: task 3: Killed\nNODE_FAIL", None, "node_failure"),
+    ("Hadrons : Error : 12.3 s : could not find module", None, "input"),
+    ("CUDA error: cudaErrorMemoryAllocation", "failed", "memory"),
+    ("", "canceled", "cancelled"),
+    ("", "failed", "unknown") ])
+def test_classify_failure(log, api_status, cause):
+    assert classifyFailure(log, api_status) == cause
+
+@pytest.mark.parametrize("walltime, factor, max_walltime, scaled", [
+    ("3600", 1.5, None, "5400"), ("300", 2, "500", "500"), ("01:00:00", 1.5, None, "01:30:00"),
+    ("01:00:00", 2, "01:30:00", "01:30:00"), ("05:00", 3, None, "00:15:00"), (" 90 ", 1, None, "90") ])
+def test_scale_walltime_preserves_the_format(walltime, factor, max_walltime, scaled):
+    assert scaleWalltime(walltime, factor, max_walltime) == scaled
+
+def test_retries_by_cause_and_attempts():
+    policy = RetryPolicy(max_attempts=3, backoff=10., backoff_factor=2.)
+    assert policy.retries("timeout", 1) and policy.retries("timeout", 2) and not policy.retries("timeout", 3)
+    assert not policy.retries("memory", 1) and not policy.retries("input", 1)
+    assert [ policy.delay(n) for n in (1, 2, 3) ] == [ 10., 20., 40. ]
@@ -0,0 +1,96 @@
+import threading
+import time
+from femtomeas.workflow_manager.token_manager import ManagedToken
+
+def refresher(tokens, calls):
+    """A refresh function handing out the given token data in turn and recording the token data it was called with"""
+    def refresh(auth_data):
+        calls.append(auth_data)
+        r = tokens[len(calls) - 1]
+        if isinstance(r, Exception):
+            raise r
+        return r
+    return refresh
+
+def test_valid_token_is_not_refreshed():
+    calls = []
+    tok = ManagedToken("test", { "access_token" : "a", "expires_at_seconds" : time.time() + 3600 }, refresher([], calls))
+    assert tok.current() == "a"
+    assert calls == []
+
+def test_expired_token_is_refreshed_on_use():
+    calls = []
+    stored = []
+    tok = ManagedToken("test", { "access_token" : "a", "refresh_token" : "r", "expires_at_seconds" : time.time() - 1 },
+                       refresher([ { "access_token" : "b", "expires_at_seconds" : time.time() + 3600 } ], calls), on_refresh=stored.append)
+    assert tok.current() == "b"
+    assert tok.current() == "b"
+    assert len(calls) == 1 and calls[0]["refresh_token"] == "r"
+    assert stored == [ tok._auth ] and stored[0]["refresh_token"] == "r" #unrotated refresh token is retained
+
+def test_authlib_expiry_field():
+    tok = ManagedToken("test", { "access_token" : "a", "expires_at" : 1234 }, refresher([], []))
+    assert tok.expiresAt() == 1234.
+    assert ManagedToken("test", { "access_token" : "a" }, refresher([], [])).expiresAt() == None
+
+def test_renew_of_a_replaced_token_does_not_refresh_again():
+    calls = []
+    tok = ManagedToken("test", { "access_token" : "a" }, refresher([ { "access_token" : "b" }, { "access_token" : "c" } ], calls))
+    assert tok.renew("a") == "b"
+    assert tok.renew("a") == "b"
+    assert len(calls) == 1
+    assert tok.renew("b") == "c"
+
+def test_concurrent_renewals_refresh_once():
+    calls = []
+    def refresh(auth_data):
+        calls.append(auth_data)
+        time.sleep(0.05)
+        return { "access_token" : "b" }
+    tok = ManagedToken("test", { "access_token" : "a" }, refresh)
+    results = []
+    threads = [ threading.Thread(target=lambda: results.append(tok.renew("a"))) for i in range(8) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [ "b" ] * 8
+    assert len(calls) == 1
+
+def test_failed_refresh_keeps_the_current_token():
+    calls = []
+    stored = []
+    tok = ManagedToken("test", { "access_token" : "a" }, refresher([ None, Exception("refused"), { "access_token" : "b" } ], calls), on_refresh=stored.append)
+    assert tok.renew("a") == "a"
+    assert tok.renew("a") == "a"
+    assert stored == []
+    assert tok.renew("a") == "b"
+    assert len(calls) == 3
+
+def test_failure_to_store_the_refreshed_token_is_not_fatal():
+    def on_refresh(auth_data):
+        raise Exception("read-only file system")
+    tok = ManagedToken("test", { "access_token" : "a" }, refresher([ { "access_token" : "b" } ], []), on_refresh=on_refresh)
+    assert tok.renew("a") == "b"
+    assert tok.current() == "b"
+
+def test_background_refresh_ahead_of_expiry():
+    calls = []
+    refreshed = threading.Event()
+    tok = ManagedToken("test", { "access_token" : "a", "expires_at_seconds" : time.time() + 100 },
+                       refresher([ { "access_token" : "b", "expires_at_seconds" : time.time() + 3600 } ], calls),
+                       on_refresh=lambda auth_data: refreshed.set(), margin=300)
+    tok.start()
+    try:
+        assert refreshed.wait(5)
+    finally:
+        tok.stop()
+    assert tok.current() == "b"
+    assert len(calls) == 1
+
+def test_background_thread_exits_without_an_expiry():
+    tok = ManagedToken("test", { "access_token" : "a" }, refresher([], []))
+    tok.start()
+    tok._thread.join(5)
+    assert not tok._thread.is_alive()
+    tok.stop()
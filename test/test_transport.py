@@ -0,0 +1,78 @@
+import httpx
+import pytest
+import femtomeas.workflow_manager.transport as transport
+from femtomeas.workflow_manager.transport import Transport, retryAfter
+
+def mockTransport(monkeypatch, responses, **kwargs):
+    """
+    A Transport whose requests are answered in turn by the given responses (status code, headers) or exceptions. Sleeps are recorded rather than taken
+    Return: the transport, the list of requests made and the list of delays slept
+    """
+    requests = []
+    delays = []
+    def handler(request):
+        requests.append(request)
+        r = responses[min(len(requests), len(responses)) - 1]
+        if isinstance(r, Exception):
+            raise r
+        status, headers = r
+        return httpx.Response(status, headers=headers)
+    t = Transport(http2=False, **kwargs)
+    t.client = httpx.Client(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(transport.time, "sleep", lambda s: delays.append(s))
+    return t, requests, delays
+
+@pytest.mark.parametrize("method, status, attempts", [ ("GET", 502, 3), ("GET", 503, 3), ("GET", 504, 3), ("GET", 500, 1), ("PUT", 503, 3), ("DELETE", 504, 3),
+                                                       ("POST", 502, 1), ("POST", 503, 1), ("POST", 504, 1), ("POST", 429, 3), ("GET", 429, 3) ])
+def test_retry_by_status_and_method(monkeypatch, method, status, attempts):
+    t, requests, delays = mockTransport(monkeypatch, [ (status, {}) ], max_attempts=3)
+    assert t.request(method, "https://api/x").status_code == status
+    assert len(requests) == attempts and len(delays) == attempts - 1
+
+def test_post_503_with_retry_after_is_retried_after_the_delay(monkeypatch):
+    t, requests, delays = mockTransport(monkeypatch, [ (503, { "Retry-After" : "7" }), (200, {}) ])
+    assert t.post("https://api/x").status_code == 200
+    assert len(requests) == 2 and delays == [ 7. ]
+
+def test_retry_after_beyond_the_limit_returns_the_response(monkeypatch):
+    t, requests, delays = mockTransport(monkeypatch, [ (429, { "Retry-After" : "600" }), (200, {}) ], max_retry_after=300.)
+    assert t.post("https://api/x").status_code == 429
+    assert len(requests) == 1 and delays == []
+
+def test_backoff_is_bounded(monkeypatch):
+    t, requests, delays = mockTransport(monkeypatch, [ (503, {}) ], max_attempts=6, backoff_base=1., backoff_max=4.)
+    t.get("https://api/x")
+    assert len(delays) == 5 and all( 0 <= d <= min(4., 2**n) for n, d in enumerate(delays) )
+
+def test_connection_failure_is_retried_for_any_method(monkeypatch):
+    t, requests, delays = mockTransport(monkeypatch, [ httpx.ConnectError("refused"), (200, {}) ])
+    assert t.post("https://api/x").status_code == 200
+    assert len(requests) == 2
+
+def test_failure_after_sending_is_retried_only_if_idempotent(monkeypatch):
+    t, requests, delays = mockTransport(monkeypatch, [ httpx.ReadTimeout("timed out"), (200, {}) ])
+    with pytest.raises(httpx.ReadTimeout):
+        t.post("https://api/x")
+    assert len(requests) == 1
+    t, requests, delays = mockTransport(monkeypatch, [ httpx.ReadTimeout("timed out"), (200, {}) ])
+    assert t.get("https://api/x").status_code == 200
+    assert len(requests) == 2
+
+def test_unauthorized_request_is_retried_once_with_a_renewed_token(monkeypatch):
+    class Token:
+        def __init__(self):
+            self.value = "old"
+        def current(self):
+            return self.value
+        def renew(self, stale):
+            self.value = "new"
+            return self.value
+    t, requests, delays = mockTransport(monkeypatch, [ (401, {}), (200, {}) ])
+    assert t.post("https://api/x", token=Token()).status_code == 200
+    assert [ r.headers["Authorization"] for r in requests ] == [ "Bearer old", "Bearer new" ]
+
+def test_retry_after_parsing():
+    assert retryAfter(httpx.Response(429, headers={ "Retry-After" : "12" })) == 12.
+    assert retryAfter(httpx.Response(429, headers={ "Retry-After" : "Wed, 21 Oct 2015 07:28:00 GMT" })) == 0.
+    assert retryAfter(httpx.Response(429, headers={ "Retry-After" : "soon" })) == None
+    assert retryAfter(httpx.Response(429)) == None